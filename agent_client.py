@@ -0,0 +1,146 @@
+import json
+import os
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from conversation import IssueLog
+
+load_dotenv()
+
+
+class RemoteResponseStream:
+    """Iterate for answer tokens from /v1/respond/stream.
+
+    After iteration .answer, .metadata and .diagnostics are set, like
+    gpt_agent.ResponseStream, and memory (if given) holds the conversation
+    the service sent back.
+    """
+
+    def __init__(self, response, memory=None):
+        self.response = response
+        self.memory = memory
+        self.answer = None
+        self.metadata = None
+        self.diagnostics = {}
+
+    def __iter__(self):
+        with self.response:
+            for line in self.response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "token" in event:
+                    yield event["token"]
+                if event.get("done"):
+                    if event.get("error"):
+                        raise RuntimeError(event["error"])
+                    self.answer = event["answer"]
+                    self.metadata = event["metadata"]
+                    self.diagnostics = event.get("diagnostics") or {}
+                    if self.memory is not None and "memory" in event:
+                        self.memory.load(event["memory"])
+                    return
+
+
+class AgentClient:
+    """Thin client for agent_service over one pooled keep-alive session."""
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or os.getenv("SNGPT_AGENT_URL", "")).rstrip("/")
+        self.timeout = timeout or float(os.getenv("SNGPT_AGENT_CLIENT_TIMEOUT", "130"))
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {os.getenv('SNGPT_AGENT_TOKEN', '')}"
+        adapter = HTTPAdapter(pool_maxsize=int(os.getenv("SNGPT_AGENT_POOL_SIZE", "10")))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _call(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def user_context(self, user_id):
+        return self._call("GET", f"/v1/users/{quote(user_id, safe='')}/context").json()
+
+    def respond(self, user_id, question, issue_log=None, confirm_ticket=False, memory=None):
+        """{answer, metadata, diagnostics}; the service keeps the issue log itself.
+
+        A ConversationMemory is sent along and replaced with the one the
+        service returns, the new turn included.
+        """
+        result = self._call("POST", "/v1/respond", json={
+            "user_id": user_id, "question": question, "confirm_ticket": confirm_ticket,
+            "memory": memory.to_dict() if memory is not None else None
+        }).json()
+        if memory is not None and "memory" in result:
+            memory.load(result.pop("memory"))
+        return result
+
+    def respond_stream(self, user_id, question, issue_log=None, confirm_ticket=False, memory=None):
+        return RemoteResponseStream(self._call("POST", "/v1/respond/stream", stream=True, json={
+            "user_id": user_id, "question": question, "confirm_ticket": confirm_ticket,
+            "memory": memory.to_dict() if memory is not None else None
+        }), memory)
+
+    def create_ticket(self, user_id, issue, intent_metadata, confirm_data=None):
+        return self._call("POST", "/v1/tickets", json={
+            "user_id": user_id, "issue": issue, "intent_metadata": intent_metadata, "confirm_data": confirm_data
+        }).json()
+
+    def find_duplicates(self, issue):
+        return self._call("POST", "/v1/tickets/duplicates", json={"issue": issue}).json()["duplicates"]
+
+    def reset_password(self, user_id, phone):
+        """{"verified": bool, "password": new password or None}."""
+        return self._call("POST", "/v1/password-reset", json={"user_id": user_id, "phone": phone}).json()
+
+    def search_kb(self, query):
+        return self._call("GET", "/v1/kb/search", params={"q": query}).json()["articles"]
+
+
+class LocalAgent:
+    """Same interface as AgentClient, running the agent in this process."""
+
+    def __init__(self):
+        import gpt_agent
+        from data_snapshot import get_servicenow_data
+        from telemetry import serve_metrics
+        self.agent = gpt_agent
+        if os.getenv("SNGPT_METRICS_PORT"):
+            # agent_service has /metrics; in-process agents can expose theirs here
+            serve_metrics(int(os.getenv("SNGPT_METRICS_PORT")))
+        # Loaded once per process and shared by every session
+        get_servicenow_data()
+
+    def user_context(self, user_id):
+        return self.agent.get_user_context(user_id)
+
+    def respond(self, user_id, question, issue_log=None, confirm_ticket=False, memory=None):
+        return self.agent.answer_question(user_id, question, issue_log if issue_log is not None else IssueLog(),
+                                          confirm_ticket=confirm_ticket, memory=memory)
+
+    def respond_stream(self, user_id, question, issue_log=None, confirm_ticket=False, memory=None):
+        return self.agent.answer_question_stream(user_id, question,
+                                                 issue_log if issue_log is not None else IssueLog(),
+                                                 confirm_ticket=confirm_ticket, memory=memory)
+
+    def create_ticket(self, user_id, issue, intent_metadata, confirm_data=None):
+        return self.agent.create_ticket_from_intent(user_id, issue, intent_metadata, confirm_data=confirm_data)
+
+    def find_duplicates(self, issue):
+        return self.agent.find_duplicate_tickets(issue)
+
+    def reset_password(self, user_id, phone):
+        return self.agent.reset_password_if_verified(user_id, phone)
+
+    def search_kb(self, query):
+        return self.agent.query_kb_articles(query=query)
+
+
+def get_agent():
+    """AgentClient when SNGPT_AGENT_URL is set, otherwise the in-process agent."""
+    if os.getenv("SNGPT_AGENT_URL"):
+        return AgentClient()
+    return LocalAgent()
@@ -0,0 +1,292 @@
+"""Headless HTTP service for the IT support agent.
+
+    python agent_service.py [--host 0.0.0.0] [--port 8700]
+
+Exposes answering, ticket creation, duplicate lookup, password reset and KB
+search as JSON endpoints so the Streamlit app (or any other channel) can be a
+thin client; set SNGPT_AGENT_URL in the app to use it. Agent work runs on a
+bounded worker pool (SNGPT_AGENT_WORKERS threads, SNGPT_AGENT_QUEUE waiting
+jobs); beyond that requests get 503 with Retry-After instead of piling up.
+Instances hold no per-request state beyond caches, so they can be scaled out
+behind a load balancer: a client's conversation (conversation.ConversationMemory)
+comes with each request and goes back with the answer.
+
+Every /v1 endpoint requires "Authorization: Bearer $SNGPT_AGENT_TOKEN"; the
+service won't start without a token. Callers holding it are trusted to pass
+the user_id of a user they have signed in. /healthz and /metrics are open for
+probes and scrapers. Password resets are limited per user by the agent
+(gpt_agent.reset_lockout), whichever client calls. GET /metrics serves Prometheus metrics; logs are JSON
+lines (see telemetry.configure_logging).
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import Flask, Response, jsonify, request
+from dotenv import load_dotenv
+from servicenow_api import get_user_context, query_kb_articles, replica_stats
+from data_snapshot import get_servicenow_data, snapshot_stats
+from answer_cache import answer_cache
+from user_cache import user_cache
+from resilience import servicenow as servicenow_backend, openai_backend
+from telemetry import configure_logging, registry
+from conversation import ConversationMemory, IssueLog
+from gpt_agent import (answer_question, answer_question_stream, create_ticket_from_intent,
+                       find_duplicate_tickets, reset_password_if_verified)
+
+load_dotenv()
+log = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = float(os.getenv("SNGPT_AGENT_TIMEOUT", "120"))
+# Shared secret clients send as a bearer token (AgentClient reads the same variable)
+API_TOKEN = os.getenv("SNGPT_AGENT_TOKEN", "")
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class WorkerPool:
+    """ThreadPoolExecutor with a bounded backlog.
+
+    At most `workers` jobs run and `queue_size` more wait; submit() raises
+    PoolBusy past that, so overload shows up as fast 503s rather than
+    ever-growing latency.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy()
+        with self._lock:
+            self.in_flight += 1
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+app = Flask(__name__)
+pool = WorkerPool(
+    workers=int(os.getenv("SNGPT_AGENT_WORKERS", "8")),
+    queue_size=int(os.getenv("SNGPT_AGENT_QUEUE", "32"))
+)
+# Latest questions per user for track_issue; sessions of one user share it across requests
+issue_log = IssueLog()
+
+POOL_JOBS = registry.gauge("sngpt_pool_jobs", "Agent worker pool jobs by state.", ("state",))
+BREAKER_OPEN = registry.gauge("sngpt_breaker_open", "1 while a backend's circuit breaker is not closed.", ("backend",))
+BACKEND_CALLS = registry.gauge("sngpt_backend_events", "Resilience counters per backend (calls, retries, hedges, ...).",
+                               ("backend", "event"))
+
+
+@app.before_request
+def authenticate():
+    if not request.path.startswith("/v1/"):
+        return None
+    expected = f"Bearer {API_TOKEN}".encode("utf-8")
+    supplied = request.headers.get("Authorization", "").encode("utf-8")
+    if not API_TOKEN or not hmac.compare_digest(supplied, expected):
+        return jsonify(error="Unauthorized"), 401, {"WWW-Authenticate": "Bearer"}
+    return None
+
+
+def run_job(fn, *args, **kwargs):
+    """Run fn on the pool and wait for it; returns a Flask response."""
+    try:
+        future = pool.submit(fn, *args, **kwargs)
+    except PoolBusy:
+        return jsonify(error="Agent is at capacity, retry shortly"), 503, {"Retry-After": "1"}
+    try:
+        return jsonify(future.result(timeout=REQUEST_TIMEOUT))
+    except FutureTimeout:
+        return jsonify(error="Timed out"), 504
+    except Exception as e:
+        log.exception("Agent job failed: %s", e)
+        return jsonify(error=str(e)), 500
+
+
+def body(*required):
+    data = request.get_json(silent=True) or {}
+    missing = [k for k in required if not data.get(k)]
+    return data, missing
+
+
+def session_memory(data):
+    """The conversation sent with the request, or None if the client sent none; ValueError if malformed."""
+    return ConversationMemory.from_dict(data["memory"]) if data.get("memory") is not None else None
+
+
+def answer_with_memory(user_id, question, memory, **kwargs):
+    result = answer_question(user_id, question, issue_log, memory=memory, **kwargs)
+    if memory is not None:
+        result["memory"] = memory.to_dict()
+    return result
+
+
+@app.post("/v1/respond")
+def respond():
+    data, missing = body("user_id", "question")
+    if missing:
+        return jsonify(error=f"Missing {', '.join(missing)}"), 400
+    try:
+        memory = session_memory(data)
+    except ValueError as e:
+        return jsonify(error=f"Invalid memory: {e}"), 400
+    return run_job(answer_with_memory, data["user_id"], data["question"], memory,
+                   confirm_ticket=bool(data.get("confirm_ticket")), response_mode=data.get("response_mode"))
+
+
+@app.post("/v1/respond/stream")
+def respond_stream():
+    """NDJSON: {"token": ...} lines as the answer is generated, then one {"done": true, ...} line."""
+    data, missing = body("user_id", "question")
+    if missing:
+        return jsonify(error=f"Missing {', '.join(missing)}"), 400
+
+    try:
+        memory = session_memory(data)
+    except ValueError as e:
+        return jsonify(error=f"Invalid memory: {e}"), 400
+    events = queue.Queue()
+
+    def produce():
+        try:
+            stream = answer_question_stream(data["user_id"], data["question"], issue_log,
+                                            confirm_ticket=bool(data.get("confirm_ticket")), memory=memory)
+            for token in stream:
+                events.put({"token": token})
+            done = {"done": True, "answer": stream.answer, "metadata": stream.metadata,
+                    "diagnostics": stream.diagnostics}
+            if memory is not None:
+                done["memory"] = memory.to_dict()
+            events.put(done)
+        except Exception as e:
+            log.exception("Agent stream failed: %s", e)
+            events.put({"done": True, "error": str(e)})
+
+    try:
+        pool.submit(produce)
+    except PoolBusy:
+        return jsonify(error="Agent is at capacity, retry shortly"), 503, {"Retry-After": "1"}
+
+    def lines():
+        while True:
+            try:
+                event = events.get(timeout=REQUEST_TIMEOUT)
+            except queue.Empty:
+                event = {"done": True, "error": "Timed out"}
+            yield json.dumps(event) + "\n"
+            if event.get("done"):
+                return
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+
+@app.post("/v1/tickets")
+def create_ticket():
+    data, missing = body("user_id", "issue")
+    if missing:
+        return jsonify(error=f"Missing {', '.join(missing)}"), 400
+    return run_job(create_ticket_from_intent, data["user_id"], data["issue"],
+                   data.get("intent_metadata") or {}, confirm_data=data.get("confirm_data"))
+
+
+@app.post("/v1/tickets/duplicates")
+def duplicates():
+    data, missing = body("issue")
+    if missing:
+        return jsonify(error=f"Missing {', '.join(missing)}"), 400
+    return run_job(lambda: {"duplicates": find_duplicate_tickets(data["issue"], k=int(data.get("k", 3)))})
+
+
+@app.post("/v1/password-reset")
+def password_reset():
+    data, missing = body("user_id", "phone")
+    if missing:
+        return jsonify(error=f"Missing {', '.join(missing)}"), 400
+    return run_job(reset_password_if_verified, data["user_id"], data["phone"])
+
+
+@app.get("/v1/users/<path:user_id>/context")
+def user_context(user_id):
+    return run_job(get_user_context, user_id)
+
+
+@app.get("/v1/kb/search")
+def kb_search():
+    query = request.args.get("q", "")
+    return run_job(lambda: {"articles": query_kb_articles(query=query)})
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify(
+        status="ok",
+        pool=pool.stats(),
+        snapshot=snapshot_stats(),
+        answer_cache=answer_cache.stats(),
+        user_cache=user_cache.stats(),
+        replica=replica_stats(),
+        backends={"servicenow": servicenow_backend.stats(), "openai": openai_backend.stats()},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    stats = pool.stats()
+    for state in ("in_flight", "completed", "rejected"):
+        POOL_JOBS.set(stats[state], state=state)
+    for name, backend in (("servicenow", servicenow_backend), ("openai", openai_backend)):
+        backend_stats = backend.stats()
+        BREAKER_OPEN.set(int(backend_stats["state"] != "closed"), backend=name)
+        for event in ("calls", "retries", "hedges", "hedge_wins", "failures", "rejected", "stale_served"):
+            BACKEND_CALLS.set(backend_stats[event], backend=name, event=event)
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.getenv("SNGPT_AGENT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SNGPT_AGENT_PORT", "8700")))
+    args = parser.parse_args()
+    if not API_TOKEN:
+        parser.error("set SNGPT_AGENT_TOKEN to the token clients must send")
+    configure_logging()
+
+    started = time.perf_counter()
+    get_servicenow_data()  # warm the shared snapshot before taking traffic
+    log.info("Snapshot loaded in %.1fs; serving on %s:%s", time.perf_counter() - started, args.host, args.port)
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from kb_index import tokenize
+from kb_vectors import HashingEmbedder
+
+NORMALIZE_RE = re.compile(r"[^a-z0-9 ]+")
+
+
+def normalize_question(question):
+    return " ".join(NORMALIZE_RE.sub(" ", question.lower()).split())
+
+
+def article_versions(articles):
+    return {a.get("number", ""): a.get("sys_updated_on", "") for a in articles}
+
+
+class AnswerCache:
+    """Two-tier cache of generated answers.
+
+    Exact tier: keyed by a hash of the normalized question, the numbers and
+    versions of the articles given to the model, and the model. Semantic tier:
+    a question whose embedding is within `threshold` cosine of a cached one
+    reuses that answer, but only if retrieval picked the same articles at the
+    same versions for both. The default HashingEmbedder is lexical - "building
+    a" and "building b" score 0.98 - so with it the two questions must also
+    have the same content words (they may differ in stopwords, punctuation and
+    order). Entries are bounded (LRU), expire after `ttl`, and are
+    dropped when any of their articles changes. Answers are shared between
+    users, so only answers to prompts that carry nothing about the asking user
+    may be stored.
+    """
+
+    def __init__(self, maxsize=1000, ttl=86400, threshold=0.9, embedder=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embedder = embedder or HashingEmbedder(dim=512)
+        self.lexical = getattr(self.embedder, "name", "") == "hashing"
+        self.entries = OrderedDict()  # key -> entry, least recently used first
+        self.by_article = {}          # article number -> keys that used it
+        self.lock = threading.RLock()
+        self._matrix = None           # stacked question vectors for the semantic tier
+        self._matrix_keys = []
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _key(self, normalized, versions, model):
+        articles = ",".join(f"{n}@{v}" for n, v in sorted(versions.items()))
+        return hashlib.sha256(f"{normalized}|{articles}|{model}".encode("utf-8")).hexdigest()
+
+    def get(self, question, articles, model):
+        """Return (answer, category, tier) or None; tier is "exact" or "semantic"."""
+        normalized = normalize_question(question)
+        versions = article_versions(articles)
+        key = self._key(normalized, versions, model)
+        vector = None
+        with self.lock:
+            entry = self._live(key)
+            if entry is None and self.entries:
+                vector = self.embedder.embed([normalized])[0]
+                key, entry = self._nearest(vector, model, versions, frozenset(tokenize(normalized)))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            tier = "exact" if vector is None else "semantic"
+            if tier == "exact":
+                self.exact_hits += 1
+            else:
+                self.semantic_hits += 1
+            return entry["answer"], entry["category"], tier
+
+    def put(self, question, articles, model, answer, category):
+        normalized = normalize_question(question)
+        versions = article_versions(articles)
+        key = self._key(normalized, versions, model)
+        vector = self.embedder.embed([normalized])[0]
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = {
+                "answer": answer,
+                "category": category,
+                "model": model,
+                "versions": versions,
+                "terms": frozenset(tokenize(normalized)),
+                "vector": vector,
+                "created": time.monotonic(),
+            }
+            for number in versions:
+                self.by_article.setdefault(number, set()).add(key)
+            self._matrix = None
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_articles(self, versions):
+        """Drop entries built from an article whose version is no longer current.
+
+        versions maps article number -> current sys_updated_on, or None if the
+        article was removed.
+        """
+        with self.lock:
+            for number, version in versions.items():
+                for key in list(self.by_article.get(number, ())):
+                    entry = self.entries.get(key)
+                    if entry is not None and entry["versions"].get(number) != version:
+                        self._drop(key)
+                        self.invalidations += 1
+
+    def _live(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry["created"] > self.ttl:
+            self._drop(key)
+            return None
+        return entry
+
+    def _nearest(self, vector, model, versions, terms):
+        if self._matrix is None:
+            self._matrix_keys = list(self.entries)
+            self._matrix = np.vstack([self.entries[k]["vector"] for k in self._matrix_keys])
+        scores = self._matrix @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                break
+            key = self._matrix_keys[i]
+            entry = self._live(key)
+            if (entry is not None and entry["model"] == model and entry["versions"] == versions
+                    and (not self.lexical or entry["terms"] == terms)):
+                return key, entry
+        return None, None
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for number in entry["versions"]:
+            keys = self.by_article.get(number)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_article[number]
+        self._matrix = None
+
+    def stats(self):
+        with self.lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self.entries),
+            }
+
+
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv("SNGPT_ANSWER_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("SNGPT_ANSWER_CACHE_TTL", "86400")),
+    # With the hashing embedder the content-word check is what tells questions apart; 0.9 still
+    # admits stopword-only rephrasings ("connect to vpn" / "connect to the VPN?" score 0.93)
+    threshold=float(os.getenv("SNGPT_ANSWER_CACHE_SIMILARITY", "0.9"))
+)
@@ -1,15 +1,89 @@
+import os
+from collections import deque
 import streamlit as st
-from servicenow_api import query_kb_articles, load_servicenow_data, get_user_context, get_user_phone_number, reset_user_password
-from gpt_agent import generate_response, create_ticket_from_intent
+from agent_client import get_agent
+from conversation import ConversationMemory, IssueLog
+from duplicate_index import format_duplicates
+from telemetry import configure_logging
+
+# Answers are streamed token by token to the UI unless SNGPT_STREAM=false
+STREAM_RESPONSES = os.getenv("SNGPT_STREAM", "true").lower() == "true"
+# Sidebar latency waterfall for the last answer
+DEBUG_PANEL = os.getenv("SNGPT_DEBUG_PANEL", "false").lower() == "true"
+# Past exchanges listed under the answer; the model sees the conversation through ConversationMemory
+CHAT_HISTORY_TURNS = int(os.getenv("SNGPT_CHAT_HISTORY_TURNS", "20"))
+
+@st.cache_resource
+def load_agent():
+    """agent_service client when SNGPT_AGENT_URL is set, else the agent in this process."""
+    configure_logging()
+    return get_agent()
+
+def show_waterfall(spans):
+    """One bar per span of the last answer, offset by when it started."""
+    import altair as alt
+    rows = [
+        {
+            "stage": f"{i:02d} " + "· " * s["depth"] + s["name"],
+            "start": s["start_ms"],
+            "end": s["start_ms"] + s["duration_ms"],
+            "ms": s["duration_ms"],
+            "error": s["error"] or "",
+        }
+        for i, s in enumerate(spans)
+    ]
+    chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+        x=alt.X("start:Q", title="ms"),
+        x2="end:Q",
+        y=alt.Y("stage:N", sort=None, title=None),
+        color=alt.condition("datum.error != ''", alt.value("#d62728"), alt.value("#1f77b4")),
+        tooltip=["stage:N", "ms:Q", "error:N"],
+    )
+    with st.sidebar.expander("⏱ Latency waterfall", expanded=True):
+        st.altair_chart(chart, use_container_width=True)
+
+def show_diagnostics(diagnostics):
+    """Sidebar summary of what went into the last answer."""
+    if "kb_articles" in diagnostics:
+        st.sidebar.markdown("### 📚 KB Articles Sent to GPT")
+        if not diagnostics["kb_articles"]:
+            st.sidebar.warning("⚠️ No knowledge base articles were found!")
+        for title in diagnostics["kb_articles"]:
+            st.sidebar.write(f"- {title}")
+    if diagnostics.get("cache"):
+        st.sidebar.caption(f"Answer cache: {diagnostics['cache']} hit")
+    if diagnostics.get("context"):
+        context = diagnostics["context"]
+        st.sidebar.caption(
+            f"Prompt context: {context['tokens']} tokens from {context['passages']} passages "
+            f"({', '.join(context['citations']) or 'no articles'})"
+        )
+    if diagnostics.get("classification"):
+        classification = diagnostics["classification"]
+        st.sidebar.caption(
+            f"Ticket category: {classification['category'] or 'none'} "
+            f"({classification['path']}, confidence {classification['confidence']:.2f})"
+        )
+    if "seconds" in diagnostics:
+        st.sidebar.caption(f"Response mode: {diagnostics['mode']} ({diagnostics['seconds']:.2f}s)")
+    if diagnostics.get("memory"):
+        memory = diagnostics["memory"]
+        st.sidebar.caption(f"Conversation memory: {memory['turns']} recent turns, "
+                           f"{memory['summarized_turns']} summarized, {memory['tokens']} tokens")
+    if DEBUG_PANEL and diagnostics.get("trace"):
+        show_waterfall(diagnostics["trace"])
 
 st.set_page_config(page_title="IT Assistant", layout="centered")
 st.title("💼 IT Support Assistant")
+agent = load_agent()
 
 # Initialize session state
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_TURNS)
 if "issue_log" not in st.session_state:
-    st.session_state.issue_log = {}
+    st.session_state.issue_log = IssueLog()
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
 if "pending_ticket" not in st.session_state:
     st.session_state.pending_ticket = False
 if "last_question" not in st.session_state:
@@ -18,26 +92,22 @@ if "ticket_metadata" not in st.session_state:
     st.session_state.ticket_metadata = None
 if "user_context" not in st.session_state:
     st.session_state.user_context = {}
-if "kb_articles" not in st.session_state:
-    st.session_state.kb_articles = []
 if "user_context_loaded" not in st.session_state:
     st.session_state.user_context_loaded = False
 if "last_response" not in st.session_state:
     st.session_state.last_response = ""
+if "duplicates" not in st.session_state:
+    st.session_state.duplicates = (None, [])  # (issue, possible duplicates) for the ticket form
 if "show_ticket_prompt" not in st.session_state:
     st.session_state.show_ticket_prompt = False
-if "servicenow_data" not in st.session_state:
-    st.session_state.servicenow_data = load_servicenow_data()
 if "password_reset_mode" not in st.session_state:
     st.session_state.password_reset_mode = False
-if "password_reset_attempts" not in st.session_state:
-    st.session_state.password_reset_attempts = 0
 
 # Step 1: User login
 user_id = st.text_input("Enter your username to begin:", value="", key="username_input")
 
 if user_id and not st.session_state.user_context_loaded:
-    st.session_state.user_context = get_user_context(user_id)
+    st.session_state.user_context = agent.user_context(user_id)
     st.session_state.user_context_loaded = True
 
     user = st.session_state.user_context.get("user", {})
@@ -58,16 +128,32 @@ if st.session_state.user_context_loaded:
 
     if st.button("Ask GPT"):
         if question.strip():
-            st.session_state.kb_articles = query_kb_articles(query=question)
-
-            response, metadata = generate_response(
-                user_id,
-                question,
-                st.session_state.kb_articles,
-                st.session_state.issue_log,
-                confirm_ticket=False,
-                stored_metadata=None
-            )
+            if STREAM_RESPONSES:
+                # Render tokens as they arrive, then clear the live view so Step 3
+                # shows the finished answer exactly once.
+                live = st.empty()
+                with live.container():
+                    st.markdown("### 💡 GPT Response")
+                    stream = agent.respond_stream(
+                        user_id,
+                        question,
+                        st.session_state.issue_log,
+                        confirm_ticket=False,
+                        memory=st.session_state.memory
+                    )
+                    st.write_stream(stream)
+                live.empty()
+                response, metadata, diagnostics = stream.answer, stream.metadata, stream.diagnostics
+            else:
+                result = agent.respond(
+                    user_id,
+                    question,
+                    st.session_state.issue_log,
+                    confirm_ticket=False,
+                    memory=st.session_state.memory
+                )
+                response, metadata, diagnostics = result["answer"], result["metadata"], result["diagnostics"]
+            show_diagnostics(diagnostics)
 
             st.session_state.last_question = question
             st.session_state.last_response = response
@@ -104,22 +190,22 @@ if st.session_state.password_reset_mode:
     phone_input = st.text_input("Enter the phone number associated with your account:")
 
     if st.button("Verify Phone"):
-        correct_phone = get_user_phone_number(user_id)
+        # The phone is checked by the agent, so the number on record never reaches the browser
+        reset = agent.reset_password(user_id, phone_input)
 
-        if phone_input.strip() == correct_phone:
-            new_password = reset_user_password(user_id)
+        if reset["verified"]:
+            new_password = reset["password"]
             if new_password:
                 st.success(f"✅ Your password has been reset! New Password: `{new_password}`")
             else:
                 st.error("❌ Could not reset your password at this time.")
             st.session_state.password_reset_mode = False
+        elif reset.get("locked"):
+            # The agent counts failed attempts per user, across sessions
+            st.error("❌ Too many incorrect phone numbers. Password reset is locked for now; please contact the service desk.")
+            st.session_state.password_reset_mode = False
         else:
-            st.session_state.password_reset_attempts += 1
-            if st.session_state.password_reset_attempts >= 2:
-                st.error("❌ Incorrect phone entered twice. Exiting.")
-                st.session_state.password_reset_mode = False
-            else:
-                st.warning("⚠️ Incorrect phone. Please try again.")
+            st.warning("⚠️ Incorrect phone. Please try again.")
 
 # Step 5: Ticket creation UI
 if st.session_state.pending_ticket and st.session_state.ticket_metadata:
@@ -130,6 +216,14 @@ if st.session_state.pending_ticket and st.session_state.ticket_metadata:
     group = st.text_input("Assignment Group", st.session_state.ticket_metadata.get("assignment_group", ""))
     desc = st.text_area("Description", "", placeholder="Leave empty to auto-generate from your user info and request.")
 
+    # Streamlit reruns the script on every widget change; look duplicates up once per issue
+    issue, duplicates = st.session_state.duplicates
+    if issue != st.session_state.last_question:
+        duplicates = agent.find_duplicates(st.session_state.last_question)
+        st.session_state.duplicates = (st.session_state.last_question, duplicates)
+    if duplicates:
+        st.warning(format_duplicates(duplicates) + "\n\nCheck these before opening a new ticket.")
+
     if st.button("✅ Create Ticket Now"):
         confirm_data = {
             "short_description": sd,
@@ -139,7 +233,7 @@ if st.session_state.pending_ticket and st.session_state.ticket_metadata:
             "description": desc
         }
 
-        result = create_ticket_from_intent(
+        result = agent.create_ticket(
             user_id=user_id,
             issue=st.session_state.last_question,
             intent_metadata=st.session_state.ticket_metadata,
@@ -151,7 +245,7 @@ if st.session_state.pending_ticket and st.session_state.ticket_metadata:
         st.session_state.ticket_metadata = None
 
 # Step 6: Show chat history
-for q, r in st.session_state.chat_history[::-1]:
+for q, r in reversed(st.session_state.chat_history):
     st.markdown(f"**You:** {q}")
     st.markdown(f"**IT Assistant:** {r}")
     st.markdown("---")
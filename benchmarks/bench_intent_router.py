@@ -0,0 +1,90 @@
+"""Compare the old per-phrase `in` scans with one IntentRouter pass.
+
+    python benchmarks/bench_intent_router.py [patterns per intent] [questions]
+
+Adds generated phrases to the real shortcut and ticket keyword tables so the
+pattern count is in the thousands, checks both approaches find the same
+intents, then times them.
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_router import IntentRouter
+
+SHORTCUTS = {
+    "password_reset": ["forgot my password", "reset my password", "can't log in", "locked out of my account"],
+    "open_incidents": ["open incidents"],
+    "open_requests": ["open requests"],
+    "open_tasks": ["open tasks"],
+    "open_work": ["open work", "open tickets"],
+}
+KEYWORDS = {
+    "access_issue": ["access", "permission", "denied", "admin rights", "shared document"],
+    "hardware_request": ["laptop", "monitor", "mouse", "keyboard", "docking station"],
+    "software_request": ["adobe", "vpn", "software installation", "creative cloud"],
+    "account_problem": ["locked", "password", "login", "mfa", "username"],
+    "security_concern": ["suspicious email", "malware", "phishing", "antivirus"],
+}
+WORDS = ("please help my the laptop vpn is broken again since monday and I cannot open "
+         "outlook or teams on the new monitor after password reset access denied").split()
+
+
+def random_phrase(rng):
+    return " ".join(
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+        for _ in range(rng.randint(1, 3))
+    )
+
+
+def make_patterns(per_intent, rng):
+    patterns = {k: list(v) for k, v in {**SHORTCUTS, **KEYWORDS}.items()}
+    for phrases in patterns.values():
+        phrases.extend(random_phrase(rng) for _ in range(per_intent))
+    return patterns
+
+
+def make_questions(count, rng):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))) for _ in range(count)]
+
+
+def naive_intents(patterns, question):
+    q = question.lower()
+    return {intent for intent, phrases in patterns.items() if any(p in q for p in phrases)}
+
+
+def timed(fn, questions):
+    start = time.perf_counter()
+    for q in questions:
+        fn(q)
+    return (time.perf_counter() - start) / len(questions) * 1e6
+
+
+def main():
+    per_intent = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(0)
+    patterns = make_patterns(per_intent, rng)
+    questions = make_questions(count, rng)
+    total = sum(len(v) for v in patterns.values())
+
+    start = time.perf_counter()
+    router = IntentRouter(patterns)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    for q in questions:
+        assert set(router.intents(q)) == naive_intents(patterns, q), q
+
+    naive_us = timed(lambda q: naive_intents(patterns, q), questions)
+    router_us = timed(router.intents, questions)
+    print(f"{total} patterns, {count} questions, router built in {build_ms:.1f} ms")
+    print(f"naive `in` scans: {naive_us:9.1f} us/question")
+    print(f"IntentRouter:     {router_us:9.1f} us/question  ({naive_us / router_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Response size and parse time of projected vs full-row Table API reads.
+
+    python benchmarks/bench_projection.py [--instance] [--user jdoe] [--tickets 20000]
+
+Sends each per-turn lookup twice: as the app now builds it (TableQuery:
+named fields, no reference links) and as it used to (query only, so every
+column comes back). Prints response bytes and JSON parse time for both.
+Runs against mock_servicenow with a generated dataset by default; with
+--instance it uses SN_INSTANCE/SN_USERNAME/SN_PASSWORD instead.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instance", action="store_true", help="use SN_INSTANCE instead of the mock")
+    parser.add_argument("--user", help="user_name to look up (default: the mock user with the most tickets)")
+    parser.add_argument("--users", type=int, default=200, help="generated mock users")
+    parser.add_argument("--tickets", type=int, default=20000, help="generated mock tickets")
+    parser.add_argument("--repeat", type=int, default=20, help="parses per response when timing")
+    return parser.parse_args()
+
+
+def start_mock(args):
+    import mock_servicenow
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    mock_servicenow.seed(args.users, args.tickets, 0)
+    server = mock_servicenow.start(port=0)
+    os.environ.update(SN_INSTANCE=f"http://127.0.0.1:{server.server_port}", SN_USERNAME="bench", SN_PASSWORD="x")
+    counts = {}
+    for row in mock_servicenow.DB["incident"]:
+        caller = row.get("caller_id")
+        if isinstance(caller, dict):
+            counts[caller["value"]] = counts.get(caller["value"], 0) + 1
+    busiest = max(counts, key=counts.get)
+    return mock_servicenow.find("sys_user", busiest)["user_name"]
+
+
+def measure(session, url, params, repeat):
+    response = session.get(url, params=params)
+    response.raise_for_status()
+    body = response.content
+    started = time.perf_counter()
+    for _ in range(repeat):
+        rows = json.loads(body)["result"]
+    return len(body), len(rows), (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    args = parse_args()
+    user = start_mock(args) if not args.instance else None
+    user = args.user or user or "jdoe"
+
+    from servicenow_api import ServiceNowClient, user_context_lookups, open_work_query, OPEN_WORK
+    client = ServiceNowClient()
+    lookups = [(f"context {table}", table, params) for table, params in user_context_lookups(user)]
+    lookups += [(f"open {kind}", *open_work_query(kind, user)[:2]) for kind in OPEN_WORK]
+
+    print(f"user {user} on {client.instance}")
+    print(f"{'lookup':<26} {'rows':>5} {'full bytes':>11} {'projected':>10} {'ratio':>6} {'parse ms':>15}")
+    totals = [0, 0]
+    for name, table, params in lookups:
+        # What the app sent before: the query alone, so every column and reference link comes back
+        legacy = {k: v for k, v in params.items() if k in ("sysparm_query", "sysparm_limit")}
+        full_bytes, rows, full_ms = measure(client.session, client.table_url(table), legacy, args.repeat)
+        projected_bytes, _, projected_ms = measure(client.session, client.table_url(table), params, args.repeat)
+        totals[0] += full_bytes
+        totals[1] += projected_bytes
+        print(f"{name:<26} {rows:>5} {full_bytes:>11,} {projected_bytes:>10,} "
+              f"{full_bytes / max(projected_bytes, 1):>5.1f}x {full_ms:>6.2f} -> {projected_ms:.2f}")
+    print(f"{'per turn':<26} {'':>5} {totals[0]:>11,} {totals[1]:>10,} {totals[0] / max(totals[1], 1):>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
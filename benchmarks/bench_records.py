@@ -0,0 +1,100 @@
+"""Memory of KB articles, tickets and users held as dicts vs records.Article/Ticket/User.
+
+    python benchmarks/bench_records.py [--rows 100000]
+
+Decodes --rows rows of each kind from a JSON payload shaped like the Table
+API responses the app keeps (projected fields, generated values), once kept
+as the dicts the app used to hold and once converted with from_row(), and
+reports the memory still allocated afterwards (tracemalloc), the build time
+and the cost of reading a field by key and (for records) by attribute.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Article, Ticket, User
+
+DEPARTMENTS = ["Finance", "Human Resources", "Information Technology", "Sales", "Customer Support", "Legal"]
+TITLES = ["Engineer", "Analyst", "Manager", "Director", "Accountant", "Support Specialist", "Recruiter"]
+TOPICS = ["VPN", "Outlook", "printer", "laptop", "Teams", "password", "badge reader", "Adobe license"]
+
+
+def rows(kind, n, rng):
+    if kind == "tickets":
+        return [{"sys_id": f"{rng.getrandbits(128):032x}", "number": f"INC{i:07d}",
+                 "short_description": f"{rng.choice(TOPICS)} not working since this morning",
+                 "state": rng.choice(["1", "2", "3", "6", "7"]),
+                 "opened_at": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 09:{i % 60:02d}:00"}
+                for i in range(n)]
+    if kind == "users":
+        return [{"sys_id": f"{rng.getrandbits(128):032x}", "user_name": f"user{i:06d}", "name": f"User {i}",
+                 "email": f"user{i:06d}@example.com", "title": rng.choice(TITLES),
+                 "department": rng.choice(DEPARTMENTS)}
+                for i in range(n)]
+    return [{"number": f"KB{i:07d}", "short_description": f"How to fix {rng.choice(TOPICS)} issues",
+             "text": f"Restart the {rng.choice(TOPICS)} client and sign in again.",
+             "sys_updated_on": f"2024-{rng.randint(1, 12):02d}-01 10:00:00",
+             "sections": [{"heading": "Steps", "text": "Restart the client and sign in again."}]}
+            for i in range(n)]
+
+
+def article_dict(r):
+    # The dict KBIndex.apply_changes used to build for each article
+    return {"title": r.get("short_description", "Untitled"), "content": r.get("text", ""), "number": r["number"],
+            "sys_updated_on": r.get("sys_updated_on", ""), "sections": r.get("sections") or []}
+
+
+def retained(build):
+    """(result, bytes still allocated once build() returns, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - started
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, seconds
+
+
+def access_time(items, read, repeat=3):
+    """Nanoseconds per read(item)."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            read(item)
+    return (time.perf_counter() - started) / (repeat * len(items)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    kinds = [("articles", Article, "title"), ("tickets", Ticket, "short_description"), ("users", User, "email")]
+    print(f"{args.rows:,} rows per kind")
+    print(f"{'kind':<10} {'dicts MB':>9} {'records MB':>11} {'saved':>6} {'B/row':>13} {'build s':>13} "
+          f"{'read ns: dict[k]':>16} {'rec.k':>6} {'rec[k]':>6}")
+    for kind, record, field in kinds:
+        payload = json.dumps(rows(kind, args.rows, rng))
+        as_dict = article_dict if kind == "articles" else (lambda r: r)
+        dicts, dict_bytes, dict_seconds = retained(lambda: [as_dict(r) for r in json.loads(payload)])
+        records, record_bytes, record_seconds = retained(lambda: [record.from_row(r) for r in json.loads(payload)])
+        print(f"{kind:<10} {dict_bytes / 1e6:>9.1f} {record_bytes / 1e6:>11.1f} {1 - record_bytes / dict_bytes:>6.0%} "
+              f"{dict_bytes // args.rows:>5} -> {record_bytes // args.rows:<5} "
+              f"{dict_seconds:>5.2f} -> {record_seconds:<5.2f} "
+              f"{access_time(dicts, lambda d: d[field]):>16.0f} "
+              f"{access_time(records, lambda r: getattr(r, field)):>6.0f} {access_time(records, lambda r: r[field]):>6.0f}")
+        del dicts, records
+
+
+if __name__ == "__main__":
+    main()
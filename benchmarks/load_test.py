@@ -0,0 +1,260 @@
+"""End-to-end load test of the agent against the mock ServiceNow and OpenAI servers.
+
+    python benchmarks/load_test.py [--users 20] [--requests 10] [--ticket-ratio 0.1]
+                                   [--sn-latency 0.05] [--llm-latency 0.4] [--json after.json]
+                                   [--compare before.json]
+
+Starts mock_servicenow and mock_openai in-process on free ports (with the
+given latency, failure rates and dataset size), points the agent at them,
+then runs --users simulated users concurrently, each asking --requests
+questions through answer_question (or the streaming path with --stream) and
+opening a ticket instead for --ticket-ratio of them. With --burst every user
+asks the same question in lockstep, as during an outage; with --memory each
+user carries a ConversationMemory across their questions, as the app does. Prints p50/p95/p99 per
+operation and overall throughput. Runs offline; save a run with --json and
+pass it to --compare on the next run to see the change.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_openai
+import mock_servicenow
+from conversation import ConversationMemory, IssueLog
+
+SHORTCUT_QUESTIONS = ["show my open incidents", "what are my open requests", "list my open work"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=10, help="requests per simulated user")
+    parser.add_argument("--ticket-ratio", type=float, default=0.1, help="fraction of requests that open a ticket")
+    parser.add_argument("--shortcut-ratio", type=float, default=0.1, help="fraction asking for their open tickets")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each user waits between requests")
+    parser.add_argument("--stream", action="store_true", help="answer through the streaming path")
+    parser.add_argument("--mode", choices=["two_call", "structured"], help="SNGPT_RESPONSE_MODE for answers")
+    parser.add_argument("--cold", action="store_true", help="make every question unique so the answer cache misses")
+    parser.add_argument("--burst", action="store_true",
+                        help="every user asks the same question at the same moment (an outage spike)")
+    parser.add_argument("--memory", action="store_true", help="keep a conversation memory per simulated user")
+    parser.add_argument("--sn-latency", type=float, default=0.05, help="seconds per ServiceNow request")
+    parser.add_argument("--sn-jitter", type=float, default=0.02)
+    parser.add_argument("--sn-error-rate", type=float, default=0.0)
+    parser.add_argument("--sn-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds to the first token")
+    parser.add_argument("--llm-token-latency", type=float, default=0.01, help="seconds per further token")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--dataset-users", type=int, default=500, help="generated ServiceNow users")
+    parser.add_argument("--dataset-tickets", type=int, default=5000, help="generated incidents, requests and tasks")
+    parser.add_argument("--dataset-articles", type=int, default=300, help="generated KB articles")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    return parser.parse_args()
+
+
+def start_mocks(args):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    mock_servicenow.seed(args.dataset_users, args.dataset_tickets, args.dataset_articles, random_seed=args.seed)
+    mock_servicenow.configure(latency=args.sn_latency, jitter=args.sn_jitter, error_rate=args.sn_error_rate,
+                              throttle_rate=args.sn_throttle_rate)
+    mock_openai.configure(latency=args.llm_latency, token_latency=args.llm_token_latency,
+                          error_rate=args.llm_error_rate, throttle_rate=args.llm_throttle_rate)
+    servicenow = mock_servicenow.start(port=0)
+    openai = mock_openai.start(port=0)
+
+    # Must be set before the agent modules are imported; they read their config at import time
+    os.environ.update({
+        "SN_INSTANCE": f"http://127.0.0.1:{servicenow.server_port}",
+        "SN_USERNAME": "load", "SN_PASSWORD": "test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai.server_port}/v1",
+        "OPENAI_API_KEY": "mock",
+    })
+    if args.mode:
+        os.environ["SNGPT_RESPONSE_MODE"] = args.mode
+    if args.cold:
+        os.environ["SNGPT_ANSWER_CACHE_SIMILARITY"] = "2"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(samples):
+    """{count, errors, degraded, p50, p95, p99, max} in milliseconds for one operation's samples."""
+    latencies = [s["seconds"] * 1000 for s in samples if s["ok"]]
+    summary = {"count": len(samples), "errors": sum(not s["ok"] for s in samples),
+               "degraded": sum(s.get("degraded", False) for s in samples)}
+    if latencies:
+        summary.update({f"p{int(q * 100)}": round(percentile(latencies, q), 1) for q in (0.5, 0.95, 0.99)})
+        summary["max"] = round(max(latencies), 1)
+    return summary
+
+
+class LoadTest:
+    def __init__(self, args):
+        import gpt_agent
+        self.agent = gpt_agent
+        self.args = args
+        self.user_ids = [u["user_name"] for u in mock_servicenow.DB["sys_user"]]
+        self.categories = [c for c in gpt_agent.CATEGORY_METADATA if c != "ticket_followup"]
+        self.samples = {}
+        self.memories = []
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def record(self, operation, started, ok, degraded=False):
+        sample = {"seconds": time.perf_counter() - started, "ok": ok, "degraded": degraded}
+        with self.lock:
+            self.samples.setdefault(operation, []).append(sample)
+
+    def question(self, rng):
+        if self.args.burst:
+            return "The VPN is down for everyone, what should I do?"
+        if rng.random() < self.args.shortcut_ratio:
+            return rng.choice(SHORTCUT_QUESTIONS)
+        question = f"My {rng.choice(mock_servicenow.TOPICS)} {rng.choice(mock_servicenow.PROBLEMS)}, what should I do?"
+        if self.args.cold:
+            with self.lock:
+                self.counter += 1
+                question += f" (case {self.counter})"
+        return question
+
+    def ask(self, user_id, question, issue_log, memory=None):
+        started = time.perf_counter()
+        try:
+            if not self.args.stream:
+                result = self.agent.answer_question(user_id, question, issue_log, memory=memory)
+                self.record("answer", started, True, bool(result["diagnostics"].get("degraded")))
+                return
+            stream = self.agent.answer_question_stream(user_id, question, issue_log, memory=memory)
+            first = None
+            for _ in stream:
+                if first is None:
+                    first = time.perf_counter()
+                    self.record("first_token", started, True)
+            self.record("answer", started, True, bool(stream.diagnostics.get("degraded")))
+        except Exception as e:
+            print("answer failed:", e)
+            self.record("answer", started, False)
+
+    def open_ticket(self, user_id, rng):
+        category = rng.choice(self.categories)
+        issue = f"{rng.choice(mock_servicenow.TOPICS)} {rng.choice(mock_servicenow.PROBLEMS)} since this morning"
+        started = time.perf_counter()
+        try:
+            result = self.agent.create_ticket_from_intent(user_id, issue, self.agent.CATEGORY_METADATA[category])
+            number = result["ticket"].get("result") or result["ticket"].get("number")
+            self.record("ticket", started, bool(number) and number != "Error")
+        except Exception as e:
+            print("ticket failed:", e)
+            self.record("ticket", started, False)
+
+    def user_session(self, index):
+        rng = random.Random(self.args.seed * 100003 + index)
+        user_id = rng.choice(self.user_ids)
+        issue_log = IssueLog()
+        memory = ConversationMemory() if self.args.memory else None
+        for _ in range(self.args.requests):
+            if self.args.burst:
+                self.barrier.wait()
+            if rng.random() < self.args.ticket_ratio and not self.args.burst:
+                self.open_ticket(user_id, rng)
+            else:
+                self.ask(user_id, self.question(rng), issue_log, memory)
+            if self.args.think:
+                time.sleep(self.args.think)
+        if memory is not None:
+            with self.lock:
+                self.memories.append(memory.stats())
+
+    def run(self):
+        from data_snapshot import get_servicenow_data
+        started = time.perf_counter()
+        get_servicenow_data()
+        warmup = time.perf_counter() - started
+
+        self.barrier = threading.Barrier(self.args.users)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.users) as pool:
+            list(pool.map(self.user_session, range(self.args.users)))
+        wall = time.perf_counter() - started
+
+        from resilience import servicenow, openai_backend
+        total = sum(len(s) for name, s in self.samples.items() if name != "first_token")
+        results = {
+            "config": vars(self.args),
+            "warmup_seconds": round(warmup, 2),
+            "wall_seconds": round(wall, 2),
+            "throughput": round(total / wall, 2) if wall else 0.0,
+            "operations": {name: summarize(s) for name, s in sorted(self.samples.items())},
+            "backends": {"servicenow": servicenow.stats(), "openai": openai_backend.stats()},
+            "llm_usage": dict(mock_openai.usage),
+        }
+        if self.memories:
+            results["memory"] = {"max_tokens": max(m["tokens"] for m in self.memories),
+                                 "max_turns": max(m["turns"] for m in self.memories),
+                                 "summarized_turns": sum(m["summarized_turns"] for m in self.memories)}
+        return results
+
+
+def report(results, baseline=None):
+    print(f"\nSnapshot warm-up {results['warmup_seconds']}s; "
+          f"{results['throughput']} req/s over {results['wall_seconds']}s")
+    print(f"{'operation':<12} {'count':>6} {'errors':>6} {'degr.':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, s in results["operations"].items():
+        print(f"{name:<12} {s['count']:>6} {s['errors']:>6} {s['degraded']:>6} "
+              + " ".join(f"{s.get(k, float('nan')):>9.1f}" for k in ("p50", "p95", "p99", "max")))
+    sn, llm = results["backends"]["servicenow"], results["backends"]["openai"]
+    print(f"ServiceNow: {sn['calls']} calls, {sn['retries']} retries, {sn['hedges']} hedges; "
+          f"LLM: {llm['calls']} calls, {llm['retries']} retries, {results['llm_usage']['prompt_tokens']} prompt tokens")
+    if results.get("memory"):
+        memory = results["memory"]
+        print(f"Conversation memory: at most {memory['max_tokens']} tokens and {memory['max_turns']} verbatim turns "
+              f"per user; {memory['summarized_turns']} turns summarized")
+    if not baseline:
+        return
+
+    def change(before, after):
+        if not before or after is None:
+            return "    n/a"
+        return f"{(after - before) / before:+7.1%}"
+
+    print(f"\nvs {baseline['_path']}: throughput {baseline['throughput']} -> {results['throughput']} req/s "
+          f"({change(baseline['throughput'], results['throughput']).strip()})")
+    for name, s in results["operations"].items():
+        before = baseline["operations"].get(name, {})
+        print(f"{name:<12} " + " ".join(
+            f"{k} {before.get(k, float('nan')):.1f}->{s.get(k, float('nan')):.1f} ({change(before.get(k), s.get(k)).strip()})"
+            for k in ("p50", "p95", "p99")))
+
+
+def main():
+    args = parse_args()
+    start_mocks(args)
+    results = LoadTest(args).run()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        baseline["_path"] = args.compare
+    report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import math
+import re
+from kb_index import KBIndex, TAG_RE, tokenize
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # optional; fall back to the ~4 characters per token rule of thumb
+    _encoding = None
+
+BLOCK_RE = re.compile(r"</?(p|div|br|li|ul|ol|h[1-6]|tr|table|pre|blockquote)\b[^>]*>", re.I)
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def chunk_article(article, max_tokens=120):
+    """Split an article into passages of roughly max_tokens, on paragraph then sentence breaks.
+
+    Uses the cleaned sections from kb_ingest when the article has them (headings
+    become their own pieces); otherwise strips the raw HTML here.
+    """
+    if article.get("sections"):
+        paragraphs = []
+        for section in article["sections"]:
+            paragraphs.append(section["heading"])
+            paragraphs.extend(section["text"].split("\n"))
+    else:
+        text = BLOCK_RE.sub("\n", article.get("content", ""))
+        paragraphs = [" ".join(TAG_RE.sub(" ", p).split()) for p in text.split("\n")]
+    pieces = []
+    for p in paragraphs:
+        if not p:
+            continue
+        if count_tokens(p) <= max_tokens:
+            pieces.append(p)
+        else:
+            pieces.extend(s for s in SENTENCE_RE.split(p) if s)
+
+    passages, current = [], ""
+    for piece in pieces:
+        candidate = f"{current} {piece}".strip()
+        if current and count_tokens(candidate) > max_tokens:
+            passages.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        passages.append(current)
+    return passages
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def build_context(question, articles, token_budget=3000, passage_tokens=120, diversity=0.3):
+    """Pick the best passages from articles that fit in token_budget.
+
+    Passages are ranked by BM25 against the question, with the article's
+    retrieval rank as a tie-breaker, and picked by maximal marginal relevance
+    so near-duplicate passages don't crowd out other material. Returns a dict
+    with the context text, the cited article numbers, the chosen passages and
+    the tokens used.
+    """
+    passages = []
+    for rank, article in enumerate(articles):
+        for position, text in enumerate(chunk_article(article, passage_tokens)):
+            passages.append({
+                "number": article.get("number", ""),
+                "title": article.get("title", "Untitled"),
+                "position": position,
+                "text": text,
+                "tokens": count_tokens(text),
+                "terms": set(tokenize(text)),
+                # Keeps retrieval order when the question shares no words with a passage
+                "prior": 1e-3 / (1 + rank + position / 100)
+            })
+
+    index = KBIndex(title_weight=1)
+    for i, p in enumerate(passages):
+        index.add({"number": i, "title": p["title"], "content": p["text"]})
+    for score, hit in index.search(question, k=len(passages)):
+        passages[hit["number"]]["relevance"] = score
+
+    top = max((p.get("relevance", 0.0) for p in passages), default=0.0) or 1.0
+    for p in passages:
+        p["relevance"] = p.get("relevance", 0.0) / top + p["prior"]
+
+    header_tokens = {}
+    selected, used = [], 0
+    remaining = list(passages)
+    redundancy = {id(p): 0.0 for p in passages}  # max similarity to anything selected so far
+    while remaining:
+        best = max(remaining, key=lambda p: (1 - diversity) * p["relevance"] - diversity * redundancy[id(p)])
+        remaining.remove(best)
+        header = 0 if best["number"] in header_tokens else count_tokens(f"[{best['number']}] {best['title']}\n")
+        if used + best["tokens"] + header > token_budget:
+            continue
+        header_tokens[best["number"]] = header
+        selected.append(best)
+        used += best["tokens"] + header
+        for p in remaining:
+            redundancy[id(p)] = max(redundancy[id(p)], _similarity(p["terms"], best["terms"]))
+
+    # Group the chosen passages under their article, articles in first-selected order
+    citations = []
+    grouped = {}
+    for p in selected:
+        if p["number"] not in grouped:
+            citations.append(p["number"])
+            grouped[p["number"]] = (p["title"], [])
+        grouped[p["number"]][1].append(p)
+    context = "\n\n".join(
+        f"[{number}] {grouped[number][0]}\n"
+        + "\n".join(p["text"] for p in sorted(grouped[number][1], key=lambda p: p["position"]))
+        for number in citations
+    )
+
+    return {
+        "context": context,
+        "citations": citations,
+        "passages": [{"number": p["number"], "text": p["text"], "tokens": p["tokens"]} for p in selected],
+        "tokens": used,
+    }
@@ -0,0 +1,177 @@
+"""Bounded per-session conversation state.
+
+    memory = ConversationMemory()
+    messages = memory.messages() + [{"role": "user", "content": prompt}]
+    ...
+    memory.add(question, answer, summarize=summarize_conversation)
+
+ConversationMemory keeps the latest turns verbatim while they fit in `budget`
+tokens; older turns are folded into a rolling summary capped at
+`summary_budget` tokens, so what it holds and what it adds to a prompt stay
+the same size however long the session runs. The summary comes from the
+summarize(summary, turns) callable passed to add() (the model, in gpt_agent),
+or from the questions alone when there is none or it fails. to_dict() and
+load() carry a memory through the stateless agent service.
+
+IssueLog is the per-user question log behind gpt_agent.track_issue: a ring
+buffer of each user's latest questions, for at most max_users users.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+from context_builder import count_tokens
+
+load_dotenv()
+
+# Tokens of recent turns kept verbatim, and the cap on the summary of older ones
+MEMORY_TOKEN_BUDGET = int(os.getenv("SNGPT_MEMORY_TOKENS", "1200"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("SNGPT_MEMORY_SUMMARY_TOKENS", "300"))
+
+# Questions kept per user by IssueLog, and how many users it keeps them for
+ISSUE_LOG_SIZE = int(os.getenv("SNGPT_ISSUE_LOG_SIZE", "50"))
+ISSUE_LOG_USERS = int(os.getenv("SNGPT_ISSUE_LOG_USERS", "10000"))
+
+
+def clip(text, max_tokens, keep="start"):
+    """text cut to about max_tokens, keeping its start or its end."""
+    tokens = count_tokens(text)
+    while tokens > max_tokens:
+        keep_chars = max(0, int(len(text) * max_tokens / tokens) - 1)
+        text = text[:keep_chars] if keep == "start" else text[len(text) - keep_chars:]
+        tokens = count_tokens(text)
+    return text
+
+
+def extractive_summary(summary, turns):
+    """Summary without the model: the old summary followed by the questions asked."""
+    asked = "; ".join(question for question, _ in turns)
+    return f"{summary} The user then asked: {asked}." if summary else f"The user asked: {asked}."
+
+
+class ConversationMemory:
+    def __init__(self, budget=None, summary_budget=None):
+        self.budget = budget or MEMORY_TOKEN_BUDGET
+        self.summary_budget = summary_budget or MEMORY_SUMMARY_TOKENS
+        self.summary = ""
+        self.turns = deque()  # (question, answer, tokens)
+        self.turn_tokens = 0
+        self.summarized = 0
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __bool__(self):
+        return bool(self.turns or self.summary)
+
+    def add(self, question, answer, summarize=None):
+        """Record a turn; once the turns exceed the budget the oldest are folded into the summary.
+
+        Folding goes down to half the budget, so the summarizer runs every few
+        turns on several at once rather than on every turn. A long turn is
+        clipped (question to a quarter, answer to half the budget) so the
+        latest turn is always kept verbatim.
+        """
+        question = clip(question, self.budget // 4)
+        answer = clip(answer, self.budget // 2)
+        tokens = count_tokens(question) + count_tokens(answer)
+        self.turns.append((question, answer, tokens))
+        self.turn_tokens += tokens
+
+        if self.turn_tokens <= self.budget:
+            return
+        folded = []
+        while self.turn_tokens > self.budget // 2 and len(self.turns) > 1:
+            q, a, t = self.turns.popleft()
+            self.turn_tokens -= t
+            folded.append((q, a))
+        self.fold(folded, summarize)
+
+    def fold(self, turns, summarize=None):
+        summary = None
+        if summarize is not None:
+            summary = summarize(self.summary, turns)
+        if not summary:
+            summary = extractive_summary(self.summary, turns)
+        # Keep the end of an over-long summary: it describes the most recent of the folded turns
+        self.summary = clip(summary.strip(), self.summary_budget, keep="end")
+        self.summarized += len(turns)
+
+    def messages(self):
+        """Chat messages for the conversation so far, to go before the new question."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far: {self.summary}"})
+        for question, answer, _ in self.turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages
+
+    def tokens(self):
+        return self.turn_tokens + (count_tokens(self.summary) if self.summary else 0)
+
+    def stats(self):
+        return {"turns": len(self.turns), "summarized_turns": self.summarized, "tokens": self.tokens()}
+
+    def to_dict(self):
+        return {"summary": self.summary, "turns": [[q, a] for q, a, _ in self.turns], "summarized": self.summarized}
+
+    def load(self, data):
+        """Replace the contents with a to_dict() result; turns are re-clipped to this memory's budget.
+
+        Raises ValueError if data isn't shaped like one (it may come from a client).
+        """
+        data = data or {}
+        if not isinstance(data, dict):
+            raise ValueError("memory must be an object")
+        summary, turns, summarized = data.get("summary") or "", data.get("turns") or [], data.get("summarized") or 0
+        if not isinstance(summary, str):
+            raise ValueError("summary must be a string")
+        if not isinstance(turns, list) or not all(
+                isinstance(t, (list, tuple)) and len(t) == 2 and all(isinstance(x, str) for x in t) for t in turns):
+            raise ValueError("turns must be a list of [question, answer] string pairs")
+        if not isinstance(summarized, int) or isinstance(summarized, bool) or summarized < 0:
+            raise ValueError("summarized must be a non-negative integer")
+
+        self.summary = clip(summary, self.summary_budget, keep="end")
+        self.summarized = summarized
+        self.turns = deque()
+        self.turn_tokens = 0
+        for question, answer in turns:
+            self.add(question, answer)
+        return self
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls().load(data)
+
+
+class IssueLog:
+    """Latest questions per user: per_user per user, for the max_users most recently seen users."""
+
+    def __init__(self, per_user=None, max_users=None):
+        self.per_user = per_user or ISSUE_LOG_SIZE
+        self.max_users = max_users or ISSUE_LOG_USERS
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, user_id, question):
+        with self.lock:
+            questions = self.users.get(user_id)
+            if questions is None:
+                questions = self.users[user_id] = deque(maxlen=self.per_user)
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(user_id)
+            questions.append(question)
+
+    def get(self, user_id):
+        with self.lock:
+            return list(self.users.get(user_id, ()))
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def __len__(self):
+        return len(self.users)
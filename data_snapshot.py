@@ -0,0 +1,147 @@
+import logging
+import os
+import sys
+import threading
+import time
+from types import MappingProxyType
+from servicenow_api import load_servicenow_data
+from records import Record
+from telemetry import count_cache, span
+
+log = logging.getLogger(__name__)
+
+
+def approx_size(obj, seen=None):
+    """Rough deep size in bytes of nested dicts/lists/tuples/records/strings."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (dict, MappingProxyType)):
+        size += sum(approx_size(k, seen) + approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v, seen) for v in obj)
+    elif isinstance(obj, Record):
+        size += sum(approx_size(getattr(obj, f), seen) for f in obj.__slots__)
+    return size
+
+
+def freeze(data):
+    # Shallow freeze: the mapping and its lists can't be mutated by a session.
+    # Rows themselves (records and dicts) must be treated as read-only.
+    return MappingProxyType({k: tuple(v) if isinstance(v, list) else v for k, v in data.items()})
+
+
+class SharedSnapshot:
+    """One read-only copy of loader() per process, with a TTL.
+
+    Only the very first get() waits for a load. After the TTL expires, callers
+    keep getting the stale copy while a background thread reloads it
+    (stale-while-revalidate), and the new copy is swapped in atomically.
+    """
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self.data = None
+        self.loaded_at = None
+        self.size_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            data = self.data
+            if data is not None:
+                if time.monotonic() - self.loaded_at < self.ttl:
+                    self.hits += 1
+                    count_cache("snapshot", "hit")
+                    return data
+                self.stale_hits += 1
+                count_cache("snapshot", "stale")
+                self._start_refresh()
+                return data
+            self.misses += 1
+        count_cache("snapshot", "miss")
+
+        # Cold start: concurrent first callers share a single load.
+        with self._load_lock:
+            if self.data is None:
+                self.refresh()
+            return self.data
+
+    def peek(self):
+        """The loaded data, stale or not, without waiting for a load; None before the first load.
+
+        Past the TTL it starts the same background refresh as get().
+        """
+        with self._lock:
+            if self.data is not None and time.monotonic() - self.loaded_at >= self.ttl:
+                self._start_refresh()
+            return self.data
+
+    def _start_refresh(self):
+        # Called with self._lock held
+        if not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self.refresh, name="snapshot-refresh", daemon=True).start()
+
+    def refresh(self):
+        try:
+            with span("snapshot.refresh"):
+                data = freeze(self.loader())
+                size = approx_size(data)
+        except Exception as e:
+            log.warning("Snapshot refresh failed: %s", e)
+            with self._lock:
+                self.failures += 1
+                self._refreshing = False
+            return
+        with self._lock:
+            self.data = data
+            self.size_bytes = size
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+            self._refreshing = False
+
+    def stats(self):
+        with self._lock:
+            requests_seen = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.stale_hits) / requests_seen if requests_seen else 0.0,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "age_seconds": time.monotonic() - self.loaded_at if self.loaded_at else None,
+                "size_bytes": self.size_bytes,
+                "rows": {k: len(v) for k, v in (self.data or {}).items()},
+            }
+
+
+_snapshot = SharedSnapshot(load_servicenow_data, ttl=float(os.getenv("SN_SNAPSHOT_TTL", "900")))
+
+
+def get_servicenow_data():
+    """Shared, read-only load_servicenow_data() result for this process."""
+    return _snapshot.get()
+
+
+def peek_servicenow_data():
+    """get_servicenow_data() if a snapshot is already loaded, else None; never waits for a load.
+
+    A stale snapshot is still refreshed in the background.
+    """
+    return _snapshot.peek()
+
+
+def snapshot_stats():
+    return _snapshot.stats()
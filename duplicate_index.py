@@ -0,0 +1,206 @@
+import os
+import threading
+import zlib
+import numpy as np
+from kb_index import tokenize
+
+SHIFT = np.uint64(32)
+
+
+def shingles(text):
+    """Word tokens plus character 4-grams of each word, so "connect"/"connecting" overlap."""
+    features = set()
+    for word in tokenize(text):
+        features.add("w:" + word)
+        padded = f"<{word}>"
+        for i in range(len(padded) - 3):
+            features.add(padded[i:i + 4])
+    return features
+
+
+class DuplicateIndex:
+    """MinHash/LSH index over ticket short descriptions.
+
+    Each description gets a num_perm MinHash signature; its similarity to
+    another is the fraction of signature slots they share, an estimate of the
+    Jaccard similarity of their shingle sets. Signatures are split into bands,
+    and only tickets sharing a whole band with the query are compared, so a
+    lookup touches a handful of candidates instead of every ticket.
+
+    Band keys live in per-band sorted arrays (binary searched) plus a small
+    dict of recent adds that is merged in every merge_every adds. That keeps
+    hundreds of thousands of tickets at a few tens of MB and adds cheap.
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.5, merge_every=1000, seed=7):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.merge_every = merge_every
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: (a * x + b) >> 32, wrapping at 64 bits
+        self._a = rng.integers(1, 2**63, size=(num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=(num_perm, 1), dtype=np.uint64)
+        self._mix = rng.integers(1, 2**63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self.numbers = []       # id -> ticket number
+        self.descriptions = []  # id -> short description
+        self.ids = {}           # ticket number -> id
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.size = 0
+        self._keys = np.zeros((bands, 0), dtype=np.uint64)  # sorted band keys per band
+        self._key_ids = np.zeros((bands, 0), dtype=np.int64)
+        self._pending = {}      # (band, key) -> [ids] added since the last merge
+        self.lock = threading.RLock()
+
+    def signature(self, text):
+        """MinHash signature of text, or None when it has no usable words."""
+        features = shingles(text)
+        if not features:
+            return None
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint64)
+        return ((self._a * hashes + self._b) >> SHIFT).min(axis=1).astype(np.uint32)
+
+    def _signatures(self, texts):
+        """(indexes of the texts that have words, their signatures), computed in one pass."""
+        offsets, hashes, usable = [], [], []
+        for i, text in enumerate(texts):
+            features = shingles(text)
+            if features:
+                usable.append(i)
+                offsets.append(len(hashes))
+                hashes.extend(zlib.crc32(f.encode("utf-8")) for f in features)
+        if not usable:
+            return usable, np.zeros((0, self.num_perm), dtype=np.uint32)
+        hashed = (self._a * np.array(hashes, dtype=np.uint64) + self._b) >> SHIFT
+        return usable, np.minimum.reduceat(hashed, offsets, axis=1).T.astype(np.uint32)
+
+    def _band_keys(self, signatures):
+        """(n, bands) uint64 key per band of each signature."""
+        banded = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return (banded * self._mix).sum(axis=2)
+
+    def _append(self, pairs, signatures):
+        start = self.size
+        needed = start + len(signatures)
+        if needed > len(self.signatures):
+            grown = np.zeros((max(needed, 2 * len(self.signatures), 1024), self.num_perm), dtype=np.uint32)
+            grown[:start] = self.signatures[:start]
+            self.signatures = grown
+        self.signatures[start:needed] = signatures
+        for offset, (number, desc) in enumerate(pairs):
+            self.ids[number] = start + offset
+            self.numbers.append(number)
+            self.descriptions.append(desc)
+        self.size = needed
+        return start
+
+    def add(self, number, description):
+        """Index one ticket; a number that is already indexed is left as is."""
+        signature = self.signature(description)
+        with self.lock:
+            if signature is None or not number or number in self.ids:
+                return False
+            i = self._append([(number, description)], signature[None, :])
+            for band, key in enumerate(self._band_keys(signature[None, :])[0]):
+                self._pending.setdefault((band, int(key)), []).append(i)
+            if len(self._pending) >= self.merge_every * self.bands:
+                self._merge()
+            return True
+
+    def add_many(self, tickets, chunk=5000):
+        """Index (number, description) pairs in bulk, skipping numbers already indexed.
+
+        Known numbers are dropped before any signature is computed, so
+        re-adding a refreshed history costs a lookup per ticket.
+        """
+        tickets = list(tickets)
+        added = 0
+        for start in range(0, len(tickets), chunk):
+            with self.lock:
+                batch = [t for t in tickets[start:start + chunk] if t[0] and t[0] not in self.ids]
+            if not batch:
+                continue
+            usable, signatures = self._signatures([desc for _, desc in batch])
+            with self.lock:
+                pairs, rows, seen = [], [], set()
+                for j, i in enumerate(usable):
+                    number = batch[i][0]
+                    if number and number not in self.ids and number not in seen:
+                        seen.add(number)
+                        pairs.append(batch[i])
+                        rows.append(j)
+                if not pairs:
+                    continue
+                self._append(pairs, signatures[rows])
+                added += len(pairs)
+        with self.lock:
+            self._merge()
+        return added
+
+    def _merge(self):
+        """Fold pending and newly appended rows into the sorted band arrays."""
+        indexed = self._keys.shape[1]
+        if indexed == self.size:
+            self._pending = {}
+            return
+        new_ids = np.arange(indexed, self.size)
+        keys = np.concatenate([self._keys, self._band_keys(self.signatures[indexed:self.size]).T], axis=1)
+        ids = np.concatenate([self._key_ids, np.broadcast_to(new_ids, (self.bands, len(new_ids)))], axis=1)
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._keys = np.take_along_axis(keys, order, axis=1)
+        self._key_ids = np.take_along_axis(ids, order, axis=1)
+        self._pending = {}
+
+    def query(self, text, k=5, threshold=None):
+        """Up to k indexed tickets similar to text, most similar first.
+
+        Returns [{"number", "short_description", "similarity"}] with similarity
+        at or above threshold (default: the index's threshold).
+        """
+        threshold = self.threshold if threshold is None else threshold
+        signature = self.signature(text)
+        if signature is None:
+            return []
+        band_keys = self._band_keys(signature[None, :])[0]
+        with self.lock:
+            candidates = set()
+            for band, key in enumerate(band_keys):
+                row = self._keys[band]
+                lo, hi = np.searchsorted(row, key, side="left"), np.searchsorted(row, key, side="right")
+                candidates.update(self._key_ids[band, lo:hi].tolist())
+                candidates.update(self._pending.get((band, int(key)), ()))
+            if not candidates:
+                return []
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            scores = (self.signatures[ids] == signature).mean(axis=1)
+            order = np.argsort(-scores)[:k]
+            return [
+                {
+                    "number": self.numbers[ids[i]],
+                    "short_description": self.descriptions[ids[i]],
+                    "similarity": round(float(scores[i]), 3),
+                }
+                for i in order if scores[i] >= threshold
+            ]
+
+    def __len__(self):
+        return self.size
+
+
+def format_duplicates(duplicates):
+    """Markdown list of query() results."""
+    lines = ["⚠️ **Possible duplicates**"]
+    for d in duplicates:
+        lines.append(f"- `{d['number']}` {d['short_description']} ({d['similarity']:.0%} similar)")
+    return "\n".join(lines)
+
+
+duplicate_index = DuplicateIndex(
+    num_perm=int(os.getenv("SNGPT_DUPLICATE_PERMUTATIONS", "64")),
+    bands=int(os.getenv("SNGPT_DUPLICATE_BANDS", "16")),
+    threshold=float(os.getenv("SNGPT_DUPLICATE_THRESHOLD", "0.5"))
+)
@@ -1,16 +1,48 @@
 import os
+import json
+import logging
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import openai
 from openai import OpenAI
 from dotenv import load_dotenv
-import streamlit as st
 from servicenow_api import *
+from intent_classifier import load_or_train
+from intent_router import build_router
+from context_builder import build_context
+from answer_cache import answer_cache
+from duplicate_index import duplicate_index, format_duplicates
+from data_snapshot import peek_servicenow_data
+from resilience import openai_backend, CircuitOpenError, RetryableError, parse_retry_after
+from telemetry import span, trace, in_context, count_cache
+from singleflight import Group, request_key
+from conversation import MEMORY_SUMMARY_TOKENS
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+log = logging.getLogger(__name__)
+# Retries and timeouts come from resilience.openai_backend (see chat_completion)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# "two_call": answer completion, then classify_ticket_category (the original flow)
+# "structured": one JSON completion returning answer, citations and ticket category
+RESPONSE_MODE = os.getenv("SNGPT_RESPONSE_MODE", "two_call")
+
+# Upper bound on KB passage tokens placed in the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("SNGPT_CONTEXT_TOKENS", "3000"))
+
+# Local classifier confidence below which detect_ticket_category asks the LLM instead
+CLASSIFIER_THRESHOLD = float(os.getenv("TICKET_CLASSIFIER_THRESHOLD", "0.7"))
+
+# Identical completions in flight at the same time share one call (see singleflight.py)
+COALESCE_LLM = os.getenv("SNGPT_COALESCE_LLM", "true").lower() == "true"
+llm_flights = Group("openai")
+answer_flights = Group("answer")
 
 # 🔍 Detect ticket inquiries
-def detect_password_reset_intent(question):
-    """Detects if the user's question is about needing a password reset or login help."""
-    q = question.lower()
-    triggers = [
+# Trigger phrases per shortcut intent; SNGPT_INTENTS_FILE can add more (see intent_router.build_router)
+SHORTCUT_PHRASES = {
+    "password_reset": [
         "forgot my password",
         "reset my password",
         "i need to reset my password",
@@ -21,8 +53,24 @@ def detect_password_reset_intent(question):
         "i'm locked out",
         "locked out of my account",
         "lost my password"
-    ]
-    return any(trigger in q for trigger in triggers)
+    ],
+    "open_incidents": ["open incidents"],
+    "open_requests": ["open requests"],
+    "open_tasks": ["open tasks"],
+    "open_work": ["open work", "open tickets"]
+}
+
+# One automaton for every shortcut phrase, built once at import
+intent_router = build_router(SHORTCUT_PHRASES)
+
+def route_question(question):
+    """{intent: Match} for every shortcut intent found in the question."""
+    return intent_router.intents(question)
+
+def detect_password_reset_intent(question, intents=None):
+    """Detects if the user's question is about needing a password reset or login help."""
+    intents = route_question(question) if intents is None else intents
+    return "password_reset" in intents
 
 def format_ticket_list(entries, label):
     if not entries:
@@ -33,14 +81,21 @@ def format_ticket_list(entries, label):
         lines.append(line)
     return "\n".join(lines)
 
-def detect_open_ticket_request(question, user_id):
-    q = question.lower()
-    if "open incidents" in q:
+def detect_open_ticket_request(question, user_id, intents=None):
+    intents = route_question(question) if intents is None else intents
+    if "open_incidents" in intents:
         return format_ticket_list(get_user_open_incidents(user_id), "Incidents")
-    elif "open requests" in q:
+    elif "open_requests" in intents:
         return format_ticket_list(get_user_open_requests(user_id), "Requests")
-    elif "open tasks" in q:
+    elif "open_tasks" in intents:
         return format_ticket_list(get_user_open_tasks(user_id), "Tasks")
+    elif "open_work" in intents:
+        work = get_user_open_work(user_id)
+        return "\n\n".join([
+            format_ticket_list(work["incidents"], "Incidents"),
+            format_ticket_list(work["tasks"], "Tasks"),
+            format_ticket_list(work["requests"], "Requests")
+        ])
     return None
 
 # Ticket routing keywords by category
@@ -115,11 +170,71 @@ CATEGORY_METADATA = {
 }
 
 def track_issue(issue_log, user_id, question):
-    if user_id not in issue_log:
-        issue_log[user_id] = []
-    issue_log[user_id].append(question.lower())
+    """Add the question to the user's entries in an IssueLog (bounded per user)."""
+    issue_log.add(user_id, question.lower())
+
+# Trained from TICKET_KEYWORDS, or loaded from a model retrained on ticket history
+# (python intent_classifier.py <path>) when TICKET_CLASSIFIER_PATH points at one.
+ticket_classifier = load_or_train(TICKET_KEYWORDS, path=os.getenv("TICKET_CLASSIFIER_PATH"))
+
+def classify_ticket_category(question):
+    """Classify locally and only escalate to the LLM when the classifier is unsure.
+
+    Returns {"category", "confidence", "path"}; path is "local" or "llm", and
+    confidence is always the local classifier's.
+    """
+    with span("pipeline.classify") as current:
+        label, confidence = ticket_classifier.predict(question)
+        if confidence >= CLASSIFIER_THRESHOLD:
+            current.set(path="local")
+            return {"category": label, "confidence": confidence, "path": "local"}
+        current.set(path="llm")
+        return {"category": detect_ticket_category_llm(question), "confidence": confidence, "path": "llm"}
 
 def detect_ticket_category(question):
+    return classify_ticket_category(question)["category"]
+
+# Raised by chat_completion once the model is out of retries or its breaker is open
+LLM_UNAVAILABLE = (CircuitOpenError, openai.APIError)
+
+def chat_completion(endpoint, **kwargs):
+    """client.chat.completions.create on gpt-4o-mini under the openai_backend policy for endpoint.
+
+    Rate limits and 5xx responses are retried with backoff (honoring
+    Retry-After), as are connection errors and timeouts. Concurrent calls with
+    the same arguments share one completion, except streams.
+    """
+    timeout = openai_backend.timeout(endpoint)
+    if timeout is not None:
+        kwargs.setdefault("timeout", timeout)
+
+    def send():
+        try:
+            return client.chat.completions.create(model="gpt-4o-mini", **kwargs)
+        except (openai.RateLimitError, openai.InternalServerError) as e:
+            raise RetryableError(e, parse_retry_after(e.response.headers.get("retry-after")))
+
+    def call():
+        with span(f"openai.{endpoint}") as current:
+            response = openai_backend.call(endpoint, send,
+                                           transient=lambda e: isinstance(e, (RetryableError, openai.APIConnectionError)))
+            # Streams report usage in their last chunk instead (see ResponseStream)
+            current.tokens(endpoint, getattr(response, "usage", None))
+            return response
+
+    if COALESCE_LLM and not kwargs.get("stream"):
+        return llm_flights.do(request_key(endpoint, kwargs), call)
+    return call()
+
+def unavailable_answer(kb_context):
+    """Reply built from the KB passages alone, for when the model can't be reached."""
+    if not kb_context["context"]:
+        return ("I'm sorry, the assistant is unavailable right now and no matching knowledge base "
+                "article was found. Please try again shortly or open a ticket.")
+    return ("The assistant is unavailable right now, but these knowledge base excerpts look relevant:\n\n"
+            + kb_context["context"])
+
+def detect_ticket_category_llm(question):
     system_msg = {
         "role": "system",
         "content": (
@@ -133,51 +248,21 @@ def detect_ticket_category(question):
     user_msg = {"role": "user", "content": question}
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[system_msg, user_msg]
-        )
+        response = chat_completion("classify", messages=[system_msg, user_msg])
         category = response.choices[0].message.content.strip().lower()
         return category if category in CATEGORY_METADATA else None
     except Exception as e:
-        print("Category detection error:", e)
+        log.warning("Category detection error: %s", e)
         return None
 
-def generate_response(user_id, question, kb_articles, issue_log, confirm_ticket=False, stored_metadata=None):
-    # 🔐 Check password reset first
-    if detect_password_reset_intent(question):
-        answer = (
-            f"Hi {user_id}, it looks like you're having trouble with your password or login. "
-            "You can press the **Reset Password** button below to begin the reset process."
-        )
-        return answer, { "type": "password_reset" }
-
-    # 🧾 Check for open ticket listing next
-    ticket_status_response = detect_open_ticket_request(question, user_id)
-    if ticket_status_response:
-        return ticket_status_response, None
+def build_kb_prompt(question, kb_articles):
+    """Returns (prompt, kb_context); kb_context is the build_context() result that went into it.
 
-    # Handle ticket status queries first
-    ticket_status_response = detect_open_ticket_request(question, user_id)
-    if ticket_status_response:
-        return ticket_status_response, None
-
-    track_issue(issue_log, user_id, question)
-
-    st.sidebar.markdown("### 📚 KB Articles Sent to GPT")
-    if not kb_articles:
-        st.sidebar.warning("⚠️ No knowledge base articles were found!")
-    else:
-        for a in kb_articles:
-            st.sidebar.write(f"- {a['title']}")
-
-    numbered_articles = []
-    context = ""
-    for i, a in enumerate(kb_articles, 1):
-        title = a["title"]
-        content = a["content"]
-        numbered_articles.append(f"{i}. {title}")
-        context += f"\n\n[{i}] {title}\n{content.strip()}"
+    The prompt holds nothing about the asking user, so its answer can be
+    cached for (and shared with) everyone asking the same question.
+    """
+    kb_context = build_context(question, kb_articles, token_budget=CONTEXT_TOKEN_BUDGET)
+    context = kb_context["context"]
 
     prompt = f"""You are an IT support assistant. The user has a question, and you must answer ONLY using the information below from the company's internal knowledge base.
 
@@ -186,7 +271,6 @@ DO NOT guess or use general knowledge. Instead, interpret the relevant content f
 If the answer is not found, say:
 "I'm sorry, I couldn’t find that information in the company’s knowledge base."
 
-User: {user_id}
 Question: {question}
 
 Relevant Articles (use as background information):
@@ -194,18 +278,132 @@ Relevant Articles (use as background information):
 
 Now, based on the articles above, answer the user's question as clearly and accurately as possible.
 """
+    return prompt, kb_context
+
+def context_usage(kb_context):
+    """Summary of what build_kb_prompt put in the prompt, for diagnostics."""
+    return {
+        "tokens": kb_context["tokens"],
+        "passages": len(kb_context["passages"]),
+        "citations": kb_context["citations"]
+    }
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}]
+STRUCTURED_INSTRUCTIONS = (
+    "Reply with a JSON object with exactly these keys:\n"
+    '- "answer": your answer to the user, as markdown\n'
+    '- "cited_articles": the article numbers (e.g. "KB0010001") you used, as a list\n'
+    '- "ticket_category": one of ' + ", ".join(CATEGORY_METADATA) + ', or "none" if no ticket fits'
+)
+
+def answer_with_category(prompt, question, kb_articles, history=()):
+    """One completion that returns the answer, its citations and the ticket category.
+
+    The category is validated against CATEGORY_METADATA and citations against the
+    articles actually sent. If the reply isn't valid JSON, the raw text is used as
+    the answer and the category comes from classify_ticket_category.
+    """
+    completion = chat_completion(
+        "structured",
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": STRUCTURED_INSTRUCTIONS},
+            *history,
+            {"role": "user", "content": prompt}
+        ]
     )
-    answer = completion.choices[0].message.content
+    content = completion.choices[0].message.content
+    try:
+        reply = json.loads(content)
+        answer = str(reply["answer"])
+    except (ValueError, KeyError, TypeError):
+        log.warning("Structured response was not valid JSON; falling back to local classification")
+        return content, classify_ticket_category(question)["category"]
+
+    category = str(reply.get("ticket_category") or "").strip().lower()
+    known = {a.get("number", "") for a in kb_articles}
+    # JSON mode doesn't enforce the schema: anything but a list of article numbers cites nothing
+    cited = reply.get("cited_articles")
+    cited = [n for n in cited if isinstance(n, str) and n in known] if isinstance(cited, list) else []
+    if cited:
+        answer += "\n\n📚 Sources: " + ", ".join(cited)
+    return answer, category if category in CATEGORY_METADATA else None
+
+def generate_answer(prompt, question, kb_articles, mode, history=()):
+    """(answer, ticket_category) from the model; ticket_category is None unless mode is "structured".
+
+    history is the conversation so far as chat messages (ConversationMemory.messages()).
+    The KB prompt doesn't name the user, so concurrent calls with the same
+    prompt and history share one completion whoever is asking.
+    """
+    def generate():
+        if mode == "structured":
+            answer, category = answer_with_category(prompt, question, kb_articles, history)
+        else:
+            completion = chat_completion("answer", messages=[*history, {"role": "user", "content": prompt}])
+            answer, category = completion.choices[0].message.content, None
+        return answer, category
+
+    if COALESCE_LLM:
+        return answer_flights.do(request_key(mode, prompt, history), generate)
+    return generate()
+
+SUMMARY_INSTRUCTIONS = (
+    "You summarize IT support conversations. Combine the summary so far with the new turns into a few "
+    "sentences: keep the user's problems, devices and systems, what was already tried or suggested, and "
+    "any ticket or article numbers. Reply with the summary only."
+)
+
+def summarize_conversation(summary, turns):
+    """Rolling summary for ConversationMemory: the old summary plus the turns it no longer keeps.
+
+    Returns None if the model can't be reached; the memory then falls back to
+    an extractive summary.
+    """
+    transcript = "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+    try:
+        completion = chat_completion("summarize", max_tokens=MEMORY_SUMMARY_TOKENS, messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": f"Summary so far: {summary or '(none)'}\n\nNew turns:\n{transcript}"}
+        ])
+        return completion.choices[0].message.content
+    except LLM_UNAVAILABLE as e:
+        log.warning("Conversation summary failed: %s", e)
+        return None
 
-    ticket_category = detect_ticket_category(question)
+def remember(memory, question, answer):
+    """Add a finished turn to the conversation memory, when there is one."""
+    if memory is not None and answer:
+        with span("pipeline.remember") as current:
+            memory.add(question, answer, summarize=summarize_conversation)
+            current.set(turns=len(memory), tokens=memory.tokens())
+
+def shortcut_response(user_id, question):
+    """Replies that need no KB lookup or LLM call, as (answer, metadata); None otherwise."""
+    # One pass over the question finds every shortcut intent
+    intents = route_question(question)
+
+    # 🔐 Check password reset first
+    if detect_password_reset_intent(question, intents):
+        answer = (
+            f"Hi {user_id}, it looks like you're having trouble with your password or login. "
+            "You can press the **Reset Password** button below to begin the reset process."
+        )
+        return answer, { "type": "password_reset" }
+
+    # 🧾 Check for open ticket listing next
+    ticket_status_response = detect_open_ticket_request(question, user_id, intents)
+    if ticket_status_response:
+        return ticket_status_response, None
+
+    return None
+
+def finish_response(user_id, question, answer, ticket_category, confirm_ticket=False):
+    """Attach ticket metadata (or create the ticket) once the answer is known."""
     if ticket_category:
         intent_metadata = CATEGORY_METADATA[ticket_category]
         if confirm_ticket:
-            result = create_ticket_from_intent(user_id, question, intent_metadata, answer)
+            # The answer is not ticket details: the ticket comes from the intent metadata
+            result = create_ticket_from_intent(user_id, question, intent_metadata)
             return f"{answer}\n\n{result['message']}", intent_metadata
         else:
             answer += "\n\n⚠️ This request may require a ticket. Please confirm if you'd like to open one."
@@ -213,9 +411,285 @@ Now, based on the articles above, answer the user's question as clearly and accu
 
     return answer, None
 
+def cached_answer(question, kb_articles, mode, diagnostics):
+    """(answer, ticket_category) from the answer cache, or None on a miss."""
+    if not kb_articles:
+        return None
+    cached = answer_cache.get(question, kb_articles, f"gpt-4o-mini:{mode}")
+    count_cache("answer", cached[2] if cached else "miss")
+    if cached:
+        diagnostics["cache"] = cached[2]
+        return cached[0], cached[1]
+    return None
+
+def store_answer(question, kb_articles, mode, answer, ticket_category):
+    # Answers without KB articles aren't tied to anything that would invalidate them
+    if kb_articles:
+        answer_cache.put(question, kb_articles, f"gpt-4o-mini:{mode}", answer, ticket_category)
+
+def generate_response(user_id, question, kb_articles, issue_log, confirm_ticket=False, stored_metadata=None,
+                      response_mode=None, diagnostics=None, memory=None):
+    """Returns (answer, metadata).
+
+    Pass a dict as diagnostics to have it filled with what went into the answer
+    (KB articles, prompt context, cache tier, classification, mode and timing)
+    for the caller to display or log. With a ConversationMemory as memory the
+    model also sees the conversation so far; the caller records the new turn.
+    """
+    diagnostics = {} if diagnostics is None else diagnostics
+    with span("pipeline.shortcuts"):
+        shortcut = shortcut_response(user_id, question)
+    if shortcut:
+        diagnostics["mode"] = "shortcut"
+        return shortcut
+
+    track_issue(issue_log, user_id, question)
+    diagnostics["kb_articles"] = [a["title"] for a in kb_articles]
+
+    mode = response_mode or RESPONSE_MODE
+    diagnostics["mode"] = mode
+    history = memory.messages() if memory else []
+    if history:
+        diagnostics["memory"] = memory.stats()
+    # Cached answers ignore earlier turns, so only the first question of a conversation uses the cache
+    with span("pipeline.cache_lookup"):
+        cached = None if history else cached_answer(question, kb_articles, mode, diagnostics)
+    if cached:
+        with span("pipeline.finish"):
+            return finish_response(user_id, question, cached[0], cached[1], confirm_ticket)
+
+    with span("pipeline.build_prompt") as current:
+        prompt, kb_context = build_kb_prompt(question, kb_articles)
+        diagnostics["context"] = context_usage(kb_context)
+        current.set(tokens=kb_context["tokens"], passages=len(kb_context["passages"]))
+
+    started = time.perf_counter()
+    try:
+        with span("pipeline.answer", mode=mode):
+            answer, ticket_category = generate_answer(prompt, question, kb_articles, mode, history)
+    except LLM_UNAVAILABLE as e:
+        log.warning("Answer generation failed: %s", e)
+        diagnostics["degraded"] = True
+        answer, ticket_category = unavailable_answer(kb_context), None
+
+    if mode != "structured" or diagnostics.get("degraded"):
+        classification = classify_ticket_category(question)
+        ticket_category = classification["category"]
+        diagnostics["classification"] = classification
+    diagnostics["seconds"] = time.perf_counter() - started
+    if not diagnostics.get("degraded") and not history:
+        store_answer(question, kb_articles, mode, answer, ticket_category)
+
+    with span("pipeline.finish"):
+        return finish_response(user_id, question, answer, ticket_category, confirm_ticket)
+
+_stream_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SNGPT_CLASSIFY_WORKERS", "8")),
+                                      thread_name_prefix="classify")
+
+class ResponseStream:
+    """Iterate to receive answer text as the model produces it.
+
+    Once iteration finishes, .answer and .metadata hold the same (answer, metadata)
+    pair generate_response would have returned, ticket suggestion included, and
+    .diagnostics the same details generate_response(diagnostics=...) fills in,
+    plus the latency waterfall under "trace". With kb_articles=None the articles
+    are looked up once the question turns out not to be a shortcut. A
+    ConversationMemory passed as memory goes into the prompt and gets the turn
+    added once the answer is complete.
+    """
+
+    def __init__(self, user_id, question, kb_articles, issue_log, confirm_ticket=False, memory=None):
+        self.user_id = user_id
+        self.question = question
+        self.kb_articles = kb_articles
+        self.issue_log = issue_log
+        self.confirm_ticket = confirm_ticket
+        self.memory = memory
+        self.answer = None
+        self.metadata = None
+        self.first_token_seconds = None
+        self.diagnostics = {}
+
+    def __iter__(self):
+        with trace("answer_stream") as current:
+            yield from self._generate()
+            remember(self.memory, self.question, self.answer)
+        self.diagnostics["trace"] = current.waterfall()
+
+    def _generate(self):
+        with span("pipeline.shortcuts"):
+            shortcut = shortcut_response(self.user_id, self.question)
+        if shortcut:
+            self.diagnostics["mode"] = "shortcut"
+            self.answer, self.metadata = shortcut
+            yield self.answer
+            return
+
+        if self.kb_articles is None:
+            with span("pipeline.kb_retrieval") as retrieval:
+                self.kb_articles = query_kb_articles(query=self.question) or []
+                retrieval.set(articles=len(self.kb_articles))
+
+        track_issue(self.issue_log, self.user_id, self.question)
+        self.diagnostics["kb_articles"] = [a["title"] for a in self.kb_articles]
+        self.diagnostics["mode"] = "stream"
+        history = self.memory.messages() if self.memory else []
+        if history:
+            self.diagnostics["memory"] = self.memory.stats()
+
+        with span("pipeline.cache_lookup"):
+            cached = None if history else cached_answer(self.question, self.kb_articles, "two_call",
+                                                        self.diagnostics)
+        if cached:
+            with span("pipeline.finish"):
+                self.answer, self.metadata = finish_response(
+                    self.user_id, self.question, cached[0], cached[1], self.confirm_ticket
+                )
+            yield self.answer
+            return
+
+        # Classify while the answer streams; a local hit finishes long before the
+        # first token, and an LLM fallback overlaps with generation.
+        classification = _stream_executor.submit(in_context(classify_ticket_category), self.question)
+
+        with span("pipeline.build_prompt") as current:
+            prompt, kb_context = build_kb_prompt(self.question, self.kb_articles)
+            self.diagnostics["context"] = context_usage(kb_context)
+            current.set(tokens=kb_context["tokens"], passages=len(kb_context["passages"]))
+
+        started = time.perf_counter()
+        parts = []
+        try:
+            with span("pipeline.answer", mode="stream") as stage:
+                # Only opening the stream is retried; once tokens flow a failure ends the answer
+                stream = chat_completion("stream", messages=[*history, {"role": "user", "content": prompt}], stream=True,
+                                         stream_options={"include_usage": True})
+                for chunk in stream:
+                    if not chunk.choices:
+                        stage.tokens("stream", getattr(chunk, "usage", None))
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if self.first_token_seconds is None:
+                            self.first_token_seconds = time.perf_counter() - started
+                            stage.set(first_token_ms=round(self.first_token_seconds * 1000, 1))
+                        parts.append(token)
+                        yield token
+        except LLM_UNAVAILABLE as e:
+            log.warning("Answer stream failed: %s", e)
+            self.diagnostics["degraded"] = True
+            fallback = ("\n\n⚠️ The answer was cut short. Please ask again." if parts
+                        else unavailable_answer(kb_context))
+            parts.append(fallback)
+            yield fallback
+
+        streamed = "".join(parts)
+        classification = classification.result()
+        self.diagnostics["classification"] = classification
+        self.diagnostics["seconds"] = time.perf_counter() - started
+        if not self.diagnostics.get("degraded") and not history:
+            store_answer(self.question, self.kb_articles, "two_call", streamed, classification["category"])
+        with span("pipeline.finish"):
+            answer, self.metadata = finish_response(
+                self.user_id, self.question, streamed, classification["category"], self.confirm_ticket
+            )
+        # Anything finish_response appended (ticket prompt/preview) goes out as a final chunk
+        tail = answer[len(streamed):]
+        if tail:
+            yield tail
+        self.answer = answer
+
+def generate_response_stream(user_id, question, kb_articles, issue_log, confirm_ticket=False, memory=None):
+    """Streaming variant of generate_response; see ResponseStream."""
+    return ResponseStream(user_id, question, kb_articles, issue_log, confirm_ticket, memory)
+
+def answer_question(user_id, question, issue_log, confirm_ticket=False, response_mode=None, memory=None):
+    """Look up KB articles for the question and answer it: {answer, metadata, diagnostics}.
+
+    With a ConversationMemory as memory the answer takes the conversation so
+    far into account, and the turn is added to it.
+    """
+    diagnostics = {}
+    with trace("answer_question") as current:
+        with span("pipeline.kb_retrieval") as retrieval:
+            kb_articles = query_kb_articles(query=question) or []
+            retrieval.set(articles=len(kb_articles))
+        answer, metadata = generate_response(user_id, question, kb_articles, issue_log, confirm_ticket=confirm_ticket,
+                                             response_mode=response_mode, diagnostics=diagnostics, memory=memory)
+        remember(memory, question, answer)
+    diagnostics["trace"] = current.waterfall()
+    return {"answer": answer, "metadata": metadata, "diagnostics": diagnostics}
+
+def answer_question_stream(user_id, question, issue_log, confirm_ticket=False, memory=None):
+    """Streaming answer_question: a ResponseStream that looks up the question's KB articles itself."""
+    return generate_response_stream(user_id, question, None, issue_log, confirm_ticket, memory)
+
+class ResetLockout:
+    """Failed phone checks per user; max_failures within lockout seconds locks the user out until they age out.
+
+    Enforced here rather than in the UI so every caller of the agent (the app,
+    agent_service clients) gets the same limit. Kept in process memory, for at
+    most max_users users.
+    """
+
+    def __init__(self, max_failures=2, lockout=900, max_users=10000):
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self.max_users = max_users
+        self.failures = OrderedDict()  # user_id -> monotonic times of recent failures
+        self.lock = threading.Lock()
+
+    def _recent(self, user_id, now):
+        times = [t for t in self.failures.get(user_id, ()) if now - t < self.lockout]
+        if times:
+            self.failures[user_id] = times
+        else:
+            self.failures.pop(user_id, None)
+        return times
+
+    def locked(self, user_id):
+        with self.lock:
+            return len(self._recent(user_id, time.monotonic())) >= self.max_failures
+
+    def failed(self, user_id):
+        """Record a failure; True if the user is now locked out."""
+        with self.lock:
+            now = time.monotonic()
+            times = self._recent(user_id, now) + [now]
+            self.failures[user_id] = times
+            self.failures.move_to_end(user_id)
+            while len(self.failures) > self.max_users:
+                self.failures.popitem(last=False)
+            return len(times) >= self.max_failures
+
+    def clear(self, user_id):
+        with self.lock:
+            self.failures.pop(user_id, None)
+
+# Failed phone checks allowed per user before password reset locks for SNGPT_RESET_LOCKOUT seconds
+reset_lockout = ResetLockout(max_failures=int(os.getenv("SNGPT_RESET_MAX_ATTEMPTS", "2")),
+                             lockout=float(os.getenv("SNGPT_RESET_LOCKOUT", "900")))
+
+def reset_password_if_verified(user_id, phone):
+    """Reset the user's password only if phone matches the number on their record.
+
+    Returns {"verified", "password", "locked"}; after too many wrong phones
+    the user is locked out and the phone is not checked at all.
+    """
+    if reset_lockout.locked(user_id):
+        log.warning("Password reset for %s refused: locked out after failed phone checks", user_id)
+        return {"verified": False, "password": None, "locked": True}
+    correct_phone = get_user_phone_number(user_id)
+    if not correct_phone or (phone or "").strip() != correct_phone:
+        locked = reset_lockout.failed(user_id)
+        return {"verified": False, "password": None, "locked": locked}
+    reset_lockout.clear(user_id)
+    return {"verified": True, "password": reset_user_password(user_id), "locked": False}
+
 def build_description(context, issue):
-    name = context["user"].get("name", "Unknown User")
-    email = context["user"].get("email", "not provided")
+    user = context.get("user") or {}
+    name = user.get("name", "Unknown User")
+    email = user.get("email", "not provided")
     device = context.get("devices")[0] if context.get("devices") else "unspecified device"
     return (
         f"Hi, this user {name} needs help with the following issue:\n"
@@ -223,8 +697,33 @@ def build_description(context, issue):
         f"They currently use a {device}. Their work email is {email}."
     )
 
+_duplicate_source = None
+_duplicate_lock = threading.Lock()
+
+def sync_duplicate_index(data):
+    """Index the tickets of a new snapshot in the background; numbers already indexed are skipped."""
+    global _duplicate_source
+    with _duplicate_lock:
+        if data is _duplicate_source:
+            return
+        _duplicate_source = data
+    tickets = data.get("previous_tickets", ())
+    threading.Thread(target=duplicate_index.add_many, args=(tickets,), name="duplicate-index", daemon=True).start()
+
+def find_duplicate_tickets(issue, k=3):
+    """Existing tickets whose short description is close to the issue: [{number, short_description, similarity}].
+
+    Uses whatever snapshot is already loaded rather than loading one, so
+    ticket creation never waits on a cold snapshot; until the history has
+    been indexed there are simply no duplicates.
+    """
+    data = peek_servicenow_data()
+    if data is not None:
+        sync_duplicate_index(data)
+    return duplicate_index.query(issue, k=k)
+
 def create_ticket_from_intent(user_id, issue, intent_metadata, confirm_data=None):
-    context = get_user_context(user_id)
+    duplicates = find_duplicate_tickets(issue)
 
     # Prefer confirm_data > intent_metadata > fallback defaults
     short_desc = confirm_data.get("short_description") if confirm_data else intent_metadata.get("short_description", issue)
@@ -235,7 +734,11 @@ def create_ticket_from_intent(user_id, issue, intent_metadata, confirm_data=None
     # ✅ Default ticket type = incident
     ticket_type = (confirm_data.get("type") if confirm_data else intent_metadata.get("type")) or "incident"
 
-    description = confirm_data.get("description") if confirm_data and confirm_data.get("description") else build_description(context, issue)
+    # User context is only needed to write the description; get_user_context sends
+    # its lookups as one batch request (see servicenow_api.BATCH_LOOKUPS)
+    description = confirm_data.get("description") if confirm_data else None
+    if not description:
+        description = build_description(get_user_context(user_id), issue)
 
     ticket = open_ticket(
         user_id=user_id,
@@ -257,6 +760,9 @@ def create_ticket_from_intent(user_id, issue, intent_metadata, confirm_data=None
     )
     ticket_type_display = (ticket.get("type") or ticket_type or "incident").capitalize()
     ticket_link = ticket.get("link", "#")
+    if ticket_number not in ("Error", "UNKNOWN"):
+        # Later tickets about the same problem should find this one
+        duplicate_index.add(ticket_number, issue)
 
     return {
         "message": f"""
@@ -270,6 +776,7 @@ def create_ticket_from_intent(user_id, issue, intent_metadata, confirm_data=None
 - Description: {description}
 
 🔗 [View Ticket in ServiceNow]({ticket_link})
-""",
-        "ticket": ticket
+""" + (f"\n{format_duplicates(duplicates)}\n" if duplicates else ""),
+        "ticket": ticket,
+        "duplicates": duplicates
     }
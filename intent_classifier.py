@@ -0,0 +1,150 @@
+import json
+import math
+import os
+from collections import Counter, defaultdict
+from kb_index import TOKEN_RE, tokenize
+from intent_router import IntentRouter
+
+
+def features(text):
+    """Word unigrams plus adjacent-word bigrams."""
+    words = tokenize(text)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TicketClassifier:
+    """Multinomial Naive Bayes over word uni/bigrams, small enough to train at import.
+
+    predict() returns (label, confidence), where confidence is the posterior of
+    the winning label. With no known words in a question the posterior falls
+    back to the label priors, so vague questions come out as low-confidence.
+    """
+
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.labels = []
+        self.log_prior = {}
+        self.log_likelihood = {}  # label -> {feature: log P(feature | label)}
+        self.log_unseen = {}      # label -> log P(unseen feature | label)
+        self.vocabulary = set()
+
+    def fit(self, examples):
+        """Train from (text, label) pairs."""
+        counts = defaultdict(Counter)
+        docs = Counter()
+        for text, label in examples:
+            counts[label].update(features(text))
+            docs[label] += 1
+
+        self.labels = sorted(counts)
+        self.vocabulary = set().union(*counts.values()) if counts else set()
+        total_docs = sum(docs.values())
+        vocab_size = len(self.vocabulary)
+        for label in self.labels:
+            total = sum(counts[label].values()) + self.alpha * vocab_size
+            self.log_prior[label] = math.log(docs[label] / total_docs)
+            self.log_likelihood[label] = {
+                f: math.log((n + self.alpha) / total) for f, n in counts[label].items()
+            }
+            self.log_unseen[label] = math.log(self.alpha / total)
+        return self
+
+    def predict_proba(self, text):
+        known = [f for f in features(text) if f in self.vocabulary]
+        scores = {}
+        for label in self.labels:
+            likelihood = self.log_likelihood[label]
+            unseen = self.log_unseen[label]
+            scores[label] = self.log_prior[label] + sum(likelihood.get(f, unseen) for f in known)
+        top = max(scores.values(), default=0.0)
+        exp = {label: math.exp(s - top) for label, s in scores.items()}
+        norm = sum(exp.values()) or 1.0
+        return {label: v / norm for label, v in exp.items()}
+
+    def predict(self, text):
+        proba = self.predict_proba(text)
+        if not proba:
+            return None, 0.0
+        label = max(proba, key=proba.get)
+        return label, proba[label]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "alpha": self.alpha,
+                "labels": self.labels,
+                "log_prior": self.log_prior,
+                "log_likelihood": self.log_likelihood,
+                "log_unseen": self.log_unseen,
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        model = cls(alpha=state["alpha"])
+        model.labels = state["labels"]
+        model.log_prior = state["log_prior"]
+        model.log_likelihood = state["log_likelihood"]
+        model.log_unseen = state["log_unseen"]
+        model.vocabulary = set().union(*(set(v) for v in model.log_likelihood.values()))
+        return model
+
+
+def keyword_examples(keywords):
+    """One (phrase, label) training example per keyword in a TICKET_KEYWORDS-style map."""
+    return [(phrase, label) for label, phrases in keywords.items() for phrase in phrases]
+
+
+def word_text(text):
+    """Lowercase word tokens joined by single spaces, with a space at each end."""
+    return " " + " ".join(TOKEN_RE.findall(text.lower())) + " "
+
+
+def keyword_router(keywords):
+    """IntentRouter over the keyword phrases that only matches whole words.
+
+    Phrases and text both go through word_text(), so "ram" matches "add ram"
+    but not "program", and "eta" not "details".
+    """
+    return IntentRouter({label: [word_text(p) for p in phrases] for label, phrases in keywords.items()})
+
+
+def weak_label(text, router):
+    """Label text by keyword hits, or None when no label or several labels match.
+
+    router is keyword_router(keywords).
+    """
+    hits = router.intents(word_text(text))
+    return next(iter(hits)) if len(hits) == 1 else None
+
+
+def train(keywords, history=(), labeled=()):
+    """Train from keyword phrases, weakly labeled ticket history and explicit (text, label) pairs."""
+    examples = keyword_examples(keywords) + list(labeled)
+    router = keyword_router(keywords)
+    for desc in history:
+        label = weak_label(desc, router)
+        if label:
+            examples.append((desc, label))
+    return TicketClassifier().fit(examples)
+
+
+def load_or_train(keywords, path=None):
+    """Load a trained model from path if it exists, otherwise train on keywords alone."""
+    if path and os.path.exists(path):
+        return TicketClassifier.load(path)
+    return train(keywords)
+
+
+if __name__ == "__main__":
+    # Retrain from ticket history: python intent_classifier.py [output path]
+    import sys
+    from gpt_agent import TICKET_KEYWORDS
+    from servicenow_api import load_servicenow_data
+
+    out = sys.argv[1] if len(sys.argv) > 1 else os.getenv("TICKET_CLASSIFIER_PATH", "ticket_classifier.json")
+    history = load_servicenow_data()["previous_ticket_descriptions"]
+    model = train(TICKET_KEYWORDS, history=history)
+    model.save(out)
+    print(f"Trained on {len(history)} historical descriptions; saved to {out}")
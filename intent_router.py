@@ -0,0 +1,105 @@
+import json
+import os
+from collections import deque, namedtuple
+
+Match = namedtuple("Match", "intent phrase start end")
+
+
+class IntentRouter:
+    """Aho-Corasick automaton over intent phrases.
+
+    Built once from {intent: [phrases]}; scan() finds every phrase occurrence
+    in a single pass over the lowercased text, however many phrases there are.
+    Matching is by substring, like the `phrase in question.lower()` checks it
+    replaces. Positions index into question.lower().
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = {}
+        for intent, phrases in (patterns or {}).items():
+            self.add(intent, phrases)
+        self.build()
+
+    def add(self, intent, phrases):
+        """Register phrases for an intent; call build() afterwards."""
+        self.patterns.setdefault(intent, [])
+        for phrase in phrases:
+            phrase = phrase.lower()
+            if phrase and phrase not in self.patterns[intent]:
+                self.patterns[intent].append(phrase)
+
+    def build(self):
+        goto = [{}]
+        outputs = [[]]
+        for intent, phrases in self.patterns.items():
+            for phrase in phrases:
+                state = 0
+                for ch in phrase:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[state][ch] = nxt
+                        goto.append({})
+                        outputs.append([])
+                    state = nxt
+                outputs[state].append((intent, phrase))
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                # Inherit matches that end here via the suffix link
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+
+        self._goto, self._fail, self._outputs = goto, fail, outputs
+
+    def scan(self, text):
+        """Every phrase occurrence in text, as Match tuples in order of end position."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = []
+        state = 0
+        for i, ch in enumerate(text.lower()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for intent, phrase in outputs[state]:
+                matches.append(Match(intent, phrase, i + 1 - len(phrase), i + 1))
+        return matches
+
+    def intents(self, text):
+        """{intent: first Match} for each intent found in text."""
+        found = {}
+        for m in self.scan(text):
+            found.setdefault(m.intent, m)
+        return found
+
+
+def load_patterns(path):
+    """Read extra {intent: [phrases]} from a JSON file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_router(*pattern_maps, config_path=None):
+    """Router over the given pattern maps plus an optional JSON config file.
+
+    config_path defaults to SNGPT_INTENTS_FILE, so new trigger phrases (or new
+    intents) can be added without a code change.
+    """
+    router = IntentRouter()
+    for patterns in pattern_maps:
+        for intent, phrases in patterns.items():
+            router.add(intent, phrases)
+    config_path = config_path or os.getenv("SNGPT_INTENTS_FILE")
+    if config_path:
+        for intent, phrases in load_patterns(config_path).items():
+            router.add(intent, phrases)
+    router.build()
+    return router
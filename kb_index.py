@@ -0,0 +1,110 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from records import Article
+
+TAG_RE = re.compile(r"<[^>]+>")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in into is it its me my no not of on or our so
+that the their then there these this to was we what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with HTML tags and common stopwords removed."""
+    text = TAG_RE.sub(" ", text or "").lower()
+    return [t for t in TOKEN_RE.findall(text) if t not in STOPWORDS]
+
+
+class KBIndex:
+    """In-memory BM25 inverted index over published KB articles.
+
+    Articles are keyed by number. apply_changes() takes rows from kb_knowledge
+    (full load or a sys_updated_on delta) and adds, replaces or drops them, so
+    the index can be kept in sync without rebuilding it.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, title_weight=2):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.articles = {}   # number -> Article
+        self.postings = {}   # term -> {number: term frequency}
+        self.doc_terms = {}  # number -> Counter of terms (needed to remove a doc)
+        self.doc_len = {}    # number -> token count
+        self.total_len = 0
+        self.last_updated = ""
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.articles)
+
+    def add(self, article):
+        number = article["number"]
+        terms = Counter(tokenize(article.get("title", "")) * self.title_weight)
+        terms.update(tokenize(article.get("content", "")))
+        with self.lock:
+            self.remove(number)
+            self.articles[number] = article
+            self.doc_terms[number] = terms
+            self.doc_len[number] = sum(terms.values())
+            self.total_len += self.doc_len[number]
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[number] = tf
+
+    def remove(self, number):
+        with self.lock:
+            terms = self.doc_terms.pop(number, None)
+            if terms is None:
+                return
+            self.articles.pop(number, None)
+            self.total_len -= self.doc_len.pop(number)
+            for term in terms:
+                docs = self.postings.get(term)
+                if docs is not None:
+                    docs.pop(number, None)
+                    if not docs:
+                        del self.postings[term]
+
+    def apply_changes(self, records):
+        """Apply kb_knowledge rows; returns (changed numbers, removed numbers)."""
+        changed, removed = [], []
+        with self.lock:
+            for r in records:
+                number = r.get("number")
+                if not number:
+                    continue
+                updated = r.get("sys_updated_on", "")
+                if updated > self.last_updated:
+                    self.last_updated = updated
+                published = r.get("active", "true") == "true" and r.get("workflow", "published") == "published"
+                if published and r.get("text"):
+                    self.add(Article.from_row(r))
+                    changed.append(number)
+                elif number in self.articles:
+                    self.remove(number)
+                    removed.append(number)
+        return changed, removed
+
+    def search(self, query, k=10):
+        """Return up to k (score, article) pairs ranked by BM25."""
+        terms = set(tokenize(query))
+        with self.lock:
+            n = len(self.articles)
+            if not n or not terms:
+                return []
+            avg_len = self.total_len / n
+            scores = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for number, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[number] / avg_len)
+                    scores[number] = scores.get(number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self.articles[number]) for number, score in top]
@@ -0,0 +1,168 @@
+import html
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "form", "iframe", "svg", "button"}
+BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "pre", "blockquote", "section", "article", "hr"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+BOILERPLATE_RE = re.compile(
+    r"^(was this (article|page) helpful\??.*|back to top|table of contents|print this (article|page)|"
+    r"rate this article.*|click here to (view|open).*|you must be logged in.*)$",
+    re.I
+)
+
+
+class _ArticleParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.in_heading = False
+        self.heading = []
+        self.line = []
+        self.sections = [{"heading": "", "lines": []}]
+
+    def _flush_line(self):
+        text = " ".join("".join(self.line).split())
+        self.line = []
+        if text and not BOILERPLATE_RE.match(text):
+            self.sections[-1]["lines"].append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif self.skip_depth:
+            return
+        elif tag in HEADING_TAGS:
+            self._flush_line()
+            self.in_heading = True
+            self.heading = []
+        elif tag in BLOCK_TAGS:
+            self._flush_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.skip_depth and tag in BLOCK_TAGS:
+            self._flush_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif self.skip_depth:
+            return
+        elif tag in HEADING_TAGS and self.in_heading:
+            self.in_heading = False
+            heading = " ".join("".join(self.heading).split())
+            if heading:
+                self.sections.append({"heading": heading, "lines": []})
+        elif tag in BLOCK_TAGS:
+            self._flush_line()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        (self.heading if self.in_heading else self.line).append(data.replace("\xa0", " "))
+
+    def close(self):
+        super().close()
+        self._flush_line()
+
+
+def clean_html(raw):
+    """Strip markup, scripts and boilerplate from article HTML.
+
+    Returns {"text": plain text, one paragraph per line, "sections":
+    [{"heading", "text"}, ...]}. Headings start new sections; text before the
+    first heading goes in a section with an empty heading.
+    """
+    parser = _ArticleParser()
+    # KB bodies are sometimes entity-encoded twice ("&amp;nbsp;")
+    parser.feed(html.unescape(raw or "") if "&amp;" in (raw or "") else raw or "")
+    parser.close()
+
+    sections = [
+        {"heading": s["heading"], "text": "\n".join(s["lines"])}
+        for s in parser.sections if s["heading"] or s["lines"]
+    ]
+    text = "\n".join(
+        "\n".join(filter(None, [s["heading"], s["text"]])) for s in sections
+    )
+    return {"text": text, "sections": sections}
+
+
+class CleanedArticleStore:
+    """Cleaned articles keyed by number, valid for one sys_updated_on version.
+
+    In memory by default; with a path the entries also go to SQLite, so a
+    restart doesn't re-clean articles that haven't changed.
+    """
+
+    def __init__(self, path=None):
+        self.entries = {}  # number -> (sys_updated_on, cleaned)
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS kb_clean ("
+                "number TEXT PRIMARY KEY, sys_updated_on TEXT, text TEXT, sections TEXT)"
+            )
+            for number, updated, text, sections in self.db.execute("SELECT * FROM kb_clean"):
+                self.entries[number] = (updated, {"text": text, "sections": json.loads(sections)})
+
+    def get(self, number, updated):
+        with self.lock:
+            entry = self.entries.get(number)
+        if entry and entry[0] == updated:
+            return entry[1]
+        return None
+
+    def put_many(self, items):
+        """items: iterable of (number, sys_updated_on, cleaned)."""
+        items = list(items)
+        with self.lock:
+            for number, updated, cleaned in items:
+                self.entries[number] = (updated, cleaned)
+            if self.db is not None:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO kb_clean VALUES (?, ?, ?, ?)",
+                    [(n, u, c["text"], json.dumps(c["sections"])) for n, u, c in items]
+                )
+                self.db.commit()
+
+
+def clean_batch(texts, processes=None, min_parallel=200):
+    """clean_html over many texts; uses a process pool once the batch is big enough."""
+    processes = processes or int(os.getenv("KB_INGEST_PROCESSES", "0")) or os.cpu_count() or 1
+    if len(texts) < min_parallel or processes < 2:
+        return [clean_html(t) for t in texts]
+    # spawn, not fork: the app has live threads (HTTP pools, refreshers) at this point
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(clean_html, texts, chunksize=max(1, len(texts) // (processes * 4))))
+
+
+def ingest_records(records, store, processes=None):
+    """Replace the HTML "text" of kb_knowledge rows with cleaned text and add "sections".
+
+    Rows whose number/sys_updated_on is already in the store are not re-cleaned.
+    """
+    pending = []
+    for r in records:
+        if not r.get("text"):
+            continue
+        cleaned = store.get(r.get("number"), r.get("sys_updated_on", ""))
+        if cleaned is None:
+            pending.append(r)
+        else:
+            r["text"], r["sections"] = cleaned["text"], cleaned["sections"]
+
+    if pending:
+        results = clean_batch([r["text"] for r in pending], processes=processes)
+        store.put_many((r.get("number"), r.get("sys_updated_on", ""), c) for r, c in zip(pending, results))
+        for r, c in zip(pending, results):
+            r["text"], r["sections"] = c["text"], c["sections"]
+    return records
@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+import zlib
+import numpy as np
+from kb_index import TAG_RE, TOKEN_RE
+
+
+class HashingEmbedder:
+    """Fully local embedder: hashed word and character n-gram features.
+
+    Character n-grams give partial credit to related word forms ("connect",
+    "connectivity") with no model download or network call.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim=1024, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text):
+        words = TOKEN_RE.findall(TAG_RE.sub(" ", text or "").lower())
+        low, high = self.ngram_range
+        for word in words:
+            yield "w:" + word
+            padded = f"<{word}>"
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n]
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # The top hash bit picks a sign so collisions tend to cancel out.
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize(matrix)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API (needs network and OPENAI_API_KEY)."""
+
+    name = "openai"
+
+    def __init__(self, model="text-embedding-3-small", client=None, batch_size=256):
+        from openai import OpenAI
+        self.model = model
+        # Retries and timeouts come from resilience.openai_backend
+        self.client = client or OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.batch_size = batch_size
+        from singleflight import Group
+        # The same query embedded by many sessions at once is requested once
+        self.flights = Group("embeddings")
+        self.dim = None
+
+    def _create(self, batch):
+        import openai
+        from resilience import openai_backend, RetryableError, parse_retry_after
+        from telemetry import span
+
+        def send():
+            try:
+                return self.client.embeddings.create(model=self.model, input=batch,
+                                                     timeout=openai_backend.timeout("embeddings", 30))
+            except (openai.RateLimitError, openai.InternalServerError) as e:
+                raise RetryableError(e, parse_retry_after(e.response.headers.get("retry-after")))
+
+        def call():
+            with span("openai.embeddings", inputs=len(batch)) as current:
+                response = openai_backend.call("embeddings", send,
+                                               transient=lambda e: isinstance(e, (RetryableError, openai.APIConnectionError)))
+                current.tokens("embeddings", getattr(response, "usage", None))
+                return response
+
+        from singleflight import request_key
+        return self.flights.do(request_key(self.model, batch), call)
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [t or " " for t in texts[start:start + self.batch_size]]
+            response = self._create(batch)
+            vectors.extend(d.embedding for d in response.data)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        self.dim = matrix.shape[1] if len(matrix) else self.dim
+        return normalize(matrix)
+
+
+def get_embedder(name=None):
+    name = name or os.getenv("KB_EMBEDDER", "hashing")
+    if name == "openai":
+        return OpenAIEmbedder(model=os.getenv("KB_EMBED_MODEL", "text-embedding-3-small"))
+    return HashingEmbedder(dim=int(os.getenv("KB_EMBED_DIM", "1024")))
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def article_text(article):
+    return f"{article.get('title', '')}\n{article.get('content', '')}"
+
+
+class VectorIndex:
+    """Article embeddings as one contiguous float32 matrix, one row per article.
+
+    Rows carry the article's sys_updated_on, so update() only re-embeds articles
+    that are new or changed. With a path, the matrix is persisted with np.save and
+    reopened as a read-only memmap on the next start.
+    """
+
+    def __init__(self, embedder, path=None):
+        self.embedder = embedder
+        self.path = path
+        self.numbers = []
+        self.rows = {}       # number -> row in matrix
+        self.versions = {}   # number -> sys_updated_on of the embedded text
+        self.matrix = None
+        self.lock = threading.RLock()
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def update(self, articles):
+        """Embed new or changed articles; returns the numbers that were (re)embedded."""
+        with self.lock:
+            stale = [a for a in articles if self.versions.get(a["number"]) != a.get("sys_updated_on", "")]
+        if not stale:
+            return []
+        # Embedding may be a network call; searches shouldn't wait on it (updates come
+        # from one sync at a time, see ServiceNowClient.sync_kb_index)
+        vectors = self.embedder.embed([article_text(a) for a in stale])
+        with self.lock:
+            # A memmap is read-only; copy into memory before the first write.
+            matrix = np.array(self.matrix) if self.matrix is not None else np.zeros((0, vectors.shape[1]), np.float32)
+            appended = []
+            for article, vector in zip(stale, vectors):
+                number = article["number"]
+                if number in self.rows:
+                    matrix[self.rows[number]] = vector
+                else:
+                    self.rows[number] = len(self.numbers)
+                    self.numbers.append(number)
+                    appended.append(vector)
+                self.versions[number] = article.get("sys_updated_on", "")
+            if appended:
+                matrix = np.vstack([matrix, np.asarray(appended, dtype=np.float32)])
+            self.matrix = np.ascontiguousarray(matrix)
+            return [a["number"] for a in stale]
+
+    def remove(self, numbers):
+        with self.lock:
+            drop = [self.rows[n] for n in numbers if n in self.rows]
+            if not drop:
+                return
+            self.matrix = np.ascontiguousarray(np.delete(np.asarray(self.matrix), drop, axis=0))
+            dropped = set(numbers)
+            self.numbers = [n for n in self.numbers if n not in dropped]
+            self.rows = {n: i for i, n in enumerate(self.numbers)}
+            for n in dropped:
+                self.versions.pop(n, None)
+
+    def search(self, query, k=10):
+        """Return up to k (cosine score, article number) pairs."""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k=10):
+        """Top-k for several queries with a single matrix product."""
+        if not self.numbers:
+            return [[] for _ in queries]
+        vectors = self.embedder.embed(queries)
+        with self.lock:
+            if not self.numbers:
+                return [[] for _ in queries]
+            scores = vectors @ self.matrix.T
+            numbers = self.numbers
+        k = min(k, scores.shape[1])
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            results.append([(float(row[i]), numbers[i]) for i in top])
+        return results
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if self.matrix is None:
+                return
+            tmp = self.path + ".tmp.npy"
+            np.save(tmp, self.matrix)
+            os.replace(tmp, self.path + ".npy")
+            with open(self.path + ".json", "w") as f:
+                json.dump({"embedder": self.embedder.name, "numbers": self.numbers, "versions": self.versions}, f)
+
+    def load(self):
+        try:
+            with open(self.path + ".json") as f:
+                meta = json.load(f)
+            matrix = np.load(self.path + ".npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return
+        if meta.get("embedder") != self.embedder.name or len(meta["numbers"]) != matrix.shape[0]:
+            return
+        if getattr(self.embedder, "dim", None) not in (None, matrix.shape[1]):
+            return
+        self.matrix = matrix
+        self.numbers = meta["numbers"]
+        self.rows = {n: i for i, n in enumerate(self.numbers)}
+        self.versions = meta["versions"]
+
+
+def fuse_scores(lexical, vector, alpha=0.5):
+    """Blend two {number: score} maps after min-max scaling each to [0, 1].
+
+    alpha is the weight of the vector scores. Returns (score, number) pairs, best first.
+    """
+    def scaled(scores):
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        if high == low:
+            return {n: 1.0 for n in scores}
+        return {n: (s - low) / (high - low) for n, s in scores.items()}
+
+    lexical, vector = scaled(lexical), scaled(vector)
+    fused = {
+        n: (1 - alpha) * lexical.get(n, 0.0) + alpha * vector.get(n, 0.0)
+        for n in set(lexical) | set(vector)
+    }
+    return sorted(((s, n) for n, s in fused.items()), reverse=True)
@@ -0,0 +1,187 @@
+"""Local stand-in for the OpenAI endpoints this app uses.
+
+    python mock_openai.py [--port 8766]
+
+then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8766/v1 (any
+OPENAI_API_KEY). Serves chat completions (plain, JSON mode and streamed) and
+embeddings with canned but prompt-shaped replies: the classifier gets a
+category, JSON mode gets an answer citing the articles in the prompt, the
+conversation summarizer a list of the questions asked, and plain prompts get
+the first passage back. --latency is the time to the first
+token and --token-latency the time per further token, so streamed and
+non-streamed calls take about as long as each other; --error-rate and
+--throttle-rate fail that fraction of calls with 500 or 429.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+app = Flask(__name__)
+
+# Set through configure(); seconds and fractions of requests
+FAULTS = {"latency": 0.0, "token_latency": 0.0, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1}
+CATEGORIES = {
+    "access_issue": ["access", "permission", "denied"],
+    "hardware_request": ["laptop", "monitor", "keyboard", "mouse"],
+    "software_request": ["install", "adobe", "license", "software"],
+    "account_problem": ["password", "locked", "login", "mfa"],
+    "security_concern": ["phishing", "malware", "suspicious"],
+}
+CITATION_RE = re.compile(r"\[(KB\d+)\]")
+EMBED_DIM = 256
+
+_random = random.Random()
+_lock = threading.Lock()
+usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def configure(latency=None, token_latency=None, error_rate=None, throttle_rate=None, retry_after=None):
+    """Change the injected latency and failure rates; None leaves a setting as is."""
+    for key, value in dict(latency=latency, token_latency=token_latency, error_rate=error_rate,
+                           throttle_rate=throttle_rate, retry_after=retry_after).items():
+        if value is not None:
+            FAULTS[key] = value
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def classify(question):
+    question = question.lower()
+    for category, words in CATEGORIES.items():
+        if any(w in question for w in words):
+            return category
+    return "none"
+
+
+def reply_text(body):
+    """Canned reply shaped like what the real model would return for this prompt."""
+    messages = body.get("messages") or []
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    prompt = messages[-1]["content"] if messages else ""
+    if system.startswith("You are a classifier"):
+        return classify(prompt)
+    if system.startswith("You summarize"):
+        asked = re.findall(r"^User: (.*)$", prompt, re.M)
+        return "The user asked about: " + "; ".join(asked) + "."
+
+    match = re.search(r"^Question: (.*)$", prompt, re.M)
+    question = match.group(1) if match else prompt
+    passages = prompt.split("Relevant Articles (use as background information):", 1)[-1]
+    first = next((line for line in passages.splitlines() if line.strip() and not line.startswith("[")), "")
+    cited = list(dict.fromkeys(CITATION_RE.findall(passages)))[:2]
+    if cited and first:
+        answer = f"{first.strip()} [{cited[0]}]"
+    else:
+        answer = "I'm sorry, I couldn’t find that information in the company’s knowledge base."
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return json.dumps({"answer": answer, "cited_articles": cited, "ticket_category": classify(question)})
+    return answer
+
+
+def record(prompt_tokens, completion_tokens):
+    with _lock:
+        usage["requests"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+
+
+@app.before_request
+def inject_faults():
+    roll = _random.random()
+    if roll < FAULTS["error_rate"]:
+        return jsonify(error={"message": "Injected failure", "type": "server_error"}), 500
+    if roll < FAULTS["error_rate"] + FAULTS["throttle_rate"]:
+        return Response('{"error": {"message": "Rate limit reached", "type": "requests"}}', 429,
+                        {"Retry-After": str(FAULTS["retry_after"])}, mimetype="application/json")
+    return None
+
+
+@app.post("/v1/chat/completions")
+def chat_completions():
+    body = request.get_json(force=True) or {}
+    text = reply_text(body)
+    words = [w + " " for w in text.split(" ")]
+    words[-1] = words[-1].rstrip()
+    prompt_tokens = sum(count_tokens(m.get("content") or "") for m in body.get("messages") or [])
+    completion_tokens = count_tokens(text)
+    record(prompt_tokens, completion_tokens)
+    base = {"id": f"chatcmpl-{zlib.crc32(text.encode('utf-8')):08x}", "created": int(time.time()),
+            "model": body.get("model", "mock")}
+
+    if not body.get("stream"):
+        time.sleep(FAULTS["latency"] + FAULTS["token_latency"] * (len(words) - 1))
+        return jsonify(**base, object="chat.completion", choices=[{
+            "index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"
+        }], usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                   "total_tokens": prompt_tokens + completion_tokens})
+
+    def events():
+        time.sleep(FAULTS["latency"])
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(FAULTS["token_latency"])
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        done = {**base, "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(done)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final = {**base, "object": "chat.completion.chunk", "choices": [],
+                     "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                               "total_tokens": prompt_tokens + completion_tokens}}
+            yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
+
+
+def embed(text):
+    """Deterministic unit vector from hashed words, so similar texts get similar vectors."""
+    vector = [0.0] * EMBED_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode("utf-8")) % EMBED_DIM] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+@app.post("/v1/embeddings")
+def embeddings():
+    body = request.get_json(force=True) or {}
+    inputs = body.get("input") or []
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    tokens = sum(count_tokens(t) for t in inputs)
+    record(tokens, 0)
+    time.sleep(FAULTS["latency"])
+    return jsonify(object="list", model=body.get("model", "mock"),
+                   data=[{"object": "embedding", "index": i, "embedding": embed(t)} for i, t in enumerate(inputs)],
+                   usage={"prompt_tokens": tokens, "total_tokens": tokens})
+
+
+def start(host="127.0.0.1", port=8766):
+    """Serve in a background thread (for scripts and benchmarks); returns the server."""
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per further token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls getting 429")
+    args = parser.parse_args()
+    configure(latency=args.latency, token_latency=args.token_latency, error_rate=args.error_rate,
+              throttle_rate=args.throttle_rate)
+    app.run(host=args.host, port=args.port, threaded=True)
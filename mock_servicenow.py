@@ -0,0 +1,421 @@
+"""Local stand-in for the parts of the ServiceNow REST API this app uses.
+
+    python mock_servicenow.py [--port 8765]
+
+then point the app at it with SN_INSTANCE=http://127.0.0.1:8765 (any
+SN_USERNAME/SN_PASSWORD). Covers the Table API (GET with encoded queries,
+field projection and paging, POST, PATCH) and the Batch API
+(/api/now/v1/batch), including dot-walked fields, sysparm_display_value and
+sysparm_exclude_reference_link. Data lives in memory and is reseeded on every
+start.
+
+For load tests, --latency/--jitter add a delay to every request,
+--error-rate/--throttle-rate make that fraction of requests fail with 500 or
+429 (with Retry-After), and --users/--tickets/--articles grow the dataset with
+generated rows on top of the fixed sample.
+"""
+import argparse
+import base64
+import itertools
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+app = Flask(__name__)
+
+# Reference fields and the table they point at, for dot-walked queries like caller_id.user_name=jdoe
+REFERENCES = {
+    "caller_id": "sys_user",
+    "assigned_to": "sys_user",
+    "requested_for": "sys_user",
+    "opened_by": "sys_user",
+    "manager": "sys_user",
+    "department": "cmn_department",
+    "assignment_group": "sys_user_group",
+}
+NUMBER_PREFIX = {"incident": "INC", "sc_request": "REQ", "sc_task": "SCTASK", "kb_knowledge": "KB"}
+# Columns every task-based row carries on a real instance, empty or not; unprojected reads return them all
+TASK_COLUMNS = {
+    "active": "true", "activity_due": "", "additional_assignee_list": "", "approval": "not requested",
+    "approval_history": "", "approval_set": "", "business_duration": "", "business_service": "",
+    "calendar_duration": "", "close_notes": "", "closed_at": "", "closed_by": "", "cmdb_ci": "", "comments": "",
+    "comments_and_work_notes": "", "company": "", "contact_type": "self-service", "contract": "",
+    "correlation_display": "", "correlation_id": "", "delivery_plan": "", "delivery_task": "", "description": "",
+    "due_date": "", "escalation": "0", "expected_start": "", "follow_up": "", "group_list": "", "impact": "3",
+    "knowledge": "false", "location": "", "made_sla": "true", "order": "", "parent": "", "priority": "4",
+    "reassignment_count": "0", "route_reason": "", "service_offering": "", "sla_due": "", "sys_class_name": "",
+    "sys_created_by": "admin", "sys_domain": "global", "sys_domain_path": "/", "sys_mod_count": "0",
+    "sys_tags": "", "sys_updated_by": "admin", "time_worked": "", "upon_approval": "proceed",
+    "upon_reject": "cancel", "urgency": "3", "user_input": "", "watch_list": "", "work_end": "", "work_notes": "",
+    "work_notes_list": "", "work_start": "",
+}
+CONDITION_RE = re.compile(
+    r"^([A-Za-z_][\w.]*?)(ISNOTEMPTY|ISEMPTY|NOT IN|IN|NOT LIKE|LIKE|STARTSWITH|ENDSWITH|!=|>=|<=|=|>|<)(.*)$", re.S
+)
+
+# Set through configure(); seconds and fractions of requests
+FAULTS = {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1}
+# Marks the sub-requests batch() replays, so they don't get a second helping of faults
+BATCH_HEADER = "X-Mock-Batch-Item"
+
+DB = {}
+_rows = {}        # (table, sys_id) -> row
+_user_names = {}  # user_name -> sys_id
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_random = random.Random()
+
+
+def configure(latency=None, jitter=None, error_rate=None, throttle_rate=None, retry_after=None):
+    """Change the injected latency and failure rates; None leaves a setting as is."""
+    for key, value in dict(latency=latency, jitter=jitter, error_rate=error_rate,
+                           throttle_rate=throttle_rate, retry_after=retry_after).items():
+        if value is not None:
+            FAULTS[key] = value
+
+
+@app.before_request
+def inject_faults():
+    if request.headers.get(BATCH_HEADER):
+        return None
+    delay = FAULTS["latency"] + _random.uniform(-FAULTS["jitter"], FAULTS["jitter"])
+    if delay > 0:
+        time.sleep(delay)
+    roll = _random.random()
+    if roll < FAULTS["error_rate"]:
+        return jsonify(error={"message": "Injected failure"}), 500
+    if roll < FAULTS["error_rate"] + FAULTS["throttle_rate"]:
+        return Response('{"error": {"message": "Too many requests"}}', 429,
+                        {"Retry-After": str(FAULTS["retry_after"])}, mimetype="application/json")
+    return None
+
+
+def now():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+def reference(table, sys_id):
+    row = find(table, sys_id)
+    name = (row.get("name") or row.get("number") or "") if row else ""
+    return {"value": sys_id, "display_value": name, "link": f"/api/now/table/{table}/{sys_id}"}
+
+
+def find(table, sys_id):
+    return _rows.get((table, sys_id))
+
+
+def insert(table, fields):
+    """Add a row the way the instance would: sys_id, number and timestamps filled in."""
+    with _lock:
+        n = next(_ids)
+        row = {"sys_id": f"{n:032x}", "sys_created_on": now(), "sys_updated_on": now()}
+        if table in NUMBER_PREFIX:
+            row["number"] = f"{NUMBER_PREFIX[table]}{n:07d}"
+            if table != "kb_knowledge":
+                row.update(TASK_COLUMNS, sys_class_name=table)
+        for field, value in fields.items():
+            if field in REFERENCES and isinstance(value, str):
+                value = reference(REFERENCES[field], resolve_user(value) if REFERENCES[field] == "sys_user" else value)
+            row[field] = value
+        DB.setdefault(table, []).append(row)
+        _rows[(table, row["sys_id"])] = row
+        if table == "sys_user" and row.get("user_name"):
+            _user_names[row["user_name"]] = row["sys_id"]
+        return row
+
+
+def resolve_user(value):
+    """Accept a sys_id or a user_name, as the instance does for sys_user references."""
+    return _user_names.get(value, value)
+
+
+def field_value(row, field):
+    """Value of a (possibly dot-walked) field as a string; references compare by sys_id."""
+    head, _, rest = field.partition(".")
+    value = row.get(head, "")
+    if isinstance(value, dict):
+        if rest:
+            target = find(REFERENCES.get(head, ""), value.get("value"))
+            return field_value(target, rest) if target else ""
+        value = value.get("value", "")
+    return "" if value is None else str(value)
+
+
+def matches(row, condition):
+    m = CONDITION_RE.match(condition)
+    if not m:
+        return True  # unknown operators are ignored rather than failing the whole query
+    field, op, expected = m.groups()
+    actual = field_value(row, field)
+    if op == "=":
+        return actual == expected
+    if op == "!=":
+        return actual != expected
+    if op == "LIKE":
+        return expected.lower() in actual.lower()
+    if op == "NOT LIKE":
+        return expected.lower() not in actual.lower()
+    if op == "STARTSWITH":
+        return actual.lower().startswith(expected.lower())
+    if op == "ENDSWITH":
+        return actual.lower().endswith(expected.lower())
+    if op == "ISEMPTY":
+        return actual == ""
+    if op == "ISNOTEMPTY":
+        return actual != ""
+    if op == "IN":
+        return actual in expected.split(",")
+    if op == "NOT IN":
+        return actual not in expected.split(",")
+    return {">": actual > expected, ">=": actual >= expected,
+            "<": actual < expected, "<=": actual <= expected}[op]
+
+
+def split_terms(query):
+    """Split an encoded query on ^; ^^ stands for a literal caret."""
+    terms, current, i = [], [], 0
+    while i < len(query):
+        if query[i] == "^":
+            if query[i + 1:i + 2] == "^":
+                current.append("^")
+                i += 2
+                continue
+            terms.append("".join(current))
+            current = []
+        else:
+            current.append(query[i])
+        i += 1
+    terms.append("".join(current))
+    return [t for t in terms if t]
+
+
+def run_query(rows, query):
+    """Filter and order rows by an encoded query (conditions joined by ^ and ^OR)."""
+    clauses, order = [], []
+    for term in split_terms(query or ""):
+        if term.startswith("ORDERBYDESC"):
+            order.append((term[11:], True))
+        elif term.startswith("ORDERBY"):
+            order.append((term[7:], False))
+        elif term.startswith("OR") and clauses:
+            clauses[-1].append(term[2:])
+        else:
+            clauses.append([term])
+    rows = [r for r in rows if all(any(matches(r, c) for c in clause) for clause in clauses)]
+    for field, descending in reversed(order):
+        rows.sort(key=lambda r: field_value(r, field), reverse=descending)
+    return rows
+
+
+def render(value, display, links):
+    """A field value as the instance returns it for the sysparm_display_value/exclude_reference_link settings."""
+    if isinstance(value, dict):  # reference
+        out = {}
+        if display in ("true", "all"):
+            out["display_value"] = value.get("display_value", "")
+        if display in ("false", "all"):
+            out["value"] = value.get("value", "")
+        if links:
+            out["link"] = value.get("link", "")
+        return out if len(out) > 1 else next(iter(out.values()))
+    return {"display_value": value, "value": value} if display == "all" else value
+
+
+def project(row, fields, display="false", links=True):
+    fields = fields.split(",") if fields else list(row)
+    out = {}
+    for f in fields:
+        value = row.get(f, "") if "." not in f else field_value(row, f)
+        out[f] = render(value, display, links)
+    return out
+
+
+def projection_args():
+    return (request.args.get("sysparm_fields"), request.args.get("sysparm_display_value", "false").lower(),
+            request.args.get("sysparm_exclude_reference_link", "false").lower() != "true")
+
+
+@app.route("/api/now/table/<table>", methods=["GET", "POST"])
+def table_collection(table):
+    if request.method == "POST":
+        return jsonify(result=insert(table, request.get_json(force=True) or {})), 201
+
+    rows = run_query(DB.get(table, []), request.args.get("sysparm_query", ""))
+    offset = int(request.args.get("sysparm_offset", 0))
+    limit = int(request.args.get("sysparm_limit", 10000))
+    page = [project(r, *projection_args()) for r in rows[offset:offset + limit]]
+    response = jsonify(result=page)
+    response.headers["X-Total-Count"] = str(len(rows))
+    if offset + limit < len(rows):
+        args = dict(request.args, sysparm_offset=str(offset + limit))
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>;rel="next"'
+    return response
+
+
+@app.route("/api/now/table/<table>/<sys_id>", methods=["GET", "PATCH", "PUT"])
+def table_record(table, sys_id):
+    row = find(table, sys_id)
+    if row is None:
+        return jsonify(error={"message": "No Record found"}), 404
+    if request.method != "GET":
+        with _lock:
+            row.update(request.get_json(force=True) or {})
+            row["sys_updated_on"] = now()
+    return jsonify(result=project(row, *projection_args()))
+
+
+@app.route("/api/now/v1/batch", methods=["POST"])
+def batch():
+    """Run each rest_request against this app in order, as the instance does."""
+    payload = request.get_json(force=True) or {}
+    serviced, unserviced = [], []
+    client = app.test_client()
+    for item in payload.get("rest_requests", []):
+        url = item.get("url", "")
+        if not url.startswith("/api/now/table/"):
+            unserviced.append(item.get("id"))
+            continue
+        started = time.perf_counter()
+        headers = {h["name"]: h["value"] for h in item.get("headers", [])}
+        headers[BATCH_HEADER] = "1"
+        body = base64.b64decode(item["body"]) if item.get("body") else None
+        sub = client.open(url, method=item.get("method", "GET"), headers=headers, data=body)
+        entry = {
+            "id": item.get("id"),
+            "status_code": sub.status_code,
+            "status_text": sub.status.split(" ", 1)[-1],
+            "body": base64.b64encode(sub.get_data()).decode("ascii"),
+            "execution_time": round((time.perf_counter() - started) * 1000),
+        }
+        if not payload.get("exclude_response_headers"):
+            entry["headers"] = [{"name": k, "value": v} for k, v in sub.headers.items()]
+        serviced.append(entry)
+    return jsonify(batch_request_id=payload.get("batch_request_id"),
+                   serviced_requests=serviced, unserviced_requests=unserviced)
+
+
+def seed(users=0, tickets=0, articles=0, random_seed=1):
+    """Fixed sample dataset, plus the given numbers of generated users, tickets and articles."""
+    DB.clear()
+    _rows.clear()
+    _user_names.clear()
+    DB["cmn_department"] = []
+    it = insert("cmn_department", {"name": "IT"})
+    finance = insert("cmn_department", {"name": "Finance"})
+    group = insert("sys_user_group", {"name": "IT Support", "description": "Service desk"})
+    insert("sys_user_group", {"name": "IT Access Control", "description": "Access and permissions"})
+    sample_users = [
+        ("jdoe", "John Doe", "Engineer", it, "555-0100"),
+        ("asmith", "Alice Smith", "Analyst", finance, "555-0101"),
+        ("bwong", "Ben Wong", "Service Desk Agent", it, "555-0102"),
+    ]
+    for user_name, name, title, dept, phone in sample_users:
+        user = insert("sys_user", {
+            "user_name": user_name, "name": name, "email": f"{user_name}@example.com",
+            "title": title, "mobile_phone": phone,
+        })
+        user["department"] = reference("cmn_department", dept["sys_id"])
+        insert("cmdb_ci_computer", {"name": f"{name.split()[0]}'s Laptop", "assigned_to": user["sys_id"]})
+
+    opened = datetime(2024, 1, 1)
+    sample_tickets = [
+        ("incident", "jdoe", "VPN not connecting from home"),
+        ("incident", "asmith", "Outlook keeps asking for password"),
+        ("incident", "jdoe", "Printer on floor 3 jammed"),
+        ("sc_request", "jdoe", "Need a new laptop"),
+        ("sc_request", "asmith", "Adobe Creative Cloud license"),
+    ]
+    for i, (table, user_name, desc) in enumerate(sample_tickets):
+        field = "caller_id" if table == "incident" else "requested_for"
+        row = insert(table, {field: user_name, "short_description": desc, "state": "1",
+                             "assignment_group": group["sys_id"]})
+        row["opened_at"] = (opened + timedelta(days=i)).strftime("%Y-%m-%d %H:%M:%S")
+        if table == "incident":
+            row["assigned_to"] = reference("sys_user", resolve_user("bwong"))
+    task = insert("sc_task", {"assigned_to": "bwong", "short_description": "Image new laptop", "state": "1"})
+    task["opened_at"] = opened.strftime("%Y-%m-%d %H:%M:%S")
+
+    sample_articles = [
+        ("How to connect to VPN", "<h2>Connecting</h2><p>Open the <b>VPN</b> client and sign in with MFA.</p>"),
+        ("Reset your password", "<h2>Password</h2><p>Go to the portal and click reset password.</p>"),
+        ("Wireless network connectivity", "<p>If wifi is down, forget the network and reconnect to CorpWiFi.</p>"),
+    ]
+    for title, text in sample_articles:
+        insert("kb_knowledge", {"short_description": title, "text": text, "active": "true", "workflow": "published"})
+
+    generate(users, tickets, articles, random.Random(random_seed))
+
+
+TOPICS = ["VPN", "Outlook", "Teams", "printer", "laptop", "monitor", "wifi", "password", "MFA", "SharePoint",
+          "Excel", "Adobe", "docking station", "shared drive", "badge", "Zoom", "Salesforce", "headset"]
+PROBLEMS = ["not connecting", "keeps crashing", "very slow", "asking for password", "access denied",
+            "needs an upgrade", "stopped working", "shows an error", "will not install", "license expired"]
+
+
+def generate(users, tickets, articles, rng):
+    """Add generated rows: users with laptops, tickets spread over all users, and KB articles."""
+    departments = DB["cmn_department"]
+    group = DB["sys_user_group"][0]
+    for i in range(users):
+        user_name = f"user{i:06d}"
+        user = insert("sys_user", {
+            "user_name": user_name, "name": f"User {i}", "email": f"{user_name}@example.com",
+            "title": rng.choice(["Engineer", "Analyst", "Manager", "Designer"]),
+            "mobile_phone": f"555-{i % 10000:04d}",
+        })
+        user["department"] = reference("cmn_department", rng.choice(departments)["sys_id"])
+        insert("cmdb_ci_computer", {"name": f"LAPTOP-{i:06d}", "assigned_to": user["sys_id"]})
+
+    user_ids = [u["sys_id"] for u in DB["sys_user"]]
+    opened = datetime(2024, 1, 1)
+    for i in range(tickets):
+        table = rng.choice(["incident", "incident", "sc_request", "sc_task"])
+        field = {"incident": "caller_id", "sc_request": "requested_for", "sc_task": "assigned_to"}[table]
+        topic, problem = rng.choice(TOPICS), rng.choice(PROBLEMS)
+        row = insert(table, {field: rng.choice(user_ids), "assignment_group": group["sys_id"],
+                             "short_description": f"{topic} {problem}",
+                             "description": f"User reports that {topic} {problem} since this morning. "
+                                            "Restarting and reconnecting did not help; please advise.",
+                             "state": rng.choice(["1", "1", "2", "6", "7"])})
+        row["opened_at"] = (opened + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")
+
+    for i in range(articles):
+        topic, problem = rng.choice(TOPICS), rng.choice(PROBLEMS)
+        text = "".join(f"<p>If {topic} {problem}, {step}.</p>" for step in rng.sample([
+            "restart the application", "sign out and back in", "check the service status page",
+            "clear the local cache", "reconnect to the corporate network", "update to the latest version",
+            "contact the service desk with the error text", "run the self-service repair tool"], 3))
+        insert("kb_knowledge", {"short_description": f"{topic}: {problem} ({i})", "text": text,
+                                "active": "true", "workflow": "published"})
+
+
+def start(host="127.0.0.1", port=8765):
+    """Serve in a background thread (for scripts and benchmarks); returns the server."""
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="mock-servicenow", daemon=True).start()
+    return server
+
+
+seed()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies by up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests getting 429")
+    parser.add_argument("--users", type=int, default=0, help="generated users on top of the sample data")
+    parser.add_argument("--tickets", type=int, default=0, help="generated incidents, requests and tasks")
+    parser.add_argument("--articles", type=int, default=0, help="generated KB articles")
+    args = parser.parse_args()
+    configure(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+              throttle_rate=args.throttle_rate)
+    seed(args.users, args.tickets, args.articles)
+    app.run(host=args.host, port=args.port, threaded=True)
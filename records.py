@@ -0,0 +1,112 @@
+"""Compact record types for KB articles, tickets and users.
+
+These rows are kept for the life of the process (the KB index, the shared
+snapshot, cached user contexts), so they are slotted dataclasses rather than
+dicts: no per-row hash table, and categorical strings (state, department,
+title) are interned so rows loaded from the same table share one copy.
+They still read like the dicts they replace - record["title"],
+record.get("title", default), "title" in record and dict(record) all work -
+so code written against ServiceNow rows keeps working. to_dict() gives a
+plain dict; Flask's jsonify serializes them as is.
+"""
+import sys
+from dataclasses import dataclass
+from query_builder import display_text
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    """Read-only mapping interface over a slotted dataclass's fields.
+
+    Attribute access (article.title) is the fast path; the mapping methods
+    exist for code that also handles plain dicts.
+    """
+    __slots__ = ()
+    _fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__dict__.get("__slots__", ())) or cls._fields
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.__slots__}
+
+
+@dataclass(slots=True)
+class Article(Record):
+    number: str
+    title: str
+    content: str = ""
+    sys_updated_on: str = ""
+    sections: tuple = ()
+    score: float = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Article from a kb_knowledge row (short_description/text, as returned by ingest_records)."""
+        return cls(
+            number=row.get("number", ""),
+            title=row.get("short_description") or "Untitled",
+            content=row.get("text", ""),
+            sys_updated_on=row.get("sys_updated_on", ""),
+            sections=tuple(row.get("sections") or ()),
+        )
+
+
+@dataclass(slots=True)
+class Ticket(Record):
+    sys_id: str
+    number: str
+    short_description: str = ""
+    state: str = ""
+    opened_at: str = ""
+
+    @classmethod
+    def from_row(cls, row):
+        """Ticket from an incident/sc_request row (TICKET_FIELDS)."""
+        return cls(
+            sys_id=row.get("sys_id", ""),
+            number=row.get("number", ""),
+            short_description=row.get("short_description", ""),
+            state=_intern(display_text(row.get("state"))),
+            opened_at=row.get("opened_at", ""),
+        )
+
+
+@dataclass(slots=True)
+class User(Record):
+    sys_id: str
+    name: str = ""
+    user_name: str = ""
+    email: str = ""
+    title: str = ""
+    department: str = ""
+
+    @classmethod
+    def from_row(cls, row):
+        """User from a sys_user row; department may be a sys_id or a display value."""
+        return cls(
+            sys_id=row.get("sys_id", ""),
+            name=row.get("name", ""),
+            user_name=row.get("user_name", ""),
+            email=row.get("email", ""),
+            title=_intern(row.get("title", "")),
+            department=_intern(display_text(row.get("department"))),
+        )
@@ -0,0 +1,182 @@
+"""Local SQLite replica of the ServiceNow reference tables.
+
+Users, groups and computers change rarely but are read on every login and
+password reset. ReferenceReplica keeps a copy of sys_user, sys_user_group and
+cmdb_ci_computer, indexed for the lookups the app makes (user_name, sys_id,
+assigned_to), and keeps it fresh with sys_updated_on deltas: each sync asks
+only for rows touched since the newest one it already has. Deltas can't see
+deleted rows, so a periodic full sync drops rows the instance no longer
+returns.
+
+In memory by default; with a path the replica survives restarts and resumes
+from its last delta. Reads are served only while every table has synced
+within max_staleness; until then (or if syncing keeps failing) callers should
+fall back to the instance.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from query_builder import Query, TableQuery
+from telemetry import span
+
+log = logging.getLogger(__name__)
+
+# table -> (fields replicated, indexed columns). A dot-walked field is stored as
+# a column named with "_" (department.name -> department_name).
+REPLICA_TABLES = {
+    "sys_user": (("sys_id", "user_name", "name", "email", "title", "department", "department.name",
+                  "mobile_phone", "active", "sys_updated_on"), ("user_name",)),
+    "sys_user_group": (("sys_id", "name", "description", "manager", "active", "sys_updated_on"), ("name",)),
+    "cmdb_ci_computer": (("sys_id", "name", "assigned_to", "sys_updated_on"), ("assigned_to",)),
+}
+
+
+def column(field):
+    return field.replace(".", "_")
+
+
+def columns(table, alias=""):
+    return ", ".join(alias + column(f) for f in REPLICA_TABLES[table][0])
+
+
+class ReferenceReplica:
+    def __init__(self, path=None, sync_interval=300, full_sync_interval=86400, max_staleness=None):
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.max_staleness = max_staleness or sync_interval * 3
+        self.syncs = 0
+        self.failures = 0
+        self.rows_synced = 0
+        self._syncing = False
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self._lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS replica_sync ("
+                "name TEXT PRIMARY KEY, last_updated TEXT, synced_at REAL, full_synced_at REAL, generation INTEGER)"
+            )
+            for table, (fields, indexes) in REPLICA_TABLES.items():
+                columns = ", ".join(f"{column(f)} TEXT" for f in fields if f != "sys_id")
+                self.db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (sys_id TEXT PRIMARY KEY, {columns}, generation INTEGER)"
+                )
+                for index in indexes:
+                    self.db.execute(f"CREATE INDEX IF NOT EXISTS {table}_{index} ON {table} ({index})")
+            self.db.commit()
+
+    def _state(self, table):
+        row = self.db.execute("SELECT * FROM replica_sync WHERE name = ?", (table,)).fetchone()
+        return dict(row) if row else {"last_updated": "", "synced_at": 0.0, "full_synced_at": 0.0, "generation": 0}
+
+    def ready(self):
+        """True while every table has synced within max_staleness."""
+        now = time.time()
+        with self._lock:
+            return all(now - self._state(table)["synced_at"] < self.max_staleness for table in REPLICA_TABLES)
+
+    def due(self):
+        now = time.time()
+        with self._lock:
+            return any(now - self._state(table)["synced_at"] >= self.sync_interval for table in REPLICA_TABLES)
+
+    def maybe_sync(self, fetch):
+        """Start a background sync when one is due; never blocks the caller."""
+        if time.monotonic() < self._retry_at or not self.due():
+            return
+        with self._lock:
+            if self._syncing:
+                return
+            self._syncing = True
+        threading.Thread(target=self.sync, args=(fetch,), name="replica-sync", daemon=True).start()
+
+    def sync(self, fetch, full=False):
+        """Bring every table up to date. fetch(table_query) yields rows and raises on errors.
+
+        A table syncs in full the first time, every full_sync_interval, or with
+        full=True; otherwise only rows with sys_updated_on at or after the newest
+        one already held are fetched. Returns False if any table failed.
+        """
+        ok = True
+        with self._sync_lock:
+            try:
+                for table in REPLICA_TABLES:
+                    try:
+                        self._sync_table(table, fetch, full)
+                    except Exception as e:
+                        log.warning("Replica sync of %s failed: %s", table, e)
+                        ok = False
+            finally:
+                with self._lock:
+                    self._syncing = False
+                    self.syncs += 1
+                    self.failures += not ok
+                    # After a failure wait a little before the next attempt instead of retrying on every read
+                    self._retry_at = 0.0 if ok else time.monotonic() + min(60, self.sync_interval)
+        return ok
+
+    def _sync_table(self, table, fetch, full):
+        fields, _ = REPLICA_TABLES[table]
+        with self._lock:
+            state = self._state(table)
+        full = full or not state["last_updated"] or time.time() - state["full_synced_at"] >= self.full_sync_interval
+        query = Query() if full else Query().gte("sys_updated_on", state["last_updated"])
+        # A full sync stamps every row it sees with a new generation; rows left on an older one were deleted
+        generation = state["generation"] + 1 if full else state["generation"]
+
+        started = time.time()
+        with span("replica.sync", table=table, full=full) as current:
+            rows = [tuple(str(row.get(f) or "") for f in fields) + (generation,)
+                    for row in fetch(TableQuery(table, fields, query.order_by("sys_updated_on")))]
+            current.set(rows=len(rows))
+        last_updated = max([state["last_updated"]] + [r[fields.index("sys_updated_on")] for r in rows])
+        placeholders = ", ".join("?" * (len(fields) + 1))
+        with self._lock:
+            self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+            if full:
+                self.db.execute(f"DELETE FROM {table} WHERE generation < ?", (generation,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO replica_sync VALUES (?, ?, ?, ?, ?)",
+                (table, last_updated, started, started if full else state["full_synced_at"], generation)
+            )
+            self.db.commit()
+            self.rows_synced += len(rows)
+
+    def user(self, user_name):
+        """The sys_user row for user_name as a dict, or None if the replica doesn't have it."""
+        with self._lock:
+            row = self.db.execute(f"SELECT {columns('sys_user')} FROM sys_user WHERE user_name = ?",
+                                  (user_name,)).fetchone()
+        return dict(row) if row else None
+
+    def devices(self, user_name):
+        """cmdb_ci_computer rows assigned to the user."""
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT {columns('cmdb_ci_computer', 'c.')} FROM cmdb_ci_computer c JOIN sys_user u ON c.assigned_to = u.sys_id "
+                "WHERE u.user_name = ?", (user_name,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def groups(self):
+        with self._lock:
+            rows = self.db.execute(f"SELECT {columns('sys_user_group')} FROM sys_user_group ORDER BY name").fetchall()
+        return [dict(r) for r in rows]
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            tables = {}
+            for table in REPLICA_TABLES:
+                state = self._state(table)
+                tables[table] = {
+                    "rows": self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0],
+                    "last_updated": state["last_updated"],
+                    "age_seconds": now - state["synced_at"] if state["synced_at"] else None,
+                }
+            return {"syncs": self.syncs, "failures": self.failures, "rows_synced": self.rows_synced,
+                    "syncing": self._syncing, "tables": tables}
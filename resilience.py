@@ -0,0 +1,363 @@
+import asyncio
+import email.utils
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+
+class CircuitOpenError(Exception):
+    """The backend's breaker is open, so the call was not attempted."""
+
+
+class RetryableError(Exception):
+    """Raised from a call to ask for a retry; result is what to return (or raise) if retries run out."""
+
+    def __init__(self, result, retry_after=None):
+        super().__init__(f"retryable result: {result!r}")
+        self.result = result
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and fails fast for reset_timeout.
+
+    Then one trial call is let through (half-open): success closes the
+    breaker, failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def release(self):
+        """End a trial call that settled nothing (it was cancelled); the next call becomes the trial."""
+        with self.lock:
+            self.trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful call durations for one endpoint."""
+
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Backend:
+    """Retry, backoff, hedging, circuit breaking and last-good fallback for one remote service.
+
+    call(endpoint, fn) runs fn, retrying with jittered exponential backoff (or
+    the server's Retry-After) while transient(exception) is true. fn signals a
+    retryable *result* (a 429 response, say) by raising RetryableError. With
+    hedge=True a duplicate attempt starts if the first is slower than the
+    endpoint's recent p95, and whichever succeeds first wins. A call that ends
+    in an exception for which failed(exception) is true (default: transient),
+    meaning the backend didn't answer, is a failure; any other exception still
+    counts as an answer. Consecutive failures open the breaker; while it is
+    open (or when a call fails for good), calls with a stale_key get the last
+    good result for that key (only results passing keep() are remembered) and
+    the rest raise CircuitOpenError.
+    """
+
+    def __init__(self, name, attempts=3, max_wait=8.0, max_retry_after=30.0, failure_threshold=5,
+                 reset_timeout=30.0, timeouts=None, hedge_after=1.0, min_hedge_after=0.05,
+                 hedge_workers=64, stale_size=256):
+        self.name = name
+        self.attempts = attempts
+        self.max_retry_after = max_retry_after
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.timeouts = timeouts or {}
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.stale_size = stale_size
+        self._backoff = wait_random_exponential(multiplier=0.25, max=max_wait)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix=f"{name}-hedge")
+        self._latency = {}
+        self._stale = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                         "failures": 0, "rejected": 0, "stale_served": 0}
+
+    def timeout(self, endpoint, default=None):
+        return self.timeouts.get(endpoint, default)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+
+    def _tracker(self, endpoint):
+        with self._lock:
+            return self._latency.setdefault(endpoint, LatencyTracker())
+
+    def hedge_delay(self, endpoint):
+        tracker = self._tracker(endpoint)
+        p95 = tracker.quantile(0.95) if len(tracker.samples) >= 20 else None
+        return max(self.min_hedge_after, p95 if p95 is not None else self.hedge_after)
+
+    def _wait(self, retry_state):
+        error = retry_state.outcome.exception()
+        if isinstance(error, RetryableError) and error.retry_after is not None:
+            return min(error.retry_after, self.max_retry_after)
+        return self._backoff(retry_state)
+
+    def _retrying(self, transient, cls=Retrying):
+        return cls(
+            stop=stop_after_attempt(self.attempts),
+            wait=self._wait,
+            retry=retry_if_exception(transient),
+            before_sleep=lambda state: self._count("retries"),
+            reraise=True,
+        )
+
+    def _remember(self, stale_key, result, keep):
+        if stale_key is None or (keep is not None and not keep(result)):
+            return
+        with self._lock:
+            self._stale[stale_key] = result
+            self._stale.move_to_end(stale_key)
+            while len(self._stale) > self.stale_size:
+                self._stale.popitem(last=False)
+
+    def _stale_result(self, stale_key):
+        if stale_key is None:
+            return None
+        with self._lock:
+            result = self._stale.get(stale_key)
+        if result is not None:
+            self._count("stale_served")
+        return result
+
+    def _timed(self, endpoint, fn):
+        started = time.perf_counter()
+        result = fn()
+        self._tracker(endpoint).record(time.perf_counter() - started)
+        return result
+
+    def _hedged(self, endpoint, fn):
+        first = self._hedge_pool.submit(self._timed, endpoint, fn)
+        done, _ = wait_futures([first], timeout=self.hedge_delay(endpoint))
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = self._hedge_pool.submit(self._timed, endpoint, fn)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _finish(self, error, failed, stale_key):
+        """Handle the exception left after retries; returns a fallback result or raises."""
+        if isinstance(error, RetryableError) or failed(error):
+            self.breaker.record_failure()
+            self._count("failures")
+            stale = self._stale_result(stale_key)
+            if stale is not None:
+                return stale
+            if isinstance(error, RetryableError):
+                if isinstance(error.result, BaseException):
+                    raise error.result
+                return error.result
+            raise error
+        # The backend answered, just not with a result (a 400, a parse error): it is reachable
+        self.breaker.record_success()
+        raise error
+
+    def call(self, endpoint, fn, transient=None, hedge=False, stale_key=None, keep=None, failed=None):
+        transient = transient or (lambda e: isinstance(e, RetryableError))
+        failed = failed or transient
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            stale = self._stale_result(stale_key)
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+        attempt = (lambda: self._hedged(endpoint, fn)) if hedge else (lambda: self._timed(endpoint, fn))
+        try:
+            result = self._retrying(transient)(attempt)
+        except Exception as e:
+            return self._finish(e, failed, stale_key)
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        self._remember(stale_key, result, keep)
+        return result
+
+    async def _ahedged(self, endpoint, fn):
+        async def timed():
+            started = time.perf_counter()
+            result = await fn()
+            self._tracker(endpoint).record(time.perf_counter() - started)
+            return result
+
+        first = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(endpoint))
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = asyncio.ensure_future(timed())
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, endpoint, fn, transient=None, hedge=False, stale_key=None, keep=None, failed=None):
+        """call() for a coroutine function fn."""
+        transient = transient or (lambda e: isinstance(e, RetryableError))
+        failed = failed or transient
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            stale = self._stale_result(stale_key)
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+        async def attempt():
+            if hedge:
+                return await self._ahedged(endpoint, fn)
+            started = time.perf_counter()
+            result = await fn()
+            self._tracker(endpoint).record(time.perf_counter() - started)
+            return result
+
+        try:
+            result = await self._retrying(transient, cls=AsyncRetrying)(attempt)
+        except Exception as e:
+            return self._finish(e, failed, stale_key)
+        except BaseException:
+            # Cancelled (asyncio.CancelledError) mid-call
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        self._remember(stale_key, result, keep)
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            latency = {name: t.quantile(0.95) for name, t in self._latency.items()}
+        return {"state": self.breaker.state, "p95_seconds": latency, **counters}
+
+
+def _timeouts(env, defaults):
+    """Per-endpoint timeouts: defaults overridden by a JSON object in env."""
+    timeouts = dict(defaults)
+    timeouts.update({k: tuple(v) if isinstance(v, list) else v for k, v in json.loads(os.getenv(env, "{}")).items()})
+    return timeouts
+
+
+# Endpoint names are Table API table names plus "batch"; values are (connect, read) seconds
+servicenow = Backend(
+    "servicenow",
+    attempts=int(os.getenv("SN_RETRY_ATTEMPTS", "3")),
+    max_wait=float(os.getenv("SN_RETRY_MAX_WAIT", "8")),
+    failure_threshold=int(os.getenv("SN_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("SN_BREAKER_RESET", "30")),
+    hedge_after=float(os.getenv("SN_HEDGE_AFTER", "1.0")),
+    hedge_workers=int(os.getenv("SN_HEDGE_WORKERS", "64")),
+    timeouts=_timeouts("SN_ENDPOINT_TIMEOUTS", {
+        "sys_user": (3, 10),
+        "cmdb_ci_computer": (3, 10),
+        "incident": (3, 15),
+        "sc_request": (3, 15),
+        "sc_task": (3, 15),
+        "kb_knowledge": (5, 60),
+        "batch": (5, 30),
+    }),
+)
+
+# Endpoint names are the gpt_agent call sites; values are total seconds
+openai_backend = Backend(
+    "openai",
+    attempts=int(os.getenv("OPENAI_RETRY_ATTEMPTS", "3")),
+    max_wait=float(os.getenv("OPENAI_RETRY_MAX_WAIT", "10")),
+    failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+    timeouts=_timeouts("OPENAI_ENDPOINT_TIMEOUTS", {
+        "answer": 60,
+        "structured": 60,
+        "stream": 30,
+        "classify": 15,
+        "summarize": 15,
+        "embeddings": 30,
+    }),
+)
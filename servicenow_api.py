@@ -1,304 +1,812 @@
+import base64
+import json
+import logging
 import os
+import threading
+import time
+import zlib
+from dataclasses import replace
+from urllib.parse import urlencode
 import requests
-from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from kb_index import KBIndex
+from kb_vectors import VectorIndex, get_embedder, fuse_scores
+from user_cache import user_cache, LookupFailed
+from kb_ingest import CleanedArticleStore, ingest_records
+from answer_cache import answer_cache
+from resilience import servicenow as backend, CircuitOpenError, RetryableError, parse_retry_after
+from query_builder import Query, TableQuery, display_text
+from records import Article, Ticket, User
+from replica import ReferenceReplica
+from singleflight import Group, request_key
+from telemetry import span
 
 load_dotenv()
+log = logging.getLogger(__name__)
+
+KB_FIELDS = ("number", "short_description", "text", "sys_updated_on", "active", "workflow")
+# key -> (table, projected fields, record type or None to keep the rows as dicts) for load_servicenow_data
+LOAD_TABLES = {
+    "assignment_groups": ("sys_user_group", ("sys_id", "name", "description", "manager"), None),
+    "knowledge_articles": ("kb_knowledge", ("sys_id", "number", "short_description", "sys_updated_on"), Article),
+    "users": ("sys_user", ("sys_id", "user_name", "name", "email", "title", "department"), User),
+    "incidents": ("incident", ("sys_id", "number", "short_description", "state", "opened_at"), Ticket),
+    "requests": ("sc_request", ("sys_id", "number", "short_description", "state", "opened_at"), Ticket)
+}
+# Fields read from the user_context_lookups results (see build_user_context)
+USER_FIELDS = ("sys_id", "name", "email", "title", "department")
+DEVICE_FIELDS = ("name",)
+TICKET_FIELDS = ("sys_id", "number", "short_description", "state", "opened_at")
+# Fan get_user_context out over the async client instead of four sequential GETs
+CONCURRENT_LOOKUPS = os.getenv("SN_CONCURRENT_LOOKUPS", "true").lower() == "true"
+# Send get_user_context's four GETs as one Batch API request (falls back when the instance lacks it)
+BATCH_LOOKUPS = os.getenv("SN_BATCH_API", "true").lower() == "true"
+# Seconds before trying the Batch API again after the instance answered 404/405 for it
+BATCH_RETRY_INTERVAL = float(os.getenv("SN_BATCH_RETRY_INTERVAL", "3600"))
+# Start a duplicate GET when the first is slower than the endpoint's recent p95
+HEDGE_READS = os.getenv("SN_HEDGE_READS", "true").lower() == "true"
+# Serve user, device and group lookups from a local delta-synced SQLite replica (see replica.py)
+REPLICA_LOOKUPS = os.getenv("SN_REPLICA", "true").lower() == "true"
+# Identical GETs in flight at the same time share one request (see singleflight.py)
+COALESCE_READS = os.getenv("SN_COALESCE_READS", "true").lower() == "true"
+# Largest GET response kept as a last-good fallback for when the instance is down
+STALE_MAX_BYTES = int(os.getenv("SN_STALE_MAX_BYTES", "262144"))
+
+
+def endpoint_name(url):
+    """Table name for Table API URLs, "batch" for the Batch API; keys resilience timeouts and stats."""
+    path = url.split("?", 1)[0]
+    if "/api/now/table/" in path:
+        return path.split("/api/now/table/", 1)[1].split("/", 1)[0]
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def transient_read(error):
+    return isinstance(error, (RetryableError, requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def is_reusable(response):
+    """Whether a response may be served again while the instance is unreachable."""
+    return response.status_code == 200 and len(response.content) <= STALE_MAX_BYTES
+
+
+def transient_write(error):
+    # A write that timed out after connecting may have been applied, so only
+    # retry when the request certainly never reached the instance.
+    return isinstance(error, (RetryableError, requests.ConnectTimeout))
+
+
+_reads = Group("servicenow")
+
+
+class ServiceNowClient:
+    """One pooled, keep-alive connection to the ServiceNow instance.
+
+    Credentials and pool settings are read once. The underlying requests.Session
+    is shared by every caller (and every Streamlit session), so repeated calls
+    reuse warm TCP/TLS connections instead of paying a new handshake each time.
+    """
+
+    def __init__(self, instance=None, username=None, password=None,
+                 pool_size=None, connect_timeout=None, read_timeout=None):
+        self.instance = (instance or os.getenv("SN_INSTANCE") or "").rstrip("/")
+        username = username or os.getenv("SN_USERNAME")
+        password = password or os.getenv("SN_PASSWORD")
+        pool_size = pool_size or int(os.getenv("SN_POOL_SIZE", "20"))
+        self.timeout = (
+            connect_timeout or float(os.getenv("SN_CONNECT_TIMEOUT", "5")),
+            read_timeout or float(os.getenv("SN_READ_TIMEOUT", "30")),
+        )
 
-instance = os.getenv("SN_INSTANCE")
-auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-headers = {"Accept": "application/json"}
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        # pool_block makes extra threads wait for a free connection instead of
+        # opening throwaway ones that are discarded after a single request.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._batch_unavailable_until = 0.0
+
+        self.kb_index = KBIndex()
+        # Cleaned article text, kept per sys_updated_on so each version is cleaned once
+        self.kb_store = CleanedArticleStore(os.getenv("KB_CLEAN_STORE"))
+        self.kb_top_k = int(os.getenv("KB_TOP_K", "10"))
+        self.kb_sync_interval = float(os.getenv("KB_SYNC_INTERVAL", "300"))
+        self._kb_sync_lock = threading.Lock()
+        self._kb_last_sync = None
+        self._kb_unembedded = set()  # changed articles whose embedding failed, retried on the next sync
+
+        # "lexical" (BM25 only), "vector" (embeddings only) or "hybrid" (both, fused)
+        self.kb_retrieval_mode = os.getenv("KB_RETRIEVAL_MODE", "lexical")
+        self.kb_hybrid_alpha = float(os.getenv("KB_HYBRID_ALPHA", "0.5"))
+        self.kb_vectors = None
+        if self.kb_retrieval_mode in ("vector", "hybrid"):
+            self.kb_vectors = VectorIndex(get_embedder(), path=os.getenv("KB_VECTOR_PATH"))
+
+        self.replica = None
+        if REPLICA_LOOKUPS:
+            self.replica = ReferenceReplica(
+                os.getenv("SN_REPLICA_PATH"),
+                sync_interval=float(os.getenv("SN_REPLICA_SYNC_INTERVAL", "300")),
+                full_sync_interval=float(os.getenv("SN_REPLICA_FULL_SYNC_INTERVAL", "86400")),
+            )
+
+    def table_path(self, table, sys_id=None):
+        path = f"/api/now/table/{table}"
+        return f"{path}/{sys_id}" if sys_id else path
+
+    def table_url(self, table, sys_id=None):
+        return self.instance + self.table_path(table, sys_id)
+
+    def request(self, method, url, idempotent=None, hedge=None, **kwargs):
+        """session.request through the resilience layer (see resilience.Backend).
+
+        Retries 429s, 5xxs on reads and transient network errors with backoff,
+        honoring Retry-After; after the last attempt the final response is
+        returned as before. GETs may be hedged and, while the breaker is open,
+        are answered from the last good response for the same URL. An open
+        breaker otherwise raises requests.ConnectionError, so callers' existing
+        RequestException handling applies. Concurrent identical GETs are sent
+        once and share the response.
+        """
+        endpoint = endpoint_name(url)
+        kwargs.setdefault("timeout", backend.timeout(endpoint, self.timeout))
+        idempotent = method in ("GET", "HEAD") if idempotent is None else idempotent
+        hedge = HEDGE_READS and idempotent if hedge is None else hedge
+        stale_key = None
+        if idempotent:
+            stale_key = (method, url, repr(sorted((kwargs.get("params") or {}).items())), repr(kwargs.get("json")))
+
+        def send():
+            response = self.session.request(method, url, **kwargs)
+            code = response.status_code
+            if code in (429, 503) or (idempotent and code >= 500):
+                raise RetryableError(response, parse_retry_after(response.headers.get("Retry-After")))
+            return response
+
+        def call():
+            with span(f"servicenow.{endpoint}", method=method) as current:
+                try:
+                    # A failed write is not retried, but still means the instance didn't answer
+                    response = backend.call(endpoint, send, transient=transient_read if idempotent else transient_write,
+                                            failed=transient_read, hedge=hedge, stale_key=stale_key,
+                                            keep=is_reusable)
+                except CircuitOpenError as e:
+                    raise requests.ConnectionError(str(e))
+                current.set(status=response.status_code)
+                current.payload(len(response.content))
+                return response
+
+        if idempotent and COALESCE_READS:
+            return _reads.do(request_key(method, url, kwargs.get("params"), kwargs.get("json")), call)
+        return call()
+
+    def get_records(self, table, params=None, label=None):
+        """GET a table and return its result list, or None if the call failed."""
+        try:
+            response = self.request("GET", self.table_url(table), params=params)
+        except requests.RequestException as e:
+            log.warning("Error fetching %s: %s", label or table, e)
+            return None
+        if response.status_code == 200:
+            return response.json().get("result", [])
+        if label:
+            log.warning("Error fetching %s: %s %s", label, response.status_code, response.text)
+        return None
+
+    @property
+    def batch_supported(self):
+        """False for BATCH_RETRY_INTERVAL after the instance said it has no Batch API."""
+        return time.monotonic() >= self._batch_unavailable_until
+
+    def batch(self, calls):
+        """Send several Table API calls in one POST to /api/now/v1/batch.
+
+        calls: list of dicts with "method", "table" and optional "sys_id",
+        "params" and "json". Returns one (status_code, parsed body) per call,
+        in order; (None, None) when a call failed or was not serviced. If the
+        instance has no Batch API the calls are sent one by one instead.
+        """
+        if not self.batch_supported:
+            return [self._send(call) for call in calls]
+
+        rest_requests = []
+        for i, call in enumerate(calls):
+            url = self.table_path(call["table"], call.get("sys_id"))
+            if call.get("params"):
+                url += "?" + urlencode(call["params"])
+            item = {
+                "id": str(i),
+                "method": call.get("method", "GET"),
+                "url": url,
+                "headers": [
+                    {"name": "Content-Type", "value": "application/json"},
+                    {"name": "Accept", "value": "application/json"},
+                ],
+            }
+            if call.get("json") is not None:
+                item["body"] = base64.b64encode(json.dumps(call["json"]).encode("utf-8")).decode("ascii")
+            rest_requests.append(item)
+
+        reads_only = all(item["method"] == "GET" for item in rest_requests)
+        try:
+            # An all-GET batch is a read, so it is hedged and its last good response reused like one
+            response = self.request(
+                "POST", f"{self.instance}/api/now/v1/batch", idempotent=reads_only,
+                headers={"Content-Type": "application/json"},
+                json={
+                    # Derived from the content so an identical batch maps to the same fallback entry
+                    "batch_request_id": f"{zlib.crc32(json.dumps(rest_requests).encode('utf-8')):08x}",
+                    "exclude_response_headers": True,
+                    "rest_requests": rest_requests,
+                }
+            )
+        except requests.RequestException as e:
+            log.warning("Error sending batch request: %s", e)
+            return [(None, None)] * len(calls)
+        if response.status_code in (404, 405):
+            log.warning("Batch API unavailable (%s), sending calls individually for %.0fs",
+                        response.status_code, BATCH_RETRY_INTERVAL)
+            self._batch_unavailable_until = time.monotonic() + BATCH_RETRY_INTERVAL
+            return [self._send(call) for call in calls]
+        if response.status_code == 400:
+            # Most likely one malformed sub-request; send these individually but keep batching
+            log.warning("Batch request rejected (400), sending its calls individually: %s", response.text)
+            return [self._send(call) for call in calls]
+        if response.status_code != 200:
+            log.warning("Error sending batch request: %s %s", response.status_code, response.text)
+            return [(None, None)] * len(calls)
+
+        results = [(None, None)] * len(calls)
+        for served in response.json().get("serviced_requests", []):
+            body = base64.b64decode(served["body"]) if served.get("body") else b""
+            results[int(served["id"])] = (served["status_code"], json.loads(body) if body else None)
+        return results
+
+    def _send(self, call):
+        """One batch() call as a plain request."""
+        try:
+            response = self.request(
+                call.get("method", "GET"), self.table_url(call["table"], call.get("sys_id")),
+                params=call.get("params"), json=call.get("json")
+            )
+        except requests.RequestException as e:
+            log.warning("Error calling %s: %s", call["table"], e)
+            return None, None
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    def get_records_batch(self, lookups):
+        """get_records for several (table, params) pairs in one batch request; a list per lookup or None."""
+        results = self.batch([{"method": "GET", "table": table, "params": params} for table, params in lookups])
+        return [
+            (body or {}).get("result", []) if status == 200 else None
+            for status, body in results
+        ]
 
-def get_user_phone_number(user_id):
-    url = f"{instance}/api/now/table/sys_user"
-    params = {
-        "sysparm_query": f"user_name={user_id}",
-        "sysparm_fields": "mobile_phone",
-        "sysparm_limit": 1
-    }
-    response = requests.get(url, auth=auth, headers=headers, params=params)
-    if response.status_code == 200:
-        result = response.json().get("result", [])
+    def local_reference(self):
+        """The reference replica if it is in sync, else None; starts a background delta sync when one is due."""
+        if self.replica is None:
+            return None
+        self.replica.maybe_sync(lambda table_query: self.iter_table(table_query, strict=True))
+        return self.replica if self.replica.ready() else None
+
+    def local_user(self, user_id):
+        """The user's sys_user row from the replica, or None to ask the instance."""
+        replica = self.local_reference()
+        return replica.user(user_id) if replica else None
+
+    def local_user_context(self, user_id):
+        """(users, devices) for build_user_context from the replica, or None to look them up remotely."""
+        replica = self.local_reference()
+        user = replica.user(user_id) if replica else None
+        if user is None:
+            return None
+        # As the display_value lookup returns it: department by name
+        return [dict(user, department=user["department_name"])], replica.devices(user_id)
+
+    def get_user_phone_number(self, user_id):
+        user = self.local_user(user_id)
+        if user is not None:
+            return user["mobile_phone"] or None
+        result = self.get_records(*TableQuery(
+            "sys_user", ("mobile_phone",), Query().eq("user_name", user_id), limit=1
+        ).lookup())
         if result and result[0].get("mobile_phone"):
             return result[0]["mobile_phone"]
-    return None
+        return None
+
+    def reset_user_password(self, user_id):
+        user = self.local_user(user_id)
+        if user is None:
+            results = self.get_records(*TableQuery(
+                "sys_user", ("sys_id",), Query().eq("user_name", user_id), limit=1
+            ).lookup())
+            if not results:
+                return None
+            user = results[0]
+        user_sys_id = user["sys_id"]
 
-def reset_user_password(user_id):
-    url = f"{instance}/api/now/table/sys_user"
-    params = {
-        "sysparm_query": f"user_name={user_id}",
-        "sysparm_limit": 1
-    }
-    response = requests.get(url, auth=auth, headers=headers, params=params)
+        new_password = "TempPass" + os.urandom(4).hex()  # Generate temp password
 
-    if response.status_code == 200:
-        results = response.json().get("result", [])
-        if not results:
+        try:
+            update_response = self.request(
+                "PATCH", self.table_url("sys_user", user_sys_id),
+                json={"password": new_password},
+                headers={"Content-Type": "application/json"}
+            )
+        except requests.RequestException as e:
+            log.warning("Error resetting password: %s", e)
             return None
-        user_sys_id = results[0]["sys_id"]
 
-        new_password = "TempPass" + os.urandom(4).hex()  # Generate temp password
+        if update_response.status_code in (200, 204):
+            return new_password
+        return None
+
+    def iter_table(self, table_query, page_size=None, max_rows=None, strict=False):
+        """Yield the rows a TableQuery selects lazily, one page at a time.
+
+        Follows the Link rel="next" header when the instance sends one and falls
+        back to stepping sysparm_offset until a short page. Stops (after logging)
+        on a failed page, or raises with strict=True.
+        """
+        page_size = page_size or int(os.getenv("SN_PAGE_SIZE", "1000"))
+        params = dict(table_query.params(), sysparm_limit=page_size, sysparm_offset=0)
+        table = table_query.table
+        url, yielded = self.table_url(table), 0
+
+        while True:
+            try:
+                # Bulk pages are slow by nature; duplicating them would only add load
+                response = self.request("GET", url, params=params, hedge=False)
+            except requests.RequestException as e:
+                if strict:
+                    raise
+                log.warning("Error loading %s: %s", table, e)
+                return
+            if response.status_code != 200:
+                if strict:
+                    raise requests.HTTPError(f"Error loading {table}: {response.status_code}", response=response)
+                log.warning("Error loading %s: %s", table, response.status_code)
+                return
+            page = response.json().get("result", [])
+            for row in page:
+                yield row
+                yielded += 1
+                if max_rows and yielded >= max_rows:
+                    return
+            next_link = response.links.get("next", {}).get("url")
+            if next_link and page:
+                # ACLs can filter rows out of a page, so a short page isn't the last one
+                url, params = next_link, None
+            elif params is None or len(page) < page_size:
+                # Following links and none came, or a short page without them
+                return
+            else:
+                params["sysparm_offset"] += page_size
+
+    def load_servicenow_data(self, page_size=None, max_rows=None, max_descriptions=None):
+        """Stream the reference and ticket tables with only the fields we keep.
+
+        Ticket tables are walked to the end so previous_ticket_descriptions covers
+        the whole history, but at most max_rows rows per table are kept in memory.
+        """
+        max_rows = max_rows or int(os.getenv("SN_LOAD_MAX_ROWS", "1000"))
+        descriptions = TicketDescriptions(max_descriptions or int(os.getenv("SN_MAX_TICKET_DESCRIPTIONS", "250000")))
+
+        data = {}
+        replica = self.local_reference()
+        for key, (table, fields, record) in LOAD_TABLES.items():
+            if key == "assignment_groups" and replica is not None:
+                data[key] = [{f: g[f] for f in fields} for g in replica.groups()[:max_rows]]
+                continue
+            tickets = key in ("incidents", "requests")
+            # Reference tables stop at max_rows instead of paging through rows that are dropped
+            rows = self.iter_table(TableQuery(table, fields, Query().order_by("sys_created_on", descending=True)),
+                                   page_size=page_size, max_rows=None if tickets else max_rows)
+            if tickets:
+                rows = descriptions.consume(rows)
+            data[key] = []
+            for row in rows:
+                if len(data[key]) < max_rows:
+                    data[key].append(record.from_row(row) if record else row)
+
+        data["previous_ticket_descriptions"] = descriptions.items()
+        data["previous_tickets"] = descriptions.numbered()
+        return data
+
+    def fetch_kb_articles(self, since=None, page_size=500):
+        """Fetch published KB articles, or every article touched at/after `since`.
+
+        Delta rows include retired/unpublished articles so the index can drop them.
+        Rows come back in sys_updated_on order, so a load cut short by an error
+        is still a clean prefix that the next delta continues from.
+        """
+        query = Query().gte("sys_updated_on", since) if since else Query().eq("active", True).eq("workflow", "published")
+        return list(self.iter_table(TableQuery("kb_knowledge", KB_FIELDS, query.order_by("sys_updated_on")),
+                                    page_size=page_size))
+
+    def sync_kb_index(self, force=False):
+        """Poll kb_knowledge for sys_updated_on deltas and apply them to the local index."""
+        def due():
+            return force or self._kb_last_sync is None or time.monotonic() - self._kb_last_sync >= self.kb_sync_interval
+
+        if not due():
+            return
+        # Only the very first build blocks; a later sync already in progress is not waited on.
+        if not self._kb_sync_lock.acquire(blocking=self._kb_last_sync is None):
+            return
+        try:
+            if not due():
+                return
+            records = self.fetch_kb_articles(since=self.kb_index.last_updated or None)
+            records = ingest_records(records, self.kb_store)
+            changed, removed = self.kb_index.apply_changes(records)
+            if changed or removed:
+                # Cached answers built on an older version of these articles are dropped
+                current = {n: self.kb_index.articles[n]["sys_updated_on"] for n in changed}
+                current.update((n, None) for n in removed)
+                answer_cache.invalidate_articles(current)
+            if self.kb_vectors is not None:
+                self.sync_kb_vectors(changed, removed)
+            self._kb_last_sync = time.monotonic()
+        finally:
+            self._kb_sync_lock.release()
+
+    def sync_kb_vectors(self, changed, removed):
+        """Re-embed changed articles and drop removed ones from the vector index.
+
+        The delta has already moved past these articles, so ones that fail to
+        embed are kept in _kb_unembedded and tried again on the next sync.
+        """
+        articles = self.kb_index.articles
+        pending = [n for n in self._kb_unembedded | set(changed) if n in articles]
+        if not pending and not removed:
+            return
+        self.kb_vectors.remove(removed)
+        try:
+            # Only articles whose sys_updated_on moved are re-embedded.
+            embedded = self.kb_vectors.update([articles[n] for n in pending])
+        except Exception as e:
+            log.warning("Error embedding %d KB articles, retrying on the next sync: %s", len(pending), e)
+            self._kb_unembedded = set(pending)
+            embedded = []
+        else:
+            self._kb_unembedded = set()
+        if embedded or removed:
+            self.kb_vectors.save()
+
+    def search_kb_remote(self, query=None):
+        """LIKE search on the instance; used only when the local index is unavailable."""
+        def published():
+            return Query().eq("active", True).eq("workflow", "published")
+
+        def fetch_articles(query):
+            result = self.get_records(*TableQuery(
+                "kb_knowledge", ("number", "short_description", "text", "sys_updated_on"), query, limit=50
+            ).lookup())
+            return [Article.from_row(a) for a in ingest_records(result or [], self.kb_store) if a.get("text")]
+
+        if not query:
+            return fetch_articles(published())
+
+        # Step 1: Try full-text query
+        articles = fetch_articles(published().like("short_description", query).or_().like("text", query))
+        if articles:
+            return articles
+
+        # Step 2: Try breaking into keywords
+        keywords = [word.strip() for word in query.split() if word.strip()]
+        if not keywords:
+            return []
+
+        keyword_query = published().like("text", keywords[0])
+        for kw in keywords[1:]:
+            keyword_query.or_().like("text", kw)
+        return fetch_articles(keyword_query)
+
+    def query_kb_articles(self, query=None, permissions=None):
+        self.sync_kb_index()
+        if not len(self.kb_index):
+            return self.search_kb_remote(query)
+
+        if not query:
+            return list(self.kb_index.articles.values())[:self.kb_top_k]
+
+        k = self.kb_top_k
+        ranked = None
+        if self.kb_vectors is not None:
+            try:
+                if self.kb_retrieval_mode == "vector":
+                    ranked = self.kb_vectors.search(query, k=k)
+                else:
+                    # Over-fetch from both sides so fusion can promote items either one ranked lower.
+                    lexical = {article["number"]: score for score, article in self.kb_index.search(query, k=k * 3)}
+                    vector = {number: score for score, number in self.kb_vectors.search(query, k=k * 3)}
+                    ranked = fuse_scores(lexical, vector, alpha=self.kb_hybrid_alpha)[:k]
+            except Exception as e:
+                # The query couldn't be embedded; BM25 still answers
+                log.warning("Vector KB search failed, using lexical search: %s", e)
+        if ranked is None:
+            ranked = [(score, article["number"]) for score, article in self.kb_index.search(query, k=k)]
+
+        articles = self.kb_index.articles
+        return [
+            replace(articles[number], score=round(score, 4))
+            for score, number in ranked if score > 0 and number in articles
+        ]
 
-        update_url = f"{instance}/api/now/table/sys_user/{user_sys_id}"
+    def open_ticket(self, user_id, short_description, description, category="request", subcategory="software",
+                    assignment_group="IT Support", ticket_type="incident"):
         payload = {
-            "password": new_password
+            "caller_id": user_id,
+            "short_description": short_description,
+            "description": description,
+            "category": category,
+            "subcategory": subcategory,
+            "assignment_group": assignment_group,
+            "impact": "3",
+            "urgency": "3",
+            "priority": "4"
         }
-        update_response = requests.patch(update_url, json=payload, auth=auth, headers={"Content-Type": "application/json"})
 
-        if update_response.status_code in (200, 204):
-            return new_password
-    return None
+        try:
+            response = self.request(
+                "POST", self.table_url(ticket_type),
+                headers={"Content-Type": "application/json"}, json=payload
+            )
+        except requests.RequestException as e:
+            return {
+                "result": "Error",
+                "type": ticket_type,
+                "link": "",
+                "summary": f"Failed to create {ticket_type}: {e}"
+            }
 
-def load_servicenow_data():
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
-
-    endpoints = {
-        "assignment_groups": "sys_user_group",
-        "knowledge_articles": "kb_knowledge",
-        "users": "sys_user",
-        "incidents": "incident",
-        "requests": "sc_request"
-    }
+        if response.status_code == 201:
+            result = response.json()["result"]
+            number = (
+                result.get("number") or
+                result.get("request_number") or
+                result.get("task_number") or
+                result.get("u_number") or
+                "UNKNOWN"
+            )
+            sys_id = result.get("sys_id", "")
+            link = f"{self.instance}/nav_to.do?uri={ticket_type}.do?sys_id={sys_id}"
+            return {
+                "result": number,
+                "type": ticket_type,
+                "link": link,
+                "summary": f"{ticket_type.capitalize()} {number} created for {short_description}"
+            }
 
-    data = {}
+        return {
+            "result": "Error",
+            "type": ticket_type,
+            "link": "",
+            "summary": f"Failed to create {ticket_type}: {response.text}"
+        }
 
-    for key, table in endpoints.items():
-        url = f"{instance}/api/now/table/{table}?sysparm_limit=100"
-        response = requests.get(url, auth=auth, headers=headers)
-        if response.status_code == 200:
-            data[key] = response.json().get("result", [])
-        else:
-            data[key] = []
-            print(f"Error loading {key}: {response.status_code}")
+    def get_user_context(self, user_id, local=None):
+        """The user's profile, devices and tickets, one GET after another.
 
-    # Build searchable summaries for tickets
-    data["previous_ticket_descriptions"] = []
-    for item in data.get("incidents", []) + data.get("requests", []):
-        desc = item.get("short_description", "")
-        if desc:
-            data["previous_ticket_descriptions"].append(desc.strip())
+        local: (users, devices) from local_user_context(); only the ticket lookups are sent then.
+        """
+        lookups = user_context_lookups(user_id, tickets_only=local is not None)
+        return build_user_context(*(local or ()), *(self.get_records(table, params) for table, params in lookups))
 
-    return data
+    def get_user_context_batch(self, user_id, local=None):
+        """get_user_context in a single round trip, via the Batch API."""
+        lookups = user_context_lookups(user_id, tickets_only=local is not None)
+        return build_user_context(*(local or ()), *self.get_records_batch(lookups))
 
-def query_kb_articles(query=None, permissions=None):
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
-
-    def fetch_articles(query_string):
-        url = f"{instance}/api/now/table/kb_knowledge"
-        params = {
-            "sysparm_query": f"active=true^workflow=published^{query_string}",
-            "sysparm_fields": "number,short_description,text",
-            "sysparm_limit": 50
-        }
-        response = requests.get(url, auth=auth, headers=headers, params=params)
-        if response.status_code == 200:
-            return [
-                {
-                    "title": a.get("short_description", "Untitled"),
-                    "content": a.get("text", ""),
-                    "number": a.get("number", "")
-                }
-                for a in response.json().get("result", []) if a.get("text")
-            ]
-        return []
+    def get_open_work(self, kind, user_id):
+        """The user's open rows of one OPEN_WORK kind; raises LookupFailed([]) if the query failed."""
+        table, params, label, format_row = open_work_query(kind, user_id)
+        rows = self.get_records(table, params, label=label)
+        if rows is None:
+            raise LookupFailed([])
+        return [format_row(r) for r in rows]
 
-    if not query:
-        return fetch_articles("")
+    def get_user_open_incidents(self, user_id):
+        return self.get_open_work("incidents", user_id)
 
-    # Step 1: Try full-text query
-    full_query = f"short_descriptionLIKE{query}^ORtextLIKE{query}"
-    articles = fetch_articles(full_query)
-    if articles:
-        return articles
+    def get_user_open_tasks(self, user_id):
+        return self.get_open_work("tasks", user_id)
 
-    # Step 2: Try breaking into keywords
-    keywords = [word.strip() for word in query.split() if word.strip()]
-    if not keywords:
-        return []
+    def get_user_open_requests(self, user_id):
+        return self.get_open_work("requests", user_id)
 
-    keyword_query = "^OR".join([f"textLIKE{kw}" for kw in keywords])
-    return fetch_articles(keyword_query)
 
-def open_ticket(user_id, short_description, description, category="request", subcategory="software",
-                assignment_group="IT Support", ticket_type="incident"):
-    instance = os.getenv("SN_INSTANCE")
-    user = os.getenv("SN_USERNAME")
-    password = os.getenv("SN_PASSWORD")
-
-    url = f"{instance}/api/now/table/{ticket_type}"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    payload = {
-        "caller_id": user_id,
-        "short_description": short_description,
-        "description": description,
-        "category": category,
-        "subcategory": subcategory,
-        "assignment_group": assignment_group,
-        "impact": "3",
-        "urgency": "3",
-        "priority": "4"
-    }
+class TicketDescriptions:
+    """Bounded, de-duplicated collector for previous_ticket_descriptions.
 
-    response = requests.post(url, auth=HTTPBasicAuth(user, password), headers=headers, json=payload)
+    Rows pass through consume() untouched while their short descriptions are
+    recorded, so the ticket tables are read in a single streaming pass.
+    """
 
-    if response.status_code == 201:
-        result = response.json()["result"]
-        number = (
-            result.get("number") or
-            result.get("request_number") or
-            result.get("task_number") or
-            result.get("u_number") or
-            "UNKNOWN"
-        )
-        sys_id = result.get("sys_id", "")
-        link = f"{instance}/nav_to.do?uri={ticket_type}.do?sys_id={sys_id}"
-        return {
-            "result": number,
-            "type": ticket_type,
-            "link": link,
-            "summary": f"{ticket_type.capitalize()} {number} created for {short_description}"
-        }
+    def __init__(self, limit):
+        self.limit = limit
+        self._seen = {}  # description -> number of its most recent ticket, insertion-ordered
 
-    return {
-        "result": "Error",
-        "type": ticket_type,
-        "link": "",
-        "summary": f"Failed to create {ticket_type}: {response.text}"
-    }
+    def add(self, desc, number=None):
+        desc = (desc or "").strip()
+        if desc and len(self._seen) < self.limit:
+            self._seen.setdefault(desc, number)
 
-def close_ticket(user_id):
-    return {"result": f"Ticket closed for {user_id}."}
+    def consume(self, rows):
+        for row in rows:
+            self.add(row.get("short_description"), row.get("number"))
+            yield row
 
-def get_user_context(user_id):
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
+    def items(self):
+        return list(self._seen)
 
-    context = {}
+    def numbered(self):
+        """(ticket number, description) pairs, for the duplicate ticket index."""
+        return [(number, desc) for desc, number in self._seen.items() if number]
 
-    # Get user profile
-    user_url = f"{instance}/api/now/table/sys_user?sysparm_query=user_name={user_id}"
-    r = requests.get(user_url, auth=auth, headers=headers)
-    if r.status_code == 200 and r.json().get("result"):
-        user = r.json()["result"][0]
-        context["user"] = {
-            "name": user.get("name"),
-            "email": user.get("email"),
-            "title": user.get("title"),
-            "department": user.get("department", {}).get("display_value", ""),
-            "sys_id": user.get("sys_id")
-        }
 
-    # Get devices owned by the user
-    asset_url = f"{instance}/api/now/table/cmdb_ci_computer?sysparm_query=assigned_to={context['user']['sys_id']}"
-    r = requests.get(asset_url, auth=auth, headers=headers)
-    if r.status_code == 200:
-        context["devices"] = [a["name"] for a in r.json().get("result", [])]
+def user_context_lookups(user_id, tickets_only=False):
+    """(table, params) for the user, their devices and their incidents and requests.
 
-    # Get user's open incidents and requests
-    incidents_url = f"{instance}/api/now/table/incident?sysparm_query=caller_id={context['user']['sys_id']}"
-    requests_url = f"{instance}/api/now/table/sc_request?sysparm_query=requested_for={context['user']['sys_id']}"
-    context["open_tickets"] = []
+    Dot-walking on user_name removes the dependency on the user's sys_id, so
+    all four can be sent at once (concurrently or in one batch). tickets_only
+    leaves out the user and device lookups, for when the replica answered them.
+    """
+    lookups = [
+        # Display values, so department arrives as its name rather than a sys_id
+        TableQuery("sys_user", USER_FIELDS, Query().eq("user_name", user_id), limit=1, display_value=True).lookup(),
+        TableQuery("cmdb_ci_computer", DEVICE_FIELDS, Query().eq("assigned_to.user_name", user_id)).lookup(),
+        TableQuery("incident", TICKET_FIELDS, Query().eq("caller_id.user_name", user_id)).lookup(),
+        TableQuery("sc_request", TICKET_FIELDS, Query().eq("requested_for.user_name", user_id)).lookup(),
+    ]
+    return lookups[2:] if tickets_only else lookups
 
-    for url in [incidents_url, requests_url]:
-        r = requests.get(url, auth=auth, headers=headers)
-        if r.status_code == 200:
-            context["open_tickets"].extend(r.json().get("result", []))
 
+def build_user_context(users, devices, incidents, requests_list):
+    """Context dict from the user_context_lookups results (None for a failed lookup).
+
+    Raises LookupFailed with the partial context if any lookup failed.
+    """
+    context = {}
+    if users:
+        context["user"] = User.from_row(users[0])
+    if devices is not None:
+        context["devices"] = [a["name"] for a in devices]
+    context["open_tickets"] = [Ticket.from_row(t) for t in (incidents or []) + (requests_list or [])]
+    if any(result is None for result in (users, devices, incidents, requests_list)):
+        raise LookupFailed(context)
     return context
 
-def get_user_open_incidents(user_id):
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
-
-    # Build query: incidents assigned to the user and not resolved/closed
-    query = f"assigned_to.user_name={user_id}^stateNOT IN6,7"  # 6 = Resolved, 7 = Closed
-
-    url = f"{instance}/api/now/table/incident"
-    params = {
-        "sysparm_query": query,
-        "sysparm_fields": "number,short_description,opened_at,caller_id",
-        "sysparm_limit": 20
+
+def _format_incident(inc):
+    return {
+        "number": inc.get("number"),
+        "short_description": inc.get("short_description", ""),
+        "opened_at": inc.get("opened_at", ""),
+        "caller": display_text(inc.get("caller_id"))
     }
 
-    response = requests.get(url, auth=auth, headers=headers, params=params)
-    if response.status_code == 200:
-        incidents = response.json().get("result", [])
-        return [
-            {
-                "number": inc.get("number"),
-                "short_description": inc.get("short_description", ""),
-                "opened_at": inc.get("opened_at", ""),
-                "caller": inc.get("caller_id", {}).get("display_value", "")
-            }
-            for inc in incidents
-        ]
-    else:
-        print("Error fetching incidents:", response.status_code, response.text)
-        return []
 
-def get_user_open_tasks(user_id):
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
-
-    query = f"assigned_to.user_name={user_id}^stateNOT IN3"  # 3 = Closed
-    url = f"{instance}/api/now/table/sc_task"
-    params = {
-        "sysparm_query": query,
-        "sysparm_fields": "number,short_description,opened_at,assigned_to",
-        "sysparm_limit": 20
+def _format_task(task):
+    return {
+        "number": task.get("number"),
+        "short_description": task.get("short_description", ""),
+        "opened_at": task.get("opened_at", ""),
+        "assigned_to": display_text(task.get("assigned_to"))
     }
 
-    response = requests.get(url, auth=auth, headers=headers, params=params)
-    if response.status_code == 200:
-        tasks = response.json().get("result", [])
-        return [
-            {
-                "number": task.get("number"),
-                "short_description": task.get("short_description", ""),
-                "opened_at": task.get("opened_at", ""),
-                "assigned_to": task.get("assigned_to", {}).get("display_value", "")
-            }
-            for task in tasks
-        ]
-    else:
-        print("Error fetching tasks:", response.status_code, response.text)
-        return []
 
-def get_user_open_requests(user_id):
-    instance = os.getenv("SN_INSTANCE")
-    auth = (os.getenv("SN_USERNAME"), os.getenv("SN_PASSWORD"))
-    headers = {"Accept": "application/json"}
-
-    query = f"requested_for.user_name={user_id}^stateNOT IN3"  # 3 = Closed
-    url = f"{instance}/api/now/table/sc_request"
-    params = {
-        "sysparm_query": query,
-        "sysparm_fields": "number,short_description,requested_for,opened_at",
-        "sysparm_limit": 20
+def _format_request(r):
+    return {
+        "number": r.get("number"),
+        "short_description": r.get("short_description", ""),
+        "opened_at": r.get("opened_at", ""),
+        "requested_for": display_text(r.get("requested_for"))
     }
 
-    response = requests.get(url, auth=auth, headers=headers, params=params)
-    if response.status_code == 200:
-        requests_list = response.json().get("result", [])
-        return [
-            {
-                "number": r.get("number"),
-                "short_description": r.get("short_description", ""),
-                "opened_at": r.get("opened_at", ""),
-                "requested_for": r.get("requested_for", {}).get("display_value", "")
-            }
-            for r in requests_list
-        ]
-    else:
-        print("Error fetching requests:", response.status_code, response.text)
-        return []
+
+# kind -> (table, user field, closed states, fields, row formatter); shared by the sync and async clients
+OPEN_WORK = {
+    # 6 = Resolved, 7 = Closed
+    "incidents": ("incident", "assigned_to", (6, 7),
+                  ("number", "short_description", "opened_at", "caller_id"), _format_incident),
+    # 3 = Closed
+    "tasks": ("sc_task", "assigned_to", (3,),
+              ("number", "short_description", "opened_at", "assigned_to"), _format_task),
+    "requests": ("sc_request", "requested_for", (3,),
+                 ("number", "short_description", "requested_for", "opened_at"), _format_request),
+}
+
+
+def open_work_query(kind, user_id):
+    """Return (table, params, label, formatter) for one of the OPEN_WORK lookups."""
+    table, user_field, closed, fields, format_row = OPEN_WORK[kind]
+    query = Query().eq(f"{user_field}.user_name", user_id).not_in("state", closed)
+    # Display values: the formatters show the caller/assignee by name
+    params = TableQuery(table, fields, query, limit=20, display_value=True).params()
+    return table, params, kind, format_row
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide ServiceNowClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ServiceNowClient()
+    return _client
+
+
+@user_cache.cached
+def get_user_phone_number(user_id):
+    return get_client().get_user_phone_number(user_id)
+
+def reset_user_password(user_id):
+    return get_client().reset_user_password(user_id)
+
+def load_servicenow_data():
+    return get_client().load_servicenow_data()
+
+def replica_stats():
+    replica = get_client().replica
+    return replica.stats() if replica else None
+
+def query_kb_articles(query=None, permissions=None):
+    return get_client().query_kb_articles(query=query, permissions=permissions)
+
+def open_ticket(user_id, short_description, description, category="request", subcategory="software",
+                assignment_group="IT Support", ticket_type="incident"):
+    ticket = get_client().open_ticket(user_id, short_description, description, category=category,
+                                      subcategory=subcategory, assignment_group=assignment_group,
+                                      ticket_type=ticket_type)
+    # The user's cached context and open-work lists no longer reflect the instance
+    user_cache.invalidate_user(user_id)
+    return ticket
+
+def close_ticket(user_id):
+    return {"result": f"Ticket closed for {user_id}."}
+
+@user_cache.cached
+def get_user_context(user_id):
+    client = get_client()
+    # With the replica in sync only the ticket lookups go to the instance
+    local = client.local_user_context(user_id)
+    if BATCH_LOOKUPS and client.batch_supported:
+        return client.get_user_context_batch(user_id, local)
+    if CONCURRENT_LOOKUPS:
+        from servicenow_async import run, get_async_client
+        return run(get_async_client().get_user_context(user_id, local))
+    return client.get_user_context(user_id, local)
+
+@user_cache.cached
+def get_user_open_incidents(user_id):
+    return get_client().get_user_open_incidents(user_id)
+
+@user_cache.cached
+def get_user_open_tasks(user_id):
+    return get_client().get_user_open_tasks(user_id)
+
+@user_cache.cached
+def get_user_open_requests(user_id):
+    return get_client().get_user_open_requests(user_id)
+
+@user_cache.cached
+def get_user_open_work(user_id):
+    """Open incidents, tasks and requests for the user, fetched concurrently."""
+    from servicenow_async import run, get_async_client
+    return run(get_async_client().get_user_open_work(user_id))
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import threading
+import httpx
+from dotenv import load_dotenv
+from servicenow_api import OPEN_WORK, HEDGE_READS, COALESCE_READS, is_reusable, open_work_query, user_context_lookups, build_user_context
+from resilience import servicenow as backend, CircuitOpenError, RetryableError, parse_retry_after
+from telemetry import bind, span
+from singleflight import AsyncGroup, request_key
+from user_cache import LookupFailed
+
+load_dotenv()
+log = logging.getLogger(__name__)
+
+
+def _timeout(seconds):
+    """httpx timeout from a resilience (connect, read) pair; the client default when None."""
+    if seconds is None:
+        return httpx.USE_CLIENT_DEFAULT
+    connect, read = seconds if isinstance(seconds, tuple) else (seconds, seconds)
+    return httpx.Timeout(read, connect=connect)
+
+
+class AsyncServiceNowClient:
+    """Async mirror of ServiceNowClient's read lookups on a pooled httpx.AsyncClient.
+
+    Lookups that do not depend on each other are issued together with
+    asyncio.gather, so a login or "my open work" costs about one round-trip.
+    Concurrent identical GETs are sent once and share the response.
+    """
+
+    def __init__(self, instance=None, username=None, password=None,
+                 pool_size=None, connect_timeout=None, read_timeout=None):
+        self.instance = (instance or os.getenv("SN_INSTANCE") or "").rstrip("/")
+        pool_size = pool_size or int(os.getenv("SN_POOL_SIZE", "20"))
+        self.client = httpx.AsyncClient(
+            auth=(username or os.getenv("SN_USERNAME"), password or os.getenv("SN_PASSWORD")),
+            headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(
+                read_timeout or float(os.getenv("SN_READ_TIMEOUT", "30")),
+                connect=connect_timeout or float(os.getenv("SN_CONNECT_TIMEOUT", "5")),
+            ),
+        )
+        self.reads = AsyncGroup("servicenow_async")
+
+    def table_url(self, table):
+        return f"{self.instance}/api/now/table/{table}"
+
+    async def get_records(self, table, params=None, label=None):
+        """GET a table and return its result list, or None if the call failed.
+
+        Goes through the same retry/hedging/breaker policy as ServiceNowClient.
+        """
+        async def send():
+            response = await self.client.get(self.table_url(table), params=params,
+                                             timeout=_timeout(backend.timeout(table)))
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableError(response, parse_retry_after(response.headers.get("Retry-After")))
+            return response
+
+        async def call():
+            with span(f"servicenow.{table}", method="GET") as current:
+                response = await backend.acall(
+                    table, send, transient=lambda e: isinstance(e, (RetryableError, httpx.TransportError)),
+                    hedge=HEDGE_READS, keep=is_reusable,
+                    # Same key as ServiceNowClient.request, so either client can fall back on the other's response
+                    stale_key=("GET", self.table_url(table), repr(sorted((params or {}).items())), repr(None))
+                )
+                current.set(status=response.status_code)
+                current.payload(len(response.content))
+                return response
+
+        try:
+            if COALESCE_READS:
+                response = await self.reads.do(request_key("GET", self.table_url(table), params, None), call)
+            else:
+                response = await call()
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            log.warning("Error fetching %s: %s", label or table, e)
+            return None
+        if response.status_code == 200:
+            return response.json().get("result", [])
+        if label:
+            log.warning("Error fetching %s: %s %s", label, response.status_code, response.text)
+        return None
+
+    async def get_user_context(self, user_id, local=None):
+        """See ServiceNowClient.get_user_context; the lookups are sent concurrently."""
+        results = await asyncio.gather(*(
+            self.get_records(table, params)
+            for table, params in user_context_lookups(user_id, tickets_only=local is not None)
+        ))
+        return build_user_context(*(local or ()), *results)
+
+    async def get_open_work(self, kind, user_id):
+        """See ServiceNowClient.get_open_work."""
+        table, params, label, format_row = open_work_query(kind, user_id)
+        rows = await self.get_records(table, params, label=label)
+        if rows is None:
+            raise LookupFailed([])
+        return [format_row(r) for r in rows]
+
+    async def get_user_open_incidents(self, user_id):
+        return await self.get_open_work("incidents", user_id)
+
+    async def get_user_open_tasks(self, user_id):
+        return await self.get_open_work("tasks", user_id)
+
+    async def get_user_open_requests(self, user_id):
+        return await self.get_open_work("requests", user_id)
+
+    async def get_user_open_work(self, user_id):
+        """{"incidents": [...], "tasks": [...], "requests": [...]} in one concurrent batch."""
+        kinds = list(OPEN_WORK)
+        results = await asyncio.gather(*(self.get_open_work(kind, user_id) for kind in kinds),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, LookupFailed):
+                raise result
+        work = {kind: result.fallback if isinstance(result, LookupFailed) else result
+                for kind, result in zip(kinds, results)}
+        # The kinds that were found are still returned, but not cached
+        if any(isinstance(result, LookupFailed) for result in results):
+            raise LookupFailed(work)
+        return work
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_loop = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _get_loop():
+    # One long-lived loop in a daemon thread owns the AsyncClient, so its
+    # connection pool survives across calls from Streamlit's script threads.
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="servicenow-async", daemon=True).start()
+    return _loop
+
+
+def get_async_client():
+    """Return the process-wide AsyncServiceNowClient, creating it on first use."""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncServiceNowClient()
+    return _async_client
+
+
+def run(coro):
+    """Run a coroutine on the shared background loop and block for its result.
+
+    The coroutine records its spans into the caller's trace.
+    """
+    return asyncio.run_coroutine_threadsafe(bind(coro), _get_loop()).result()
@@ -0,0 +1,129 @@
+"""Coalesce identical concurrent calls ("singleflight").
+
+    flights = Group("servicenow")
+    response = flights.do(request_key("GET", url, params), lambda: session.get(url, params=params))
+
+The first caller for a key runs the call; callers arriving with the same key
+while it is in flight wait for it and get the same result (or exception)
+instead of making their own. Nothing is cached: once the call returns, the
+next caller starts a new one. AsyncGroup does the same for coroutines on one
+event loop. Results are shared between callers, so they must be treated as
+read-only.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from telemetry import registry, span
+
+COALESCED = registry.counter("sngpt_singleflight_calls_total",
+                             "Calls through a singleflight group; role is leader (ran it) or shared (waited).",
+                             ("group", "role"))
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_key(*parts):
+    """Hash of the parts with whitespace in strings collapsed and dict keys sorted."""
+    encoded = json.dumps(_normalize(parts), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """fn() once per key at a time; concurrent callers with the key share its outcome."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        COALESCED.inc(group=self.name, role="leader" if leader else "shared")
+
+        if not leader:
+            with span(f"singleflight.{self.name}"):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self.calls)}
+
+
+class AsyncGroup:
+    """Group for coroutines; use from a single event loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """await fn() once per key at a time; concurrent callers with the key share its outcome."""
+        future = self.calls.get(key)
+        if future is not None:
+            self.shared += 1
+            COALESCED.inc(group=self.name, role="shared")
+            with span(f"singleflight.{self.name}"):
+                # shield: one waiter being cancelled must not cancel the call for the others
+                return await asyncio.shield(future)
+
+        self.leaders += 1
+        COALESCED.inc(group=self.name, role="leader")
+        future = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # marks it retrieved when nobody was waiting
+            raise
+        finally:
+            del self.calls[key]
+
+    def stats(self):
+        return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self.calls)}
@@ -0,0 +1,337 @@
+"""Spans, Prometheus-style metrics and structured logs.
+
+Wrap a unit of work in `with span("stage") as s:` to time it; s.set(...)
+attaches attributes (status, bytes, tokens). Every span feeds the
+sngpt_span_seconds histogram. Spans opened under `with trace("request"):`
+are also collected into that trace, whose waterfall() gives the per-stage
+timeline of one request. Each finished trace is logged as one JSON line.
+registry.render() returns every metric in the Prometheus text format.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('{}="{}"'.format(n, str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value:g}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    out.append((f"{self.name}_bucket", _labels(self.labelnames + ("le",), key + (f"{bound:g}",)), count))
+                out.append((f"{self.name}_bucket", _labels(self.labelnames + ("le",), key + ("+Inf",)), entry["count"]))
+                out.append((f"{self.name}_sum", _labels(self.labelnames, key), entry["sum"]))
+                out.append((f"{self.name}_count", _labels(self.labelnames, key), entry["count"]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+registry = Registry()
+SPAN_SECONDS = registry.histogram("sngpt_span_seconds", "Duration of pipeline stages and remote calls.", ("span",))
+SPAN_ERRORS = registry.counter("sngpt_span_errors_total", "Spans that ended with an exception.", ("span",))
+PAYLOAD_BYTES = registry.counter("sngpt_payload_bytes_total", "Response bytes received by remote calls.", ("span",))
+LLM_TOKENS = registry.counter("sngpt_llm_tokens_total", "OpenAI tokens used, by call site.", ("endpoint", "kind"))
+CACHE_LOOKUPS = registry.counter("sngpt_cache_lookups_total", "Cache lookups by cache and result.",
+                                 ("cache", "result"))
+
+_current_trace = contextvars.ContextVar("sngpt_trace", default=None)
+_current_span = contextvars.ContextVar("sngpt_span", default=None)
+
+
+class Span:
+    def __init__(self, name, attrs, depth):
+        self.name = name
+        self.attrs = attrs
+        self.depth = depth
+        self.start = 0.0
+        self.duration = 0.0
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def payload(self, nbytes):
+        """Record the size of a response body on this span and in sngpt_payload_bytes_total."""
+        self.attrs["bytes"] = nbytes
+        PAYLOAD_BYTES.inc(nbytes, span=self.name)
+
+    def tokens(self, endpoint, usage):
+        """Record an OpenAI usage object on this span and in sngpt_llm_tokens_total."""
+        if usage is None:
+            return
+        prompt, completion = getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+        self.attrs.update(prompt_tokens=prompt, completion_tokens=completion)
+        LLM_TOKENS.inc(prompt, endpoint=endpoint, kind="prompt")
+        LLM_TOKENS.inc(completion, endpoint=endpoint, kind="completion")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start_ms": round(self.start * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1),
+            "depth": self.depth,
+            "error": self.error,
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class Trace:
+    """The spans recorded while handling one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def waterfall(self):
+        """Spans as dicts ordered by start time; start_ms is relative to the start of the trace."""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: (s.start, s.depth))
+        return [s.to_dict() for s in spans]
+
+
+def _reset(var, token):
+    # A generator closed from another context (e.g. garbage collected on another thread) can't reset
+    try:
+        var.reset(token)
+    except ValueError:
+        pass
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as one span; yields the Span so attributes can be added."""
+    parent = _current_span.get()
+    current = Span(name, attrs, parent.depth + 1 if parent else 0)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            current.error = type(e).__name__
+            SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        _reset(_current_span, token)
+        current.duration = time.perf_counter() - started
+        SPAN_SECONDS.observe(current.duration, span=name)
+        active = _current_trace.get()
+        if active is not None:
+            current.start = started - active.started
+            active.add(current)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("span", extra={"event": {"trace": active.name if active else None, **current.to_dict()}})
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Collect the spans of one request, with the block itself as the root span.
+
+    Inside an active trace this is just a span of that trace. Yields the Trace.
+    """
+    active = _current_trace.get()
+    if active is not None:
+        with span(name, **attrs):
+            yield active
+        return
+
+    current = Trace(name)
+    token = _current_trace.set(current)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, **attrs):
+            yield current
+    finally:
+        _reset(_current_span, span_token)
+        _reset(_current_trace, token)
+        global last_trace
+        last_trace = current
+        log.info("trace", extra={"event": {"trace": name, "spans": current.waterfall()}})
+
+
+# Most recently finished trace in this process, for debugging
+last_trace = None
+
+
+def current_span():
+    return _current_span.get()
+
+
+def in_context(fn):
+    """fn bound to the caller's current trace and span, for handing to a thread pool."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def bind(coro):
+    """Wrap coro so it records into the caller's trace when run on another thread's event loop."""
+    active, parent = _current_trace.get(), _current_span.get()
+
+    async def bound():
+        _current_trace.set(active)
+        _current_span.set(parent)
+        return await coro
+
+    return bound()
+
+
+def count_cache(cache, result):
+    CACHE_LOOKUPS.inc(cache=cache, result=result)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, plus any `event` passed via extra."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "event", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """Root logging from SNGPT_LOG_LEVEL (INFO) and SNGPT_LOG_FORMAT ("json" or "text")."""
+    level = level or os.getenv("SNGPT_LOG_LEVEL", "INFO")
+    fmt = fmt or os.getenv("SNGPT_LOG_FORMAT", "json")
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    # Every request is already a span; httpx would log each one again at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host="0.0.0.0"):
+    """Serve registry.render() on every path from a background thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
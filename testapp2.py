@@ -1,6 +1,7 @@
 import streamlit as st
 from servicenow_api import query_kb_articles, load_servicenow_data, get_user_context
 from gpt_agent import generate_response, create_ticket_from_intent
+from conversation import IssueLog
 
 # Page config
 st.set_page_config(page_title="IT Assistant", layout="centered")
@@ -10,7 +11,7 @@ st.title("💼 IT Support Assistant")
 defaults = {
     "page_state": "login",
     "chat_history": [],
-    "issue_log": {},
+    "issue_log": IssueLog(),
     "pending_ticket": False,
     "last_question": "",
     "ticket_metadata": None,
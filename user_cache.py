@@ -0,0 +1,79 @@
+import functools
+import os
+import threading
+from cachetools import TTLCache
+from telemetry import count_cache
+
+
+class LookupFailed(Exception):
+    """Raised by a cached lookup to return fallback without caching it."""
+
+    def __init__(self, fallback):
+        super().__init__("lookup failed")
+        self.fallback = fallback
+
+
+class UserCache:
+    """Bounded LRU cache with TTL for per-user lookups.
+
+    Keys start with the user_id so every entry for a user can be dropped at once
+    after a write on that user's behalf (write-through invalidation).
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, fn):
+        """Decorate fn(user_id, ...) so results are cached per user and arguments.
+
+        fn raises LookupFailed(fallback) when a lookup behind it failed; the
+        fallback is returned to the caller but not cached, so the next call
+        asks again instead of serving it for the whole TTL.
+        """
+        @functools.wraps(fn)
+        def wrapper(user_id, *args, **kwargs):
+            key = (user_id, fn.__name__, args, tuple(sorted(kwargs.items())))
+            with self.lock:
+                if key in self.cache:
+                    self.hits += 1
+                    count_cache("user", "hit")
+                    return self.cache[key]
+                self.misses += 1
+            count_cache("user", "miss")
+            try:
+                value = fn(user_id, *args, **kwargs)
+            except LookupFailed as e:
+                return e.fallback
+            if value is not None:
+                with self.lock:
+                    self.cache[key] = value
+            return value
+        return wrapper
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [k for k in self.cache.keys() if k[0] == user_id]:
+                self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.cache),
+            }
+
+
+user_cache = UserCache(
+    maxsize=int(os.getenv("SN_USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SN_USER_CACHE_TTL", "60"))
+)